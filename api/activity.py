@@ -0,0 +1,62 @@
+"""
+用户活跃记录（延迟写入）
+
+玩家的每个操作都要更新 users.username / last_active，逐次写库会让每个请求都产生一次写事务。
+这里在内存中：
+- 记住已确认存在于数据库中的用户（known），这些用户不再需要 INSERT / SELECT
+- 把用户名和活跃时间的更新按用户合并，由后台任务每隔几秒一次性写回（take → save → 失败时 restore）
+新用户的注册（插入 users 并发放初始余额）仍在写命令中同步完成，只发放一次。
+"""
+import sqlite3
+import threading
+from datetime import datetime
+
+
+class UserActivity:
+    """已知用户集合 + 待写回的用户名/活跃时间（线程安全）"""
+
+    def __init__(self):
+        self._known: set[int] = set()
+        self._pending: dict[int, tuple[str | None, str]] = {}
+        self._lock = threading.Lock()
+
+    def known(self, user_id: int) -> bool:
+        return user_id in self._known
+
+    def remember(self, user_id: int) -> None:
+        """用户已确认存在于数据库中（注册提交之后调用）"""
+        with self._lock:
+            self._known.add(user_id)
+
+    def touch(self, user_id: int, username: str | None) -> None:
+        """记录一次活跃，同一用户在两次写回之间只保留最新的用户名和时间"""
+        with self._lock:
+            self._pending[user_id] = (username, datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def take(self) -> list[tuple[str | None, str, int]]:
+        """取出待写回的 [(username, last_active, user_id)]"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return [(username, last_active, user_id) for user_id, (username, last_active) in pending.items()]
+
+    def restore(self, rows: list[tuple[str | None, str, int]]) -> None:
+        """写回失败时放回缓冲，下次重试（期间又有新活跃的用户以新的为准）"""
+        with self._lock:
+            for username, last_active, user_id in rows:
+                self._pending.setdefault(user_id, (username, last_active))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._known.clear()
+            self._pending.clear()
+
+
+def save(conn: sqlite3.Connection, rows: list[tuple[str | None, str, int]]) -> None:
+    """把 take() 取出的更新写回 users 表（写命令）"""
+    conn.executemany("UPDATE users SET username=?, last_active=? WHERE user_id=?", rows)
+
+
+activity = UserActivity()
@@ -0,0 +1,125 @@
+"""
+已结束房间归档
+
+rooms 表只需要保存进行中和刚结束的房间：大厅、我的房间、过期清理、点击和结算都只读这些房间。
+FINISHED / CANCELLED 且创建时间早于 ARCHIVE_AFTER_HOURS 的房间由后台任务移到 rooms_archive：
+- 每个写命令最多移动 ARCHIVE_BATCH 个房间（INSERT 到归档表 + 从 rooms 删除，同一事务），
+  两批之间让出写线程，不会长时间占用写锁
+- 按房间ID查询（GET /api/rooms/{room_id}、重复结算）在 rooms 中找不到时读归档表
+- 对局历史（GET /api/users/{user_id}/history）在同一个读事务中合并两张表的结果
+"""
+import asyncio
+import heapq
+import os
+import time
+from datetime import datetime, timedelta
+
+from . import db, metrics
+
+ARCHIVE_AFTER_HOURS = float(os.getenv("ARCHIVE_AFTER_HOURS", "24"))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "500"))
+# 两批之间的间隔（秒），让其他写命令先执行
+ARCHIVE_PAUSE = 0.05
+
+# rooms 与 rooms_archive 共有的列（rooms_archive 另有 archived_at）
+COLUMNS = (
+    "room_id", "chat_id", "host_id", "host_username", "guest_id", "guest_username",
+    "bet_amount", "status", "invite_token", "host_ready", "guest_ready", "host_clicks", "guest_clicks",
+    "countdown_start_time", "game_start_time", "game_end_time", "winner_id", "created_at", "expires_at",
+)
+_COLUMN_LIST = ", ".join(COLUMNS)
+
+# 最近一次归档的摘要（/api/internal/stats）
+last: dict = {}
+
+
+def cutoff(hours: float = ARCHIVE_AFTER_HOURS) -> str:
+    """早于这个时间创建的已结束房间可以归档（与 rooms.created_at 相同的 ISO 格式，UTC）"""
+    return (datetime.utcnow() - timedelta(hours=hours)).isoformat()
+
+def archive_batch(conn, before: str, limit: int = ARCHIVE_BATCH) -> int:
+    """把最多 limit 个 before 之前创建的已结束房间移到归档表（写命令），返回移动的数量"""
+    room_ids = [row[0] for row in conn.execute("""
+        SELECT room_id FROM rooms
+        WHERE status IN ('FINISHED', 'CANCELLED') AND created_at < ?
+        ORDER BY created_at
+        LIMIT ?
+    """, (before, limit))]
+    if not room_ids:
+        return 0
+
+    marks = ",".join("?" * len(room_ids))
+    conn.execute(
+        f"""INSERT OR REPLACE INTO rooms_archive({_COLUMN_LIST}, archived_at)
+            SELECT {_COLUMN_LIST}, ? FROM rooms WHERE room_id IN ({marks})""",
+        (int(time.time()), *room_ids)
+    )
+    conn.execute(f"DELETE FROM rooms WHERE room_id IN ({marks})", room_ids)
+    return len(room_ids)
+
+async def archive_rooms(hours: float = ARCHIVE_AFTER_HOURS, batch: int = ARCHIVE_BATCH) -> int:
+    """分批归档所有可以归档的房间，返回归档的数量"""
+    start = time.perf_counter()
+    before = cutoff(hours)
+    total = batches = 0
+    while True:
+        moved = await db.write(archive_batch, before, batch)
+        total += moved
+        batches += 1
+        if moved < batch:
+            break
+        await asyncio.sleep(ARCHIVE_PAUSE)
+
+    metrics.rooms_archived.inc(amount=total)
+    last.update(
+        rooms=total, batches=batches, before=before,
+        seconds=round(time.perf_counter() - start, 3), at=int(time.time()),
+    )
+    return total
+
+def fetch_archived_room(conn, room_id: str):
+    return conn.execute(f"SELECT {_COLUMN_LIST} FROM rooms_archive WHERE room_id=?", (room_id,)).fetchone()
+
+def user_history(conn, user_id: int, limit: int, cursor: str | None = None) -> tuple[list[dict], str | None]:
+    """
+    用户已结束的房间（含已归档），按 (created_at, room_id) 倒序
+    cursor 为上一页最后一个房间的 "created_at~room_id"，返回 (房间列表, 下一页 cursor)
+    """
+    after = ("9999", "")
+    if cursor:
+        created_at, _, room_id = cursor.rpartition("~")
+        after = (created_at, room_id)
+
+    # 同一个读事务：归档任务在两次查询之间移动房间也不会重复或遗漏
+    conn.execute("BEGIN")
+    try:
+        sources = [
+            conn.execute(f"""
+                SELECT {_COLUMN_LIST} FROM {table}
+                WHERE {column}=? {terminal}
+                AND (created_at < ? OR (created_at = ? AND room_id < ?))
+                ORDER BY created_at DESC, room_id DESC
+                LIMIT ?
+            """, (user_id, after[0], after[0], after[1], limit + 1)).fetchall()
+            for table, terminal in (
+                ("rooms", "AND status IN ('FINISHED', 'CANCELLED')"),
+                ("rooms_archive", ""),
+            )
+            for column in ("host_id", "guest_id")
+        ]
+    finally:
+        conn.rollback()
+
+    key = lambda room: (room["created_at"], room["room_id"])
+    rooms = []
+    for room in heapq.merge(*sources, key=key, reverse=True):
+        if rooms and rooms[-1]["room_id"] == room["room_id"]:
+            continue
+        rooms.append(dict(room))
+        if len(rooms) > limit:
+            break
+
+    if len(rooms) > limit:
+        rooms = rooms[:limit]
+        return rooms, "~".join(key(rooms[-1]))
+    return rooms, None
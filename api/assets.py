@@ -0,0 +1,161 @@
+"""
+Mini App 静态资源
+
+优先提供 build_assets.py 构建出的 dist/miniapp/，没有构建时退回源目录 miniapp/：
+- 全部文件（含 .br / .gz 预压缩版本）在第一次请求时读入内存，之后每个请求只是查字典，不读磁盘
+- 按 Accept-Encoding 选择预压缩版本（br 优先于 gzip），不在请求时压缩
+- 带内容哈希的文件（manifest.json 中的值）返回 Cache-Control: immutable，一年内不再请求
+- 其他文件（HTML 入口、未构建时的所有文件）返回 no-cache + ETag，内容没变时 304
+  （各编码版本的 ETag 不同，如 "<哈希>" 和 "<哈希>-br"，任何一个匹配都可以 304）
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+# (Content-Encoding, 预压缩文件后缀)，按优先顺序
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+MANIFEST = "manifest.json"
+
+mimetypes.add_type("image/webp", ".webp")
+
+
+class Asset:
+    __slots__ = ("body", "etag", "media_type", "cache_control", "variants")
+
+    def __init__(self, body: bytes, media_type: str, cache_control: str, variants: dict[str, bytes]):
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:16]
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.variants = variants
+
+    def etag_for(self, encoding: str | None) -> str:
+        return f'"{self.etag}-{encoding}"' if encoding else f'"{self.etag}"'
+
+    def matches(self, if_none_match: str) -> bool:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or any(self.etag_for(encoding) in tags for encoding in (None, *self.variants))
+
+
+def _accepted(header: str) -> set[str]:
+    """Accept-Encoding 中可接受的编码（忽略 q=0）"""
+    accepted = set()
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticAssets:
+    """挂载在 /miniapp 的 ASGI 应用（替代 StaticFiles）"""
+
+    def __init__(self, directory: str, fallback: str | None = None):
+        self.directory = directory
+        self.fallback = fallback
+        self.built = False
+        self.root: str | None = None
+        self._assets: dict[str, Asset] | None = None
+        self._lock = threading.Lock()
+
+    def load(self) -> dict[str, Asset]:
+        """读入全部文件（只在第一次调用时执行）"""
+        if self._assets is not None:
+            return self._assets
+        with self._lock:
+            if self._assets is None:
+                self._assets = self._scan()
+        return self._assets
+
+    def _scan(self) -> dict[str, Asset]:
+        self.built = os.path.isfile(os.path.join(self.directory, MANIFEST))
+        self.root = self.directory if self.built or not self.fallback else self.fallback
+        immutable = set()
+        if self.built:
+            with open(os.path.join(self.root, MANIFEST), encoding="utf-8") as f:
+                immutable = set(json.load(f).values())
+
+        files = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                with open(path, "rb") as f:
+                    files[os.path.relpath(path, self.root).replace(os.sep, "/")] = f.read()
+
+        assets = {}
+        for name, body in files.items():
+            if name == MANIFEST or name.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+                continue
+            variants = {
+                encoding: files[name + suffix] for encoding, suffix in ENCODINGS if name + suffix in files
+            }
+            media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            if media_type.startswith("text/") or media_type in ("application/javascript", "application/json"):
+                media_type += "; charset=utf-8"
+            cache_control = IMMUTABLE if name in immutable else REVALIDATE
+            assets[name] = Asset(body, media_type, cache_control, variants)
+        return assets
+
+    def stale(self) -> bool:
+        """源目录中有文件比构建结果新（修改 miniapp/ 后忘了重新构建）"""
+        if not self.built or not self.fallback:
+            return False
+        built_at = os.path.getmtime(os.path.join(self.directory, MANIFEST))
+        return any(
+            os.path.getmtime(os.path.join(dirpath, filename)) > built_at
+            for dirpath, _, filenames in os.walk(self.fallback)
+            for filename in filenames
+        )
+
+    async def __call__(self, scope, receive, send):
+        assert scope["type"] == "http"
+        if scope["method"] not in ("GET", "HEAD"):
+            return await self._send(send, 405, [(b"allow", b"GET, HEAD")], b"Method Not Allowed")
+
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if path.startswith(root_path):
+            path = path[len(root_path):]
+        name = path.lstrip("/")
+        if not name or name.endswith("/"):
+            name += "index.html"
+
+        asset = self.load().get(name)
+        if asset is None:
+            return await self._send(send, 404, [], b"Not Found")
+
+        request_headers = dict(scope["headers"])
+        chosen = None
+        if asset.variants:
+            accepted = _accepted(request_headers.get(b"accept-encoding", b"").decode("latin-1"))
+            chosen = next((encoding for encoding, _ in ENCODINGS if encoding in asset.variants and encoding in accepted), None)
+        headers = [
+            (b"cache-control", asset.cache_control.encode()),
+            (b"etag", asset.etag_for(chosen).encode()),
+            (b"vary", b"Accept-Encoding"),
+        ]
+        if_none_match = request_headers.get(b"if-none-match")
+        if if_none_match and asset.matches(if_none_match.decode("latin-1")):
+            return await self._send(send, 304, headers, b"")
+
+        body = asset.body
+        if chosen:
+            body = asset.variants[chosen]
+            headers.append((b"content-encoding", chosen.encode()))
+        headers.append((b"content-type", asset.media_type.encode()))
+        await self._send(send, 200, headers, body, head=scope["method"] == "HEAD")
+
+    @staticmethod
+    async def _send(send, status: int, headers: list, body: bytes, head: bool = False) -> None:
+        headers = headers + [(b"content-length", str(len(body)).encode())]
+        if status in (404, 405):
+            headers.append((b"content-type", b"text/plain; charset=utf-8"))
+        if status == 304:
+            headers = [header for header in headers if header[0] != b"content-length"]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": b"" if head or status == 304 else body})
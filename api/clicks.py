@@ -0,0 +1,146 @@
+"""
+PLAYING 房间的内存点击计数器
+
+点击只在进程内存中累加，不产生任何磁盘 I/O；
+结算时由 settle_room 在写命令中关闭计数（之后的点击被拒绝），一次性把 host_clicks/guest_clicks 写回 rooms 表。
+后台任务定期把有变化的计数快照写回 rooms 表，进程重启后从快照恢复。
+"""
+import sqlite3
+import threading
+from datetime import datetime
+
+# 游戏结束后多久仍未结算的计数会被丢弃（秒）
+STALE_AFTER = 30 + 120
+
+
+class RoomClicks:
+    """单个房间的点击计数"""
+    __slots__ = ("host_id", "guest_id", "game_start", "host_clicks", "guest_clicks", "dirty", "closed")
+
+    def __init__(self, host_id: int, guest_id: int, game_start: datetime | None,
+                 host_clicks: int = 0, guest_clicks: int = 0):
+        self.host_id = host_id
+        self.guest_id = guest_id
+        self.game_start = game_start
+        self.host_clicks = host_clicks
+        self.guest_clicks = guest_clicks
+        self.dirty = False
+        # 已开始结算：计数不再变化
+        self.closed = False
+
+
+class ClickCounter:
+    """进程内点击计数表，room_id -> RoomClicks（线程安全）"""
+
+    def __init__(self):
+        self._rooms: dict[str, RoomClicks] = {}
+        self._lock = threading.Lock()
+
+    def get(self, room_id: str) -> RoomClicks | None:
+        return self._rooms.get(room_id)
+
+    def track(self, room) -> RoomClicks:
+        """从 rooms 行开始跟踪一个 PLAYING 房间，已跟踪时返回现有计数"""
+        game_start = datetime.fromisoformat(room["game_start_time"]) if room["game_start_time"] else None
+        with self._lock:
+            entry = self._rooms.get(room["room_id"])
+            if entry is None:
+                entry = RoomClicks(
+                    room["host_id"], room["guest_id"], game_start,
+                    room["host_clicks"], room["guest_clicks"]
+                )
+                self._rooms[room["room_id"]] = entry
+            return entry
+
+    def add(self, room_id: str, user_id: int, n: int = 1,
+            limit: int | None = None) -> tuple[int, int, int] | None:
+        """
+        为玩家累加点击数，返回 (本次接受的点击数, host_clicks, guest_clicks)
+        limit 为该玩家本局累计点击数上限，超出部分不计入
+        房间未跟踪、已开始结算或 user_id 不是本房间玩家时返回 None
+        """
+        with self._lock:
+            entry = self._rooms.get(room_id)
+            if entry is None or entry.closed:
+                return None
+            if user_id == entry.host_id:
+                current = entry.host_clicks
+            elif user_id == entry.guest_id:
+                current = entry.guest_clicks
+            else:
+                return None
+
+            if limit is not None:
+                n = max(0, min(n, limit - current))
+            if user_id == entry.host_id:
+                entry.host_clicks += n
+            else:
+                entry.guest_clicks += n
+            if n:
+                entry.dirty = True
+            return n, entry.host_clicks, entry.guest_clicks
+
+    def counts(self, room_id: str) -> tuple[int, int] | None:
+        entry = self._rooms.get(room_id)
+        if entry is None:
+            return None
+        return entry.host_clicks, entry.guest_clicks
+
+    def close(self, room) -> tuple[int, int]:
+        """
+        停止计数并返回最终的 (host_clicks, guest_clicks)（在结算写命令中调用）
+        与 add 互斥：返回的计数之后不会再有被接受的点击；内存中没有该房间时从 rooms 行的快照开始
+        """
+        entry = self.track(room)
+        with self._lock:
+            entry.closed = True
+            return entry.host_clicks, entry.guest_clicks
+
+    def discard(self, room_id: str) -> None:
+        with self._lock:
+            self._rooms.pop(room_id, None)
+
+    def overlay(self, room: dict) -> dict:
+        """用内存中的实时计数覆盖房间字典里的点击数"""
+        if room.get("status") == "PLAYING":
+            counts = self.counts(room["room_id"])
+            if counts is not None:
+                room["host_clicks"], room["guest_clicks"] = counts
+        return room
+
+    def take_dirty(self) -> list[tuple[int, int, str]]:
+        """
+        取出有变化的计数 [(host_clicks, guest_clicks, room_id)] 并清除脏标记（快照用）
+        同时丢弃早已超时却没有被结算的计数
+        """
+        now = datetime.utcnow()
+        with self._lock:
+            rows = []
+            for room_id, entry in list(self._rooms.items()):
+                if entry.dirty:
+                    rows.append((entry.host_clicks, entry.guest_clicks, room_id))
+                    entry.dirty = False
+                if entry.game_start and (now - entry.game_start).total_seconds() > STALE_AFTER:
+                    del self._rooms[room_id]
+            return rows
+
+    def reset(self) -> None:
+        with self._lock:
+            self._rooms.clear()
+
+    def restore_dirty(self, rows: list[tuple[int, int, str]]) -> None:
+        """快照写入失败时恢复脏标记，下次快照重试"""
+        with self._lock:
+            for _, _, room_id in rows:
+                if room_id in self._rooms:
+                    self._rooms[room_id].dirty = True
+
+
+def save_counts(conn: sqlite3.Connection, rows: list[tuple[int, int, str]]) -> None:
+    """把 take_dirty() 取出的计数写回 rooms 表（写命令）"""
+    conn.executemany(
+        "UPDATE rooms SET host_clicks=?, guest_clicks=? WHERE room_id=? AND status='PLAYING'",
+        rows
+    )
+
+counter = ClickCounter()
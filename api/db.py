@@ -1,18 +1,307 @@
+import asyncio
+import functools
+import os
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 
-DB_PATH = Path(__file__).resolve().parent.parent / "lgw33.db"
+from . import metrics
+
+DB_PATH = Path(os.getenv("DB_PATH") or Path(__file__).resolve().parent.parent / "lgw33.db")
+
+# 连接池配置
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# 每个连接缓存的预编译语句数量
+DB_STATEMENT_CACHE = 256
 
 def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+    """新建一个已配置好 WAL / busy_timeout 的连接（一般请使用 connection()）"""
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        cached_statements=DB_STATEMENT_CACHE,
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
     return conn
 
-def init_db() -> None:
-    conn = get_conn()
-    cur = conn.cursor()
+class ConnectionPool:
+    """
+    SQLite 连接池
+    连接在线程间复用（check_same_thread=False），同一时刻只被一个线程持有；
+    复用连接也就复用了它的预编译语句缓存。
+    """
+
+    def __init__(self, size: int = DB_POOL_SIZE):
+        self.size = size
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return get_conn()
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        # 归还前回滚未提交的事务（例如中途抛出 HTTPException）
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if not self._closed and self._idle.qsize() < self.size:
+                self._idle.put_nowait(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+def close_pool() -> None:
+    """关闭写线程（先处理完已排队的写命令）和连接池"""
+    global _pool, _writer
+    with _pool_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+@contextmanager
+def connection():
+    """从连接池借出一个连接，用完自动归还（未提交的修改会被回滚）"""
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+# --------------------
+# Async access
+# --------------------
+# 所有阻塞的数据库操作都在这个专用线程池中执行，事件循环只负责 await 结果；
+# 线程数与连接池大小一致，每个线程最多同时持有一个连接。
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+async def run(fn, *args, **kwargs):
+    """在数据库线程中执行同步函数 fn(*args, **kwargs) 并等待结果"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(_timed, fn, args, kwargs))
+
+def _timed(fn, args, kwargs):
+    """执行 fn 并按函数名记录耗时（lgw33_db_query_duration_seconds）"""
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    except sqlite3.OperationalError as e:
+        if is_locked(e):
+            metrics.db_locked_errors.inc("read")
+        raise
+    finally:
+        metrics.db_query_duration.observe(time.perf_counter() - start, getattr(fn, "__name__", "other"))
+
+def is_locked(error: Exception) -> bool:
+    """busy_timeout 内没有等到锁（SQLITE_BUSY / SQLITE_LOCKED）"""
+    return isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+
+# --------------------
+# Group commit
+# --------------------
+# SQLite 同一时刻只允许一个写事务。所有修改数据的操作都作为写命令 fn(conn, ...) 交给唯一的写线程：
+# 写线程把排队中的命令（最多等待 WRITE_BATCH_MS 毫秒凑批）放进同一个事务依次执行，
+# 每个命令在自己的 SAVEPOINT 中运行，抛出异常只回滚该命令；一次 COMMIT（一次 fsync）覆盖整批命令，
+# 之后每个调用方分别拿到自己的结果或异常。
+# 写命令内不要 commit/rollback，也不要做提交之后才能做的事（推送、定时器、内存索引），
+# 这些在 await write(...) 返回后由调用方完成；写命令深处需要同步内存状态时用 after_commit() 登记。
+WRITE_BATCH_MS = float(os.getenv("WRITE_BATCH_MS", "2"))
+WRITE_BATCH_MAX = 256
+# BEGIN IMMEDIATE 超过这个时间（秒）说明写锁被其他连接持有、在 busy handler 中重试过
+LOCK_BUSY_SECONDS = 0.001
+
+class GroupWriter:
+    """单写入线程 + 批量提交"""
+
+    def __init__(self, window_ms: float = WRITE_BATCH_MS, max_batch: int = WRITE_BATCH_MAX):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.stats = {
+            "batches": 0, "commands": 0, "errors": 0, "failed_batches": 0, "max_batch": 0,
+            # 等待写锁（BEGIN IMMEDIATE，其他进程持有写锁时）和 COMMIT 的累计/最大耗时
+            "lock_wait_ms": 0.0, "max_lock_wait_ms": 0.0, "commit_ms": 0.0, "max_commit_ms": 0.0,
+        }
+        self._hooks: list = []
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """排队一个写命令，返回在提交后完成的 Future"""
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("Cannot submit a write command from inside another write command")
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def after_commit(self, fn) -> None:
+        if threading.current_thread() is not self._thread:
+            raise RuntimeError("after_commit() must be called from a write command")
+        self._hooks.append(fn)
+
+    def close(self) -> None:
+        """处理完已排队的命令后停止写线程"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _loop(self) -> None:
+        conn = get_conn()
+        conn.isolation_level = None  # 事务由写线程显式控制
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                batch = [item]
+                stopping = False
+                deadline = time.monotonic() + self.window
+                while len(batch) < self.max_batch:
+                    timeout = deadline - time.monotonic()
+                    try:
+                        item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+                self._apply(conn, batch)
+                if stopping:
+                    return
+        finally:
+            conn.close()
+
+    def _apply(self, conn: sqlite3.Connection, batch: list) -> None:
+        # 调用方已取消（例如请求被中断）的命令不再执行
+        batch = [item for item in batch if item[0].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        outcomes = []
+        try:
+            started = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            lock_wait = (time.perf_counter() - started) * 1000
+            for future, fn, args, kwargs in batch:
+                self._hooks = hooks = []
+                conn.execute("SAVEPOINT command")
+                started = time.perf_counter()
+                try:
+                    outcomes.append((future, fn(conn, *args, **kwargs), None, hooks))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO command")
+                    outcomes.append((future, None, e, []))
+                metrics.db_command_duration.observe(time.perf_counter() - started, getattr(fn, "__name__", "other"))
+                conn.execute("RELEASE command")
+            started = time.perf_counter()
+            conn.execute("COMMIT")
+            commit = (time.perf_counter() - started) * 1000
+        except Exception as e:
+            # 整批提交失败（磁盘错误、其他进程长时间占用写锁等）：所有命令都失败
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self.stats["failed_batches"] += 1
+            if is_locked(e):
+                metrics.db_locked_errors.inc("write")
+            print(f"❌ 批量写入失败（{len(batch)} 个命令）: {e}")
+            for future, *_ in batch:
+                future.set_exception(e)
+            return
 
-    cur.execute("""
+        self.stats["batches"] += 1
+        self.stats["commands"] += len(batch)
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+        self.stats["lock_wait_ms"] += lock_wait
+        self.stats["max_lock_wait_ms"] = max(self.stats["max_lock_wait_ms"], lock_wait)
+        self.stats["commit_ms"] += commit
+        self.stats["max_commit_ms"] = max(self.stats["max_commit_ms"], commit)
+        metrics.db_batch_size.observe(len(batch))
+        metrics.db_lock_wait.observe(lock_wait / 1000)
+        metrics.db_commit_duration.observe(commit / 1000)
+        if lock_wait >= LOCK_BUSY_SECONDS * 1000:
+            metrics.db_lock_busy.inc()
+        for future, result, error, hooks in outcomes:
+            # 先同步内存状态，调用方拿到结果时已经是提交后的状态
+            for hook in hooks:
+                try:
+                    hook()
+                except Exception as e:
+                    print(f"❌ 提交后回调出错: {e}")
+            if error is None:
+                future.set_result(result)
+            else:
+                self.stats["errors"] += 1
+                future.set_exception(error)
+
+_writer: GroupWriter | None = None
+
+def get_writer() -> GroupWriter:
+    global _writer
+    if _writer is None:
+        with _pool_lock:
+            if _writer is None:
+                _writer = GroupWriter()
+    return _writer
+
+def after_commit(fn) -> None:
+    """在写命令中登记 fn()，所在批次提交成功后（调用方拿到结果之前）在写线程中执行；命令被回滚时不执行"""
+    if _writer is None:
+        raise RuntimeError("after_commit() must be called from a write command")
+    _writer.after_commit(fn)
+
+async def write(fn, *args, **kwargs):
+    """把写命令 fn(conn, *args, **kwargs) 交给写线程，等待所在批次提交后返回其结果"""
+    return await asyncio.wrap_future(get_writer().submit(fn, *args, **kwargs))
+
+def writer_stats() -> dict:
+    if _writer is None:
+        return {}
+    return {key: round(value, 3) if isinstance(value, float) else value for key, value in _writer.stats.items()}
+
+# --------------------
+# Schema migrations
+# --------------------
+# 每个迁移是 (版本号, 说明, 函数)，按顺序执行；当前版本记录在 PRAGMA user_version 中。
+# 新增表结构变更时在末尾追加一个迁移，不要修改已发布的迁移。
+
+def _m1_base_schema(conn: sqlite3.Connection) -> None:
+    """初始表结构（兼容旧版本数据库缺失的列）"""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS users (
       user_id INTEGER PRIMARY KEY,
       username TEXT,
@@ -23,7 +312,7 @@ def init_db() -> None:
     );
     """)
 
-    cur.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS rooms (
       room_id TEXT PRIMARY KEY,
       chat_id INTEGER,
@@ -47,13 +336,22 @@ def init_db() -> None:
     );
     """)
 
-    # 添加 countdown_start_time 列（如果不存在）
-    try:
-        cur.execute("ALTER TABLE rooms ADD COLUMN countdown_start_time TEXT")
-    except sqlite3.OperationalError:
-        pass  # 列已存在
+    # 旧版本数据库缺少的游戏相关列
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(rooms)")}
+    for name, decl in (
+        ("host_ready", "INTEGER NOT NULL DEFAULT 0"),
+        ("guest_ready", "INTEGER NOT NULL DEFAULT 0"),
+        ("host_clicks", "INTEGER NOT NULL DEFAULT 0"),
+        ("guest_clicks", "INTEGER NOT NULL DEFAULT 0"),
+        ("countdown_start_time", "TEXT"),
+        ("game_start_time", "TEXT"),
+        ("game_end_time", "TEXT"),
+        ("winner_id", "INTEGER"),
+    ):
+        if name not in existing:
+            conn.execute(f"ALTER TABLE rooms ADD COLUMN {name} {decl}")
 
-    cur.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS ledger (
       tx_id TEXT PRIMARY KEY,
       user_id INTEGER NOT NULL,
@@ -64,5 +362,221 @@ def init_db() -> None:
     );
     """)
 
-    conn.commit()
-    conn.close()
+def _m2_room_indexes(conn: sqlite3.Connection) -> None:
+    """
+    统一 rooms 时间列为 ISO-8601（YYYY-MM-DDTHH:MM:SS[.ffffff]，UTC），
+    使 expires_at 可以直接与参数比较并走索引；并为活跃房间的查询建立索引
+    """
+    for column in ("expires_at", "countdown_start_time", "game_start_time", "game_end_time"):
+        conn.execute(f"""
+            UPDATE rooms SET {column} = strftime('%Y-%m-%dT%H:%M:%f', {column})
+            WHERE {column} IS NOT NULL
+            AND {column} NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]T[0-9][0-9]:[0-9][0-9]:[0-9][0-9]*'
+        """)
+
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_rooms_invite_token ON rooms(invite_token)")
+    # 我的房间：(host_id=? OR guest_id=?) 走 MULTI-INDEX OR
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rooms_host ON rooms(host_id, status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rooms_guest ON rooms(guest_id, status)")
+    # 大厅列表（按创建时间倒序）和过期清理只涉及 OPEN/FULL 房间
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_rooms_lobby ON rooms(created_at)
+        WHERE status IN ('OPEN', 'FULL')
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_rooms_open_expires ON rooms(expires_at)
+        WHERE status IN ('OPEN', 'FULL')
+    """)
+    # 启动时恢复定时器
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_rooms_live ON rooms(status)
+        WHERE status IN ('COUNTDOWN', 'PLAYING')
+    """)
+
+def _m3_compact_ledger(conn: sqlite3.Connection) -> None:
+    """
+    账本改为追加写友好的结构（见 api/ledger.py）：
+    INTEGER PRIMARY KEY 代替 UUID 文本主键，整数类型/原因编码，room_id 单独成列，Unix 时间戳
+    旧记录按 created_at 顺序分配 tx_id，ref 字符串拆分为 reason / room_id
+    """
+    from .ledger import TYPES, parse_ref
+
+    conn.execute("""
+    CREATE TABLE ledger_new (
+      tx_id INTEGER PRIMARY KEY,
+      user_id INTEGER NOT NULL,
+      type INTEGER NOT NULL, -- ledger.CREDIT / DEBIT / FREEZE / UNFREEZE
+      amount INTEGER NOT NULL,
+      reason INTEGER NOT NULL, -- ledger.SIGNUP / BET / WIN / DRAW / EXPIRED
+      room_id TEXT,
+      note TEXT, -- 旧记录中无法识别的 ref
+      created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+    );
+    """)
+
+    codes = {name: code for code, name in TYPES.items()}
+
+    def rows():
+        for row in conn.execute("""
+            SELECT user_id, type, amount, ref,
+                   COALESCE(CAST(strftime('%s', created_at) AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER)) AS created_at
+            FROM ledger ORDER BY created_at, rowid
+        """):
+            reason, room_id, note = parse_ref(row["ref"])
+            yield row["user_id"], codes[row["type"]], row["amount"], reason, room_id, note, row["created_at"]
+
+    conn.executemany(
+        "INSERT INTO ledger_new(user_id, type, amount, reason, room_id, note, created_at) VALUES(?,?,?,?,?,?,?)",
+        rows()
+    )
+    conn.execute("DROP TABLE ledger")
+    conn.execute("ALTER TABLE ledger_new RENAME TO ledger")
+
+def _m4_balance_checkpoints(conn: sqlite3.Connection) -> None:
+    """对账检查点（见 api/reconcile.py）：账本推算出的每个用户余额，以及检查点对应的账本位置"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS balance_checkpoints (
+      user_id INTEGER PRIMARY KEY,
+      available INTEGER NOT NULL,
+      frozen INTEGER NOT NULL
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS reconcile_state (
+      id INTEGER PRIMARY KEY CHECK (id = 1),
+      tx_id INTEGER NOT NULL, -- 检查点包含的最后一条账本记录
+      checked_at INTEGER NOT NULL,
+      drift INTEGER NOT NULL -- 上次对账发现的不一致用户数
+    );
+    """)
+
+def _m5_room_status_index(conn: sqlite3.Connection) -> None:
+    """/api/internal/metrics 按状态统计未结束的房间：只索引这四种状态，结束的房间不占索引"""
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_rooms_status ON rooms(status)
+        WHERE status IN ('OPEN', 'FULL', 'COUNTDOWN', 'PLAYING')
+    """)
+
+def _m6_rooms_archive(conn: sqlite3.Connection) -> None:
+    """已结束房间的归档表（见 api/archive.py），列与 rooms 相同，另记录归档时间"""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS rooms_archive (
+      room_id TEXT PRIMARY KEY,
+      chat_id INTEGER,
+      host_id INTEGER NOT NULL,
+      host_username TEXT,
+      guest_id INTEGER,
+      guest_username TEXT,
+      bet_amount INTEGER NOT NULL,
+      status TEXT NOT NULL, -- FINISHED, CANCELLED
+      invite_token TEXT NOT NULL,
+      host_ready INTEGER NOT NULL DEFAULT 0,
+      guest_ready INTEGER NOT NULL DEFAULT 0,
+      host_clicks INTEGER NOT NULL DEFAULT 0,
+      guest_clicks INTEGER NOT NULL DEFAULT 0,
+      countdown_start_time TEXT,
+      game_start_time TEXT,
+      game_end_time TEXT,
+      winner_id INTEGER,
+      created_at TEXT NOT NULL,
+      expires_at TEXT NOT NULL,
+      archived_at INTEGER NOT NULL -- Unix 时间戳
+    );
+    """)
+    # 对局历史：按用户倒序分页
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_archive_host ON rooms_archive(host_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_archive_guest ON rooms_archive(guest_id, created_at)")
+    # 归档任务按创建时间找可以归档的房间
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_rooms_terminal ON rooms(created_at)
+        WHERE status IN ('FINISHED', 'CANCELLED')
+    """)
+
+def _m7_room_created_at(conn: sqlite3.Connection) -> None:
+    """
+    rooms.created_at 也统一为 ISO-8601（_m2 没有处理这一列，默认值仍是 datetime('now') 的空格格式），
+    大厅和对局历史的游标、归档的截止时间只需要处理一种格式。
+    SQLite 不能修改列的默认值：按 _m3 的方式重建 rooms 表，原有索引原样重建；rooms_archive 只转换已有数据
+    """
+    iso = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]T[0-9][0-9]:[0-9][0-9]:[0-9][0-9]*"
+    normalized = f"""
+        CASE WHEN created_at GLOB '{iso}' THEN created_at
+             ELSE COALESCE(strftime('%Y-%m-%dT%H:%M:%f', created_at), created_at) END
+    """
+    indexes = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type='index' AND tbl_name='rooms' AND sql IS NOT NULL"
+    )]
+
+    conn.execute("""
+    CREATE TABLE rooms_new (
+      room_id TEXT PRIMARY KEY,
+      chat_id INTEGER,
+      host_id INTEGER NOT NULL,
+      host_username TEXT,
+      guest_id INTEGER,
+      guest_username TEXT,
+      bet_amount INTEGER NOT NULL,
+      status TEXT NOT NULL, -- OPEN, FULL, COUNTDOWN, PLAYING, FINISHED, CANCELLED
+      invite_token TEXT NOT NULL,
+      host_ready INTEGER NOT NULL DEFAULT 0,
+      guest_ready INTEGER NOT NULL DEFAULT 0,
+      host_clicks INTEGER NOT NULL DEFAULT 0,
+      guest_clicks INTEGER NOT NULL DEFAULT 0,
+      countdown_start_time TEXT,
+      game_start_time TEXT,
+      game_end_time TEXT,
+      winner_id INTEGER,
+      created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
+      expires_at TEXT NOT NULL
+    );
+    """)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(rooms_new)")]
+    selected = [normalized if column == "created_at" else column for column in columns]
+    conn.execute(f"INSERT INTO rooms_new({', '.join(columns)}) SELECT {', '.join(selected)} FROM rooms")
+    conn.execute("DROP TABLE rooms")
+    conn.execute("ALTER TABLE rooms_new RENAME TO rooms")
+    for sql in indexes:
+        conn.execute(sql)
+
+    conn.execute(f"UPDATE rooms_archive SET created_at = {normalized} WHERE created_at NOT GLOB '{iso}'")
+
+MIGRATIONS = [
+    (1, "初始表结构", _m1_base_schema),
+    (2, "rooms 时间格式统一与索引", _m2_room_indexes),
+    (3, "账本改为整数主键与结构化引用", _m3_compact_ledger),
+    (4, "对账检查点", _m4_balance_checkpoints),
+    (5, "未结束房间的状态索引", _m5_room_status_index),
+    (6, "已结束房间归档表", _m6_rooms_archive),
+    (7, "rooms.created_at 统一为 ISO 格式", _m7_room_created_at),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn: sqlite3.Connection) -> list[tuple[int, str]]:
+    """执行所有未执行的迁移（每个迁移一个事务），返回本次执行的 (版本号, 说明)"""
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 拿到写锁后再检查一次，避免多个进程同时迁移
+            if version > schema_version(conn):
+                step(conn)
+                conn.execute(f"PRAGMA user_version={version}")
+                applied.append((version, description))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return applied
+
+def init_db() -> None:
+    conn = get_conn()
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
@@ -0,0 +1,67 @@
+"""
+过期房间回收
+
+房间创建/加入时按 expires_at 在定时器中登记，到期时由定时器批量调用 expire_rooms：
+同一时刻到期的房间在一个写命令（db.write）里完成取消和退款。
+定时器里的截止时间可能已经过时（房间已被加入、已开局），这里会以数据库为准重新检查。
+冻结余额不足以退款的房间（余额与房间不一致）原样保留并返回给调用方，由调用方计数、移出大厅并退避重试。
+"""
+import logging
+
+from . import ledger
+from .db import after_commit
+from .wallets import wallets
+
+logger = logging.getLogger(__name__)
+
+def expire_rooms(conn, room_ids: list[str], now: str) -> tuple[list, list[str]]:
+    """
+    取消已过期的 OPEN/FULL 房间并退还双方押注（写命令），返回 (本次取消的房间行, 无法退款而跳过的房间ID)
+    now 为 ISO-8601 UTC 时间，expires_at 晚于 now 的房间（例如刚被加入延长了时间）会被跳过
+    """
+    if not room_ids:
+        return [], []
+
+    marks = ",".join("?" * len(room_ids))
+    rooms = conn.execute(
+        f"""SELECT * FROM rooms
+            WHERE room_id IN ({marks}) AND status IN ('OPEN', 'FULL') AND expires_at <= ?""",
+        (*room_ids, now)
+    ).fetchall()
+    if not rooms:
+        return [], []
+
+    players = {room["host_id"] for room in rooms} | {room["guest_id"] for room in rooms if room["guest_id"]}
+    marks = ",".join("?" * len(players))
+    frozen = dict(conn.execute(
+        f"SELECT user_id, frozen FROM users WHERE user_id IN ({marks})", tuple(players)
+    ).fetchall())
+
+    cancelled, failed, refunds, entries = [], [], [], []
+    for room in rooms:
+        bet = room["bet_amount"]
+        users = [room["host_id"]] + ([room["guest_id"]] if room["guest_id"] else [])
+        if any(frozen.get(user_id, 0) < bet for user_id in users):
+            logger.error("清理房间 %s 失败: Insufficient frozen balance (users %s, bet %s)", room["room_id"], users, bet)
+            failed.append(room["room_id"])
+            continue
+        for user_id in users:
+            frozen[user_id] -= bet
+            refunds.append((bet, bet, user_id))
+            entries.append((user_id, ledger.UNFREEZE, bet, ledger.EXPIRED, room["room_id"]))
+        cancelled.append(room)
+
+    conn.executemany(
+        "UPDATE users SET available=available+?, frozen=frozen-?, last_active=datetime('now') WHERE user_id=?",
+        refunds
+    )
+    ledger.record(conn, entries)
+    conn.executemany(
+        "UPDATE rooms SET status='CANCELLED' WHERE room_id=? AND status IN ('OPEN', 'FULL')",
+        [(room["room_id"],) for room in cancelled]
+    )
+    # 批量退款不逐个读回余额，提交后使这些用户的余额缓存失效
+    refunded = [user_id for _, _, user_id in refunds]
+    after_commit(lambda: wallets.discard(*refunded))
+
+    return cancelled, failed
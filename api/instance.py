@@ -0,0 +1,87 @@
+"""
+单实例锁：同一个数据库只允许一个 API 进程
+
+很多状态只存在于进程内存中，多个进程之间不共享：
+- 点击计数（clicks.py）：快照直接覆盖房间的点击数，另一个进程的点击会丢失
+- 余额缓存（wallets.py）：没有过期时间，其他进程的结算不会让它失效，会显示旧余额
+- 大厅索引、WebSocket 推送、开局/结算/过期定时器、排行榜、快速匹配队列：
+  各进程只知道自己处理过的房间和玩家，不同进程排队的玩家永远匹配不到
+因此只支持单进程运行（uvicorn 不要加 --workers N，需要更多吞吐时把这些状态移出进程之后再扩展）。
+
+启动时用文件锁（flock）确认没有其他进程在使用同一个数据库：锁被占用时每隔 INSTANCE_LOCK_RETRY 秒重试，
+最多等待 INSTANCE_LOCK_WAIT 秒（重启时旧进程可能还在关闭），仍拿不到锁就拒绝启动。
+锁在进程退出时由操作系统释放，锁文件默认放在数据库旁边。没有 fcntl 的平台（Windows）不检查。
+"""
+import asyncio
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+INSTANCE_LOCK_FILE = os.getenv("INSTANCE_LOCK_FILE", "")
+INSTANCE_LOCK_WAIT = float(os.getenv("INSTANCE_LOCK_WAIT", "10"))
+INSTANCE_LOCK_RETRY = 0.5
+
+
+class InstanceLock:
+    def __init__(self):
+        self.path: str | None = None
+        self.waited = 0.0
+        self._fd: int | None = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self, path: str) -> bool:
+        """尝试获得锁（不阻塞），返回是否成功"""
+        self.path = path
+        if self._fd is not None or fcntl is None:
+            return True
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # 记录持有者的 pid，拒绝启动时报告给另一个进程
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        return True
+
+    def holder(self) -> str:
+        """持有锁的进程 pid（读不到时返回 "?"）"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return f.read().strip() or "?"
+        except OSError:
+            return "?"
+
+    async def acquire(self, path: str, wait: float | None = None) -> None:
+        """获得锁；wait 秒内一直被其他进程持有时抛出 RuntimeError"""
+        wait = INSTANCE_LOCK_WAIT if wait is None else wait
+        started = time.monotonic()
+        while not self.try_acquire(path):
+            if time.monotonic() - started >= wait:
+                raise RuntimeError(
+                    f"另一个 API 进程 (pid {self.holder()}) 正在使用这个数据库（锁文件 {path}）。"
+                    "只支持单进程运行，不要使用 uvicorn --workers N"
+                )
+            await asyncio.sleep(INSTANCE_LOCK_RETRY)
+        self.waited = time.monotonic() - started
+
+    def release(self) -> None:
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def snapshot(self) -> dict:
+        return {"pid": os.getpid(), "lock": self.path, "lock_wait_seconds": round(self.waited, 3)}
+
+
+instance_lock = InstanceLock()
@@ -0,0 +1,342 @@
+"""
+排行榜
+
+按胜场（wins）、净赢额（net）、对局数（games）排名，每个榜单有全局和按群（chat_id）两种范围，
+每种范围又分总榜（all）、今日（day）和本周（week，ISO 周）三个时间窗口，时间均为 UTC。
+
+全部榜单在内存中维护：
+- 每个榜单对每项指标保存一个有序的 RankedList，元素是把 (-分数, user_id) 编码成的一个整数，
+  插入、删除、查名次、按名次取值都是 O(log n)
+- 结算提交后（db.after_commit）按本局结果更新相关榜单，每个玩家每个榜单只是删除旧键、插入新键
+- 启动或手动重建时从账本（结算产生的 WIN / DRAW 记录）批量汇总，排序后一次性建表
+  重建期间提交的结算先排队，重建完成后补上账本位置（tx_id）之后的部分，既不重复也不遗漏
+今日/本周之外只保留上一个窗口，更早的窗口榜单直接丢弃。
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timezone
+
+from . import ledger
+
+METRICS = ("wins", "net", "games")
+WINDOWS = ("all", "day", "week")
+
+# user_id 占用的低位（Telegram user_id / chat_id 都小于 2^52）
+_ID_BITS = 53
+_ID_MASK = (1 << _ID_BITS) - 1
+
+
+def _key(score: int, user_id: int) -> int:
+    """分数高的排在前面，同分按 user_id 升序"""
+    return (-score << _ID_BITS) | user_id
+
+def _user(key: int) -> int:
+    return key & _ID_MASK
+
+
+class RankedList:
+    """
+    有序整数集合，支持按值查名次、按名次取值
+    分桶有序列表（每桶约 LOAD 个元素）+ 桶大小的树状数组：
+    定位桶 O(log n)，桶内插入/删除是一次长度不超过 2*LOAD 的 memmove
+    """
+
+    LOAD = 512
+
+    def __init__(self, values=()):
+        values = sorted(values)
+        self._buckets = [values[i:i + self.LOAD] for i in range(0, len(values), self.LOAD)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._len = len(values)
+        self._reindex()
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _reindex(self) -> None:
+        """按当前各桶大小重建树状数组（桶分裂或删空时）"""
+        tree = [0] * (len(self._buckets) + 1)
+        for i, bucket in enumerate(self._buckets, 1):
+            tree[i] += len(bucket)
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _update(self, pos: int, delta: int) -> None:
+        i = pos + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _before(self, pos: int) -> int:
+        """前 pos 个桶的元素总数"""
+        total = 0
+        while pos:
+            total += self._tree[pos]
+            pos -= pos & -pos
+        return total
+
+    def add(self, value: int) -> None:
+        self._len += 1
+        if not self._buckets:
+            self._buckets.append([value])
+            self._maxes.append(value)
+            self._reindex()
+            return
+        pos = min(bisect_left(self._maxes, value), len(self._buckets) - 1)
+        bucket = self._buckets[pos]
+        insort(bucket, value)
+        self._maxes[pos] = bucket[-1]
+        if len(bucket) > 2 * self.LOAD:
+            self._buckets[pos:pos + 1] = [bucket[:self.LOAD], bucket[self.LOAD:]]
+            self._maxes[pos:pos + 1] = [bucket[self.LOAD - 1], bucket[-1]]
+            self._reindex()
+        else:
+            self._update(pos, 1)
+
+    def remove(self, value: int) -> None:
+        pos = bisect_left(self._maxes, value)
+        bucket = self._buckets[pos] if pos < len(self._buckets) else []
+        i = bisect_left(bucket, value)
+        if i == len(bucket) or bucket[i] != value:
+            raise KeyError(value)
+        del bucket[i]
+        self._len -= 1
+        if bucket:
+            self._maxes[pos] = bucket[-1]
+            self._update(pos, -1)
+        else:
+            del self._buckets[pos], self._maxes[pos]
+            self._reindex()
+
+    def index(self, value: int) -> int:
+        """value 的名次（从 0 开始），value 必须在集合中"""
+        pos = bisect_left(self._maxes, value)
+        if pos == len(self._buckets):
+            raise KeyError(value)
+        return self._before(pos) + bisect_left(self._buckets[pos], value)
+
+    def slice(self, start: int, stop: int) -> list[int]:
+        """第 start 到 stop-1 名的元素"""
+        stop = min(stop, self._len)
+        if start >= stop:
+            return []
+        # 在树状数组上二分找到第 start 个元素所在的桶
+        pos = 0
+        remaining = start
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= remaining:
+                pos = nxt
+                remaining -= self._tree[nxt]
+            step >>= 1
+        out = self._buckets[pos][remaining:remaining + stop - start]
+        while len(out) < stop - start:
+            pos += 1
+            out.extend(self._buckets[pos][:stop - start - len(out)])
+        return out
+
+
+class Board:
+    """一个榜单：user_id -> [wins, net, games]，每项指标一个 RankedList"""
+
+    __slots__ = ("stats", "ranks")
+
+    def __init__(self, stats: dict[int, list[int]] | None = None):
+        self.stats = stats or {}
+        # 批量建表：一次排序
+        self.ranks = {
+            metric: RankedList(_key(values[i], user_id) for user_id, values in self.stats.items())
+            for i, metric in enumerate(METRICS)
+        }
+
+    def add(self, user_id: int, wins: int, net: int, games: int) -> None:
+        values = self.stats.get(user_id)
+        if values is None:
+            values = self.stats[user_id] = [0, 0, 0]
+        else:
+            for i, metric in enumerate(METRICS):
+                self.ranks[metric].remove(_key(values[i], user_id))
+        values[0] += wins
+        values[1] += net
+        values[2] += games
+        for i, metric in enumerate(METRICS):
+            self.ranks[metric].add(_key(values[i], user_id))
+
+    def entry(self, user_id: int) -> dict:
+        wins, net, games = self.stats[user_id]
+        return {"user_id": user_id, "wins": wins, "net": net, "games": games}
+
+    def top(self, metric: str, limit: int, offset: int = 0) -> list[dict]:
+        return [
+            {"rank": offset + i + 1, **self.entry(_user(key))}
+            for i, key in enumerate(self.ranks[metric].slice(offset, offset + limit))
+        ]
+
+    def rank(self, metric: str, user_id: int) -> dict | None:
+        if user_id not in self.stats:
+            return None
+        i = METRICS.index(metric)
+        return {"rank": self.ranks[metric].index(_key(self.stats[user_id][i], user_id)) + 1, **self.entry(user_id)}
+
+
+def window_keys(at: float) -> dict[str, str]:
+    """时间戳所在的各时间窗口，如 {"all": "all", "day": "2024-05-01", "week": "2024-W18"}"""
+    day = datetime.fromtimestamp(at, timezone.utc).date()
+    year, week, _ = day.isocalendar()
+    return {"all": "all", "day": day.isoformat(), "week": f"{year}-W{week:02d}"}
+
+
+class Leaderboard:
+    """(chat_id, 时间窗口) -> Board，chat_id 为 0 表示全局（线程安全）"""
+
+    def __init__(self):
+        self.ready = False
+        # 已计入榜单的最后一条账本记录
+        self.tx_id = 0
+        self._boards: dict[tuple[int, str], Board] = {}
+        self._pending: list | None = None
+        self._lock = threading.Lock()
+        # 同一时间只进行一次重建
+        self._load_lock = threading.Lock()
+
+    def _kept(self, now: float) -> set[str]:
+        """保留的时间窗口：总榜、今天/昨天、本周/上周"""
+        today = window_keys(now)
+        yesterday = window_keys(now - 86400)
+        last_week = window_keys(now - 7 * 86400)
+        return {"all", today["day"], yesterday["day"], today["week"], last_week["week"]}
+
+    def record(self, tx_id: int, at: float, chat_id: int | None, results: list[tuple[int, int, int]]) -> None:
+        """
+        计入一局的结算结果（提交后在写线程调用）
+        tx_id 为该局最后一条账本记录，results 为 [(user_id, 是否获胜, 净赢额)]
+        """
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((tx_id, at, chat_id, results))
+            elif self.ready and tx_id > self.tx_id:
+                self._apply(tx_id, at, chat_id, results)
+
+    def _apply(self, tx_id: int, at: float, chat_id: int | None, results) -> None:
+        windows = set(window_keys(at).values())
+        scopes = (0, chat_id) if chat_id else (0,)
+        created = False
+        for scope in scopes:
+            for window in windows:
+                board = self._boards.get((scope, window))
+                if board is None:
+                    board = self._boards[(scope, window)] = Board()
+                    created = True
+                for user_id, won, net in results:
+                    board.add(user_id, int(won), net, 1)
+        self.tx_id = tx_id
+        if created:
+            # 进入新的一天/一周时丢弃过期窗口
+            kept = self._kept(at)
+            for key in [key for key in self._boards if key[1] not in kept]:
+                del self._boards[key]
+
+    def load(self, fetch) -> int:
+        """
+        用 fetch() 返回的 (tx_id, [(user_id, chat_id, 时间戳, wins, net, games)]) 重建全部榜单
+        fetch 和建表都在锁外执行，期间提交的结算排队，完成后补上 tx_id 之后的部分；返回榜单数量
+        同时只进行一次：并发的调用依次执行，后一次在前一次完成后重新读取账本
+        """
+        with self._load_lock:
+            pending = []
+            with self._lock:
+                self._pending = pending
+            try:
+                tx_id, rows = fetch()
+                now = time.time()
+                kept = self._kept(now)
+                stats: dict[tuple[int, str], dict[int, list[int]]] = {}
+                for user_id, chat_id, at, wins, net, games in rows:
+                    scopes = (0, chat_id) if chat_id else (0,)
+                    for window in set(window_keys(at).values()) & kept:
+                        for scope in scopes:
+                            values = stats.setdefault((scope, window), {}).setdefault(user_id, [0, 0, 0])
+                            values[0] += wins
+                            values[1] += net
+                            values[2] += games
+                boards = {key: Board(users) for key, users in stats.items()}
+            except BaseException:
+                with self._lock:
+                    self._pending = None
+                raise
+
+            with self._lock:
+                self._boards = boards
+                self.tx_id = tx_id
+                self._pending = None
+                for item in pending:
+                    if item[0] > self.tx_id:
+                        self._apply(*item)
+                self.ready = True
+                return len(self._boards)
+
+    def _board(self, window: str, chat_id: int | None) -> Board | None:
+        return self._boards.get((chat_id or 0, window_keys(time.time())[window]))
+
+    def top(self, metric: str, window: str = "all", chat_id: int | None = None,
+            limit: int = 20, offset: int = 0) -> tuple[int, list[dict]]:
+        """返回 (榜单人数, 第 offset+1 名起的 limit 条)"""
+        with self._lock:
+            board = self._board(window, chat_id)
+            if board is None:
+                return 0, []
+            return len(board.stats), board.top(metric, limit, offset)
+
+    def rank(self, user_id: int, metric: str, window: str = "all", chat_id: int | None = None) -> tuple[int, dict | None]:
+        """返回 (榜单人数, 该用户的名次和数据)，不在榜上时为 None"""
+        with self._lock:
+            board = self._board(window, chat_id)
+            if board is None:
+                return 0, None
+            return len(board.stats), board.rank(metric, user_id)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "tx_id": self.tx_id,
+                "boards": len(self._boards),
+                "players": len(self._boards[(0, "all")].stats) if (0, "all") in self._boards else 0,
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._boards = {}
+            self.tx_id = 0
+            self.ready = False
+
+
+# 从账本汇总：每个 (用户, 群, 天) 一行
+# 胜者：UNFREEZE + CREDIT，败者：DEBIT，平局：双方各一条 UNFREEZE；一局中每个玩家恰好一条 UNFREEZE 或 DEBIT
+_RESULTS_SQL = f"""
+    SELECT l.user_id, COALESCE(r.chat_id, a.chat_id, 0), l.created_at / 86400 * 86400,
+           SUM(l.type = {ledger.CREDIT}),
+           SUM(CASE l.type WHEN {ledger.CREDIT} THEN l.amount WHEN {ledger.DEBIT} THEN -l.amount ELSE 0 END),
+           SUM(l.type IN ({ledger.UNFREEZE}, {ledger.DEBIT}))
+    FROM ledger l
+    LEFT JOIN rooms r ON r.room_id = l.room_id
+    LEFT JOIN rooms_archive a ON a.room_id = l.room_id
+    WHERE l.tx_id <= ? AND l.reason IN ({ledger.WIN}, {ledger.DRAW})
+    GROUP BY 1, 2, 3
+"""
+
+def fetch_results(conn) -> tuple[int, list[tuple]]:
+    """在一个读事务中取得账本位置和截至该位置的汇总结果（Leaderboard.load 的 fetch）"""
+    conn.execute("BEGIN")
+    try:
+        tx_id = conn.execute("SELECT COALESCE(MAX(tx_id), 0) FROM ledger").fetchone()[0]
+        return tx_id, conn.execute(_RESULTS_SQL, (tx_id,)).fetchall()
+    finally:
+        conn.rollback()
+
+
+leaderboard = Leaderboard()
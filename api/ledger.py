@@ -0,0 +1,67 @@
+"""
+资金账本
+
+账本只追加、不修改，是增长最快的表，表结构按追加写优化：
+- tx_id 为 INTEGER PRIMARY KEY（即 rowid），单调递增，新记录总是追加在 B 树末尾，没有额外的主键索引
+- type / reason 为整数编码；房间引用单独存在 room_id 列，不再拼接 "room:{id}:win" 这样的字符串
+- created_at 为 Unix 时间戳（秒）
+
+旧版本的 ref 字符串由迁移用 parse_ref 拆开，无法识别的原样保存在 note 列。
+"""
+import sqlite3
+
+# 记录类型
+CREDIT = 1
+DEBIT = 2
+FREEZE = 3
+UNFREEZE = 4
+
+TYPES = {CREDIT: "CREDIT", DEBIT: "DEBIT", FREEZE: "FREEZE", UNFREEZE: "UNFREEZE"}
+
+# 每种记录对 users 余额的影响：(available 系数, frozen 系数)
+EFFECTS = {
+    CREDIT: (1, 0),     # 入账到可用余额
+    DEBIT: (0, -1),     # 从冻结余额扣除（结算输掉的押注）
+    FREEZE: (-1, 1),    # 可用 → 冻结
+    UNFREEZE: (1, -1),  # 冻结 → 可用
+}
+
+# 变动原因
+OTHER = 0
+SIGNUP = 1   # 注册赠送
+BET = 2      # 创建/加入房间冻结押注
+WIN = 3      # 结算：胜负
+DRAW = 4     # 结算：平局
+EXPIRED = 5  # 房间过期退款
+
+REASONS = {OTHER: "other", SIGNUP: "signup", BET: "bet", WIN: "win", DRAW: "draw", EXPIRED: "expired"}
+
+# 旧 ref 后缀 → 原因
+_REF_SUFFIXES = {"win": WIN, "draw": DRAW, "expired": EXPIRED}
+
+def record(conn: sqlite3.Connection, entries) -> None:
+    """追加账本记录，entries 为 [(user_id, type, amount, reason, room_id)]"""
+    conn.executemany(
+        "INSERT INTO ledger(user_id, type, amount, reason, room_id) VALUES(?,?,?,?,?)",
+        entries
+    )
+
+def parse_ref(ref: str | None) -> tuple[int, str | None, str | None]:
+    """把旧版本的 ref 字符串拆成 (reason, room_id, note)"""
+    if ref == "signup":
+        return SIGNUP, None, None
+    if ref and ref.startswith("room:"):
+        parts = ref.split(":")
+        if len(parts) == 2 and parts[1]:
+            return BET, parts[1], None
+        if len(parts) == 3 and parts[1] and parts[2] in _REF_SUFFIXES:
+            return _REF_SUFFIXES[parts[2]], parts[1], None
+    return OTHER, None, ref
+
+def describe(row) -> str:
+    """账本记录的可读描述，如 "UNFREEZE 10 (win, room abc123)" """
+    reason = REASONS.get(row["reason"], str(row["reason"]))
+    detail = f"{reason}, room {row['room_id']}" if row["room_id"] else reason
+    if row["note"]:
+        detail += f", {row['note']}"
+    return f"{TYPES.get(row['type'], str(row['type']))} {row['amount']} ({detail})"
@@ -0,0 +1,137 @@
+"""
+大厅房间索引
+
+内存中维护所有 OPEN/FULL 房间，按 (created_at, room_id) 倒序排列，
+创建、加入、开局、过期时由对应的路由增量更新，大厅列表不再查询数据库。
+每次变化递增版本号，用作 ETag，大厅没有变化时返回 304。
+"""
+import bisect
+import threading
+import uuid
+
+# 大厅列表返回的字段
+FIELDS = (
+    "room_id", "host_id", "host_username", "guest_id", "guest_username",
+    "bet_amount", "status", "created_at", "expires_at",
+)
+
+LOBBY_STATUSES = ("OPEN", "FULL")
+
+
+class LobbyIndex:
+    """room_id -> 大厅条目，另有按 (created_at, room_id) 升序排列的键列表"""
+
+    def __init__(self):
+        self._rooms: dict[str, dict] = {}
+        self._keys: list[tuple[str, str]] = []
+        self._lock = threading.Lock()
+        # 进程启动标识 + 版本号，保证重启后 ETag 不会与旧值相同
+        self._boot = uuid.uuid4().hex[:8]
+        self._version = 0
+        self.ready = False
+
+    @property
+    def etag(self) -> str:
+        return f'"{self._boot}-{self._version}"'
+
+    def load(self, fetch) -> int:
+        """用 fetch() 返回的房间行重建索引（fetch 在锁内执行，期间的增量更新会排在之后）"""
+        with self._lock:
+            self._rooms.clear()
+            self._keys.clear()
+            for room in fetch():
+                self._put(dict(room))
+            self._version += 1
+            self.ready = True
+            return len(self._rooms)
+
+    def upsert(self, room) -> None:
+        """加入或更新一个房间；状态不再是 OPEN/FULL 时移出大厅"""
+        room = dict(room)
+        with self._lock:
+            self._drop(room["room_id"])
+            if room["status"] in LOBBY_STATUSES:
+                self._put(room)
+            self._version += 1
+
+    def update(self, room_id: str, **fields) -> None:
+        """修改大厅中已有房间的字段"""
+        with self._lock:
+            entry = self._rooms.get(room_id)
+            if entry is None:
+                return
+            self._drop(room_id)
+            entry.update(fields)
+            if entry["status"] in LOBBY_STATUSES:
+                self._put(entry)
+            self._version += 1
+
+    def remove(self, *room_ids: str) -> None:
+        with self._lock:
+            changed = [self._drop(room_id) for room_id in room_ids]
+            if any(changed):
+                self._version += 1
+
+    def page(
+        self,
+        now: str,
+        limit: int = 50,
+        cursor: str | None = None,
+        min_bet: int | None = None,
+        max_bet: int | None = None,
+    ) -> tuple[list[dict], str | None]:
+        """
+        按创建时间倒序返回一页未过期的房间和下一页游标（没有更多时为 None）
+        cursor 为上一页最后一个房间的 "created_at~room_id"
+        """
+        with self._lock:
+            end = len(self._keys)
+            if cursor:
+                created_at, _, room_id = cursor.rpartition("~")
+                end = bisect.bisect_left(self._keys, (created_at, room_id))
+
+            rooms = []
+            i = end - 1
+            while i >= 0:
+                entry = self._rooms[self._keys[i][1]]
+                i -= 1
+                if entry["expires_at"] <= now:
+                    continue
+                if min_bet is not None and entry["bet_amount"] < min_bet:
+                    continue
+                if max_bet is not None and entry["bet_amount"] > max_bet:
+                    continue
+                if len(rooms) == limit:
+                    last = rooms[-1]
+                    return rooms, f"{last['created_at']}~{last['room_id']}"
+                rooms.append(dict(entry))
+            return rooms, None
+
+    def reset(self) -> None:
+        """清空索引，下次请求时重新从数据库加载"""
+        with self._lock:
+            self._rooms.clear()
+            self._keys.clear()
+            self._version += 1
+            self.ready = False
+
+    def __len__(self) -> int:
+        return len(self._rooms)
+
+    def _put(self, room: dict) -> None:
+        entry = {field: room.get(field) for field in FIELDS}
+        self._rooms[entry["room_id"]] = entry
+        bisect.insort(self._keys, (entry["created_at"], entry["room_id"]))
+
+    def _drop(self, room_id: str) -> bool:
+        entry = self._rooms.pop(room_id, None)
+        if entry is None:
+            return False
+        key = (entry["created_at"], room_id)
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+        return True
+
+
+lobby = LobbyIndex()
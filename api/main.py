@@ -1,27 +1,50 @@
+import gc
 import os
+import time
 import uuid
 import asyncio
+
+# 启动耗时从开始导入本模块算起（uvicorn 先导入 app 再执行 lifespan）
+IMPORT_STARTED = time.perf_counter()
+
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
+from typing import Literal
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import FileResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, RedirectResponse
 from pydantic import BaseModel, Field
 
-from .db import init_db, get_conn
-from .tg_send import send_invite_message, send_game_result
-
-# 导入 Bot 相关
-from aiogram import Bot
-from aiogram.types import Update
-from bot.main import dp  # 导入 dispatcher
-
+# 先加载 .env，下面的模块在导入时读取配置
 load_dotenv()
 
+from . import db, settlement, expiry, service, reconcile, metrics, archive, matchmaking
+from .db import init_db, connection, close_pool
+from .service import (
+    ServiceError, upsert_user, ensure_user, freeze, fetch_room, load_room, publish_room,
+    join_by_id, join_by_invite, init_user, get_user as get_user_info,
+)
+from .activity import activity as user_activity, save as save_activity
+from .clicks import counter as click_counter, save_counts
+from .realtime import hub as room_hub, RESYNC
+from .lobby import lobby
+from .leaderboard import leaderboard, fetch_results as fetch_leaderboard_results
+from .wallets import wallets
+from .scheduler import scheduler
+from .tg_send import TELEGRAM_API_URL, sender as tg_sender, send_invite_message, send_game_result
+from .webhook import updates as webhook_updates
+from .looplag import monitor as loop_monitor
+from .assets import StaticAssets
+from .instance import instance_lock, INSTANCE_LOCK_FILE
+
+# aiogram 和 Bot 处理函数在启动后按需导入（见 load_bot），这里只导入轻量的服务客户端
+from bot import api_client as bot_api
+
+# Bot 与 API 同进程运行（Webhook）：Bot 处理函数直接调用服务层，不再经过 HTTP 回环
+bot_api.use_local(service)
+
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY", "change_me")
-DEFAULT_BALANCE = int(os.getenv("DEFAULT_BALANCE", "1000"))
 DEFAULT_CHAT_ID = int(os.getenv("DEFAULT_CHAT_ID", "0"))  # 默认游戏群组ID
 API_URL = os.getenv("API_URL", "http://127.0.0.1:8000")
 MINIAPP_URL = os.getenv("MINIAPP_URL", "http://127.0.0.1:8000")
@@ -30,9 +53,50 @@ MINIAPP_URL = os.getenv("MINIAPP_URL", "http://127.0.0.1:8000")
 WEBHOOK_PATH = f"/webhook/{BOT_TOKEN}"
 WEBHOOK_URL = API_URL + WEBHOOK_PATH
 
+# 双方 Ready 后的倒计时（秒），结束后由服务端自动开局
+COUNTDOWN_SECONDS = 3
+
+# 定时开局/结算/过期回收失败后首次重试的等待时间（秒），之后按指数退避（见 DeadlineScheduler.retry）
+START_RETRY_SECONDS = 1
+SETTLE_RETRY_SECONDS = 5
+EXPIRE_RETRY_SECONDS = 5
+
+# 点击防作弊：每秒最多计入的点击数、批量提交的最大时间跨度和网络延迟容差
+MAX_TAPS_PER_SECOND = int(os.getenv("MAX_TAPS_PER_SECOND", "20"))
+CLICK_BATCH_MAX_SPAN_MS = 2000
+CLICK_BATCH_GRACE = 1.0
+
+# 点击快照间隔（秒），用于进程崩溃后恢复 PLAYING 房间的点击数
+CLICK_SNAPSHOT_INTERVAL = float(os.getenv("CLICK_SNAPSHOT_INTERVAL", "2"))
+
+# 用户名/活跃时间写回间隔（秒）
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "5"))
+
+# 余额对账间隔（秒），0 表示不在 API 进程内对账
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "300"))
+
+# 已结束房间归档间隔（秒），0 表示不归档
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "600"))
+
+# 关闭时是否删除 Webhook（默认保留：重启/滚动发布期间 Telegram 继续排队更新，新进程启动后照常投递）
+WEBHOOK_DELETE_ON_SHUTDOWN = os.getenv("WEBHOOK_DELETE_ON_SHUTDOWN", "0") == "1"
+
+# 启动耗时目标（秒，导入 + lifespan，不含后台加载的 Bot），超过时启动日志告警
+STARTUP_TARGET_SECONDS = 1.5
+
 # 后台任务控制
-cleanup_task = None
-bot_instance = None
+snapshot_task = None
+activity_task = None
+reconcile_task = None
+archive_task = None
+webhook_task = None
+leaderboard_task = None
+# (Bot, Dispatcher, Update) 的加载任务
+bot_loader: asyncio.Future | None = None
+# 正在进行的排行榜重建（并发的调用方共用同一次）
+leaderboard_loader: asyncio.Future | None = None
+# 启动耗时等信息（/api/internal/stats）
+startup: dict = {}
 
 # --------------------
 # Models
@@ -46,6 +110,12 @@ class CreateRoomIn(BaseModel):
     bet_amount: int = Field(ge=1, le=100000)
     chat_id: int | None = None  # 如果在群上下文创建，就填群 chat_id（负数）
 
+class MatchIn(BaseModel):
+    user: DebugUser
+    bet_amount: int = Field(ge=1, le=100000)
+    chat_id: int | None = None  # 只和同一个群的玩家匹配；不填则不限群
+    wait: float = Field(matchmaking.MATCH_WAIT_SECONDS, ge=0, le=matchmaking.MATCH_WAIT_SECONDS)
+
 class ShareRoomIn(BaseModel):
     user: DebugUser
     chat_id: int | None = None  # 群 chat_id（负数），如果不填则使用默认群组
@@ -65,6 +135,11 @@ class ReadyIn(BaseModel):
 class ClickIn(BaseModel):
     user: DebugUser
 
+class ClickBatchIn(BaseModel):
+    user: DebugUser
+    count: int = Field(ge=1, le=MAX_TAPS_PER_SECOND * CLICK_BATCH_MAX_SPAN_MS // 1000)
+    taps: list[int]  # 每次点击的客户端时间戳（毫秒）
+
 # --------------------
 # Helpers
 # --------------------
@@ -73,278 +148,496 @@ def require_internal(request: Request) -> None:
     if key != INTERNAL_API_KEY:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-def upsert_user(user_id: int, username: str | None) -> None:
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT user_id FROM users WHERE user_id=?", (user_id,))
-    row = cur.fetchone()
-    if row is None:
-        cur.execute(
-            "INSERT INTO users(user_id, username, available, frozen) VALUES(?,?,?,0)",
-            (user_id, username, DEFAULT_BALANCE)
-        )
-        cur.execute(
-            "INSERT INTO ledger(tx_id, user_id, type, amount, ref) VALUES(?,?,?,?,?)",
-            (str(uuid.uuid4()), user_id, "CREDIT", DEFAULT_BALANCE, "signup")
-        )
-    else:
-        cur.execute(
-            "UPDATE users SET username=?, last_active=datetime('now') WHERE user_id=?",
-            (username, user_id)
-        )
-    conn.commit()
-    conn.close()
+def publish_clicks(room_id: str, host_clicks: int, guest_clicks: int) -> None:
+    """推送实时点击数"""
+    room_hub.publish(room_id, {"type": "clicks", "host_clicks": host_clicks, "guest_clicks": guest_clicks})
 
-def freeze(user_id: int, amount: int, ref: str) -> None:
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT available, frozen FROM users WHERE user_id=?", (user_id,))
-    row = cur.fetchone()
-    if not row:
-        raise HTTPException(404, "User not found")
-    if row["available"] < amount:
-        raise HTTPException(400, "Insufficient balance")
-    cur.execute(
-        "UPDATE users SET available=available-?, frozen=frozen+?, last_active=datetime('now') WHERE user_id=?",
-        (amount, amount, user_id)
-    )
-    cur.execute(
-        "INSERT INTO ledger(tx_id, user_id, type, amount, ref) VALUES(?,?,?,?,?)",
-        (str(uuid.uuid4()), user_id, "FREEZE", amount, ref)
-    )
-    conn.commit()
-    conn.close()
-
-def unfreeze(user_id: int, amount: int, ref: str) -> None:
-    """解冻用户资金"""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT available, frozen FROM users WHERE user_id=?", (user_id,))
-    row = cur.fetchone()
-    if not row:
-        raise HTTPException(404, "User not found")
-    if row["frozen"] < amount:
-        raise HTTPException(400, "Insufficient frozen balance")
-    cur.execute(
-        "UPDATE users SET available=available+?, frozen=frozen-?, last_active=datetime('now') WHERE user_id=?",
-        (amount, amount, user_id)
-    )
-    cur.execute(
-        "INSERT INTO ledger(tx_id, user_id, type, amount, ref) VALUES(?,?,?,?,?)",
-        (str(uuid.uuid4()), user_id, "UNFREEZE", amount, ref)
-    )
-    conn.commit()
-    conn.close()
-
-def transfer_frozen(from_user_id: int, to_user_id: int, amount: int, ref: str) -> None:
-    """从一个用户的冻结资金转移到另一个用户的可用余额"""
-    conn = get_conn()
-    cur = conn.cursor()
-
-    # 检查源用户冻结余额
-    cur.execute("SELECT frozen FROM users WHERE user_id=?", (from_user_id,))
-    row = cur.fetchone()
-    if not row:
-        raise HTTPException(404, "Source user not found")
-    if row["frozen"] < amount:
-        raise HTTPException(400, "Insufficient frozen balance")
-
-    # 扣除源用户冻结余额
-    cur.execute(
-        "UPDATE users SET frozen=frozen-?, last_active=datetime('now') WHERE user_id=?",
-        (amount, from_user_id)
-    )
-    cur.execute(
-        "INSERT INTO ledger(tx_id, user_id, type, amount, ref) VALUES(?,?,?,?,?)",
-        (str(uuid.uuid4()), from_user_id, "DEBIT", amount, ref)
-    )
-
-    # 增加目标用户可用余额
-    cur.execute(
-        "UPDATE users SET available=available+?, last_active=datetime('now') WHERE user_id=?",
-        (amount, to_user_id)
-    )
-    cur.execute(
-        "INSERT INTO ledger(tx_id, user_id, type, amount, ref) VALUES(?,?,?,?,?)",
-        (str(uuid.uuid4()), to_user_id, "CREDIT", amount, ref)
-    )
-
-    conn.commit()
-    conn.close()
+async def expire_rooms(room_ids: list[str], trigger: str = "timer") -> int:
+    """
+    取消到期的房间并退还押注（一个写命令），返回取消的房间数量
+    无法退款的房间移出大厅（已过期，不能再加入），按指数退避重新登记，修复余额后自动取消
+    """
+    with metrics.expiry_sweep_duration.time(trigger):
+        cancelled, failed = await db.write(expiry.expire_rooms, room_ids, datetime.utcnow().isoformat())
+        lobby.remove(*(room["room_id"] for room in cancelled), *failed)
 
-def cleanup_expired_rooms() -> int:
+        for room in cancelled:
+            scheduler.done("expire", room["room_id"])
+            print(f"🧹 清理过期房间: {room['room_id']} (状态: {room['status']})")
+            await db.run(publish_room, room["room_id"])
+        for room_id in failed:
+            delay = scheduler.retry("expire", room_id, EXPIRE_RETRY_SECONDS)
+            print(f"❌ 过期房间 {room_id} 无法退款，{delay:g}秒后重试")
+    metrics.rooms_expired.inc(amount=len(cancelled))
+    metrics.rooms_expire_failed.inc(amount=len(failed))
+    return len(cancelled)
+
+async def cleanup_expired_rooms() -> int:
     """
-    清理过期房间并退还押注
+    清理所有已过期的房间并退还押注（手动/兜底使用，平时由定时器按房间到期时间回收）
     返回清理的房间数量
     """
-    conn = get_conn()
-    cur = conn.cursor()
-
-    # 查找所有过期的房间 (使用expires_at字段)
-    cur.execute("""
-        SELECT * FROM rooms
-        WHERE status IN ('OPEN', 'FULL')
-        AND datetime(expires_at) < datetime('now')
-    """)
-
-    expired_rooms = cur.fetchall()
-    cleaned_count = 0
-
-    for room in expired_rooms:
+    def expired():
+        with connection() as conn:
+            # expires_at 为 ISO-8601 UTC 字符串，可直接比较并走索引
+            return [row["room_id"] for row in conn.execute("""
+                SELECT room_id FROM rooms
+                WHERE status IN ('OPEN', 'FULL')
+                AND expires_at < ?
+            """, (datetime.utcnow().isoformat(),))]
+
+    return await expire_rooms(await db.run(expired), trigger="sweep")
+
+async def snapshot_clicks() -> int:
+    """把内存中有变化的点击计数写回数据库，写入失败时下次重试"""
+    rows = click_counter.take_dirty()
+    if rows:
         try:
-            # 退还房主押注
-            unfreeze(room['host_id'], room['bet_amount'], ref=f"room:{room['room_id']}:expired")
-
-            # 如果客人已加入,也退还客人押注
-            if room['guest_id']:
-                unfreeze(room['guest_id'], room['bet_amount'], ref=f"room:{room['room_id']}:expired")
+            await db.write(save_counts, rows)
+        except Exception:
+            click_counter.restore_dirty(rows)
+            raise
+    return len(rows)
+
+async def periodic_click_snapshot():
+    """定期保存点击计数快照的后台任务"""
+    while True:
+        try:
+            await asyncio.sleep(CLICK_SNAPSHOT_INTERVAL)
+            await snapshot_clicks()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ 点击快照出错: {e}")
 
-            # 更新房间状态为CANCELLED
-            cur.execute("UPDATE rooms SET status='CANCELLED' WHERE room_id=?", (room['room_id'],))
-            cleaned_count += 1
+async def flush_activity() -> int:
+    """把合并后的用户名/活跃时间一次性写回数据库，写入失败时下次重试"""
+    rows = user_activity.take()
+    if rows:
+        try:
+            await db.write(save_activity, rows)
+        except Exception:
+            user_activity.restore(rows)
+            raise
+    return len(rows)
+
+async def periodic_activity_flush():
+    """定期写回用户活跃记录的后台任务"""
+    while True:
+        try:
+            await asyncio.sleep(ACTIVITY_FLUSH_INTERVAL)
+            await flush_activity()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ 写回用户活跃记录出错: {e}")
 
-            print(f"🧹 清理过期房间: {room['room_id']} (状态: {room['status']})")
+async def periodic_reconcile():
+    """定期增量对账（只检查上次检查点之后的账本记录）"""
+    while True:
+        try:
+            await asyncio.sleep(RECONCILE_INTERVAL)
+            report = await reconcile.reconcile()
+            if report.drift:
+                print(f"⚠️ 对账发现 {len(report.drift)} 个用户余额与账本不一致")
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            print(f"❌ 清理房间 {room['room_id']} 失败: {e}")
-            continue
+            print(f"❌ 余额对账出错: {e}")
 
-    conn.commit()
-    conn.close()
+async def periodic_archive():
+    """定期把已结束的旧房间移到归档表"""
+    while True:
+        try:
+            await asyncio.sleep(ARCHIVE_INTERVAL)
+            archived = await archive.archive_rooms()
+            if archived:
+                print(f"📦 归档了 {archived} 个已结束的房间")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ 归档房间出错: {e}")
 
-    return cleaned_count
+async def on_expire_due(room_ids: list[str]) -> None:
+    """房间到期：批量取消并退款"""
+    try:
+        cleaned = await expire_rooms(room_ids)
+        if cleaned > 0:
+            print(f"✅ 清理了 {cleaned} 个过期房间")
+    except Exception as e:
+        print(f"❌ 清理过期房间出错: {e}")
+        for room_id in room_ids:
+            scheduler.retry("expire", room_id, EXPIRE_RETRY_SECONDS)
+
+def timer_failed(kind: str, room_id: str, error: Exception, base: float) -> None:
+    """自动开局/结算失败：计数并按指数退避重试，房间不会一直停在 COUNTDOWN/PLAYING"""
+    delay = scheduler.retry(kind, room_id, base)
+    metrics.timer_failures.inc(kind)
+    action = "开局" if kind == "start" else "结算"
+    print(f"❌ 房间 {room_id} 自动{action}失败: {error}，{delay:g}秒后重试")
+
+async def on_countdown_due(room_ids: list[str]) -> None:
+    """倒计时结束：自动开局"""
+    for room_id in room_ids:
+        try:
+            await begin_game(room_id)
+        except ServiceError as e:
+            if e.status_code == 404 or e.detail.startswith("Room is not in countdown"):
+                scheduler.done("start", room_id)  # 房间已被删除或取消，不再需要开局
+            else:
+                timer_failed("start", room_id, e, START_RETRY_SECONDS)
+        except Exception as e:
+            timer_failed("start", room_id, e, START_RETRY_SECONDS)
+        else:
+            scheduler.done("start", room_id)
 
-async def periodic_cleanup():
-    """定期清理过期房间的后台任务"""
-    print("🚀 后台清理任务已启动")
-    while True:
+async def on_game_due(room_ids: list[str]) -> None:
+    """游戏时间到：自动结算"""
+    for room_id in room_ids:
         try:
-            await asyncio.sleep(30)  # 每30秒检查一次
-            cleaned = cleanup_expired_rooms()
-            if cleaned > 0:
-                print(f"✅ 清理了 {cleaned} 个过期房间")
+            await finish_room(room_id)
+        except ServiceError as e:
+            if e.status_code == 404 or e.detail == "Game is not playing":
+                scheduler.done("settle", room_id)  # 房间已被删除或取消，不再需要结算
+            else:
+                timer_failed("settle", room_id, e, SETTLE_RETRY_SECONDS)
         except Exception as e:
-            print(f"❌ 清理任务出错: {e}")
+            timer_failed("settle", room_id, e, SETTLE_RETRY_SECONDS)
+        else:
+            scheduler.done("settle", room_id)
+
+scheduler.on("start", on_countdown_due)
+scheduler.on("settle", on_game_due)
+scheduler.on("expire", on_expire_due)
+
+def load_lobby() -> int:
+    """从数据库重建大厅索引"""
+    def fetch():
+        with connection() as conn:
+            return conn.execute("""
+                SELECT room_id, host_id, host_username, guest_id, guest_username,
+                       bet_amount, status, created_at, expires_at
+                FROM rooms
+                WHERE status IN ('OPEN', 'FULL')
+                AND expires_at > ?
+            """, (datetime.utcnow().isoformat(),)).fetchall()
+    return lobby.load(fetch)
+
+def load_leaderboard() -> int:
+    """从账本重建排行榜"""
+    def fetch():
+        with connection() as conn:
+            return fetch_leaderboard_results(conn)
+    return leaderboard.load(fetch)
+
+def leaderboard_loading() -> asyncio.Future:
+    """开始（或返回正在进行的）排行榜重建；完成后清除，下一次调用重新读取账本"""
+    global leaderboard_loader
+    if leaderboard_loader is None:
+        leaderboard_loader = asyncio.ensure_future(db.run(load_leaderboard))
+        leaderboard_loader.add_done_callback(_leaderboard_loaded)
+    return leaderboard_loader
+
+def _leaderboard_loaded(future: asyncio.Future) -> None:
+    global leaderboard_loader
+    if leaderboard_loader is future:
+        leaderboard_loader = None
+
+async def preload_leaderboard() -> None:
+    """启动后在后台从账本加载排行榜（要扫描全部 WIN/DRAW 记录，账本很大时需要数秒到数十秒）"""
+    started = time.perf_counter()
+    try:
+        boards = await asyncio.shield(leaderboard_loading())
+    except Exception as e:
+        print(f"❌ 加载排行榜出错: {e}（首次查询排行榜时重试）")
+        return
+    startup["leaderboard_seconds"] = round(time.perf_counter() - started, 3)
+    print(f"✅ 排行榜已从账本加载 ({boards} 个榜单，{startup['leaderboard_seconds']:.2f}秒)")
+
+def arm_pending_rooms() -> int:
+    """启动时从数据库恢复所有未结束房间的定时器（停机期间已到期的会立即处理）"""
+    with connection() as conn:
+        waiting = conn.execute(
+            "SELECT room_id, expires_at FROM rooms WHERE status IN ('OPEN', 'FULL') ORDER BY expires_at"
+        ).fetchall()
+        rooms = conn.execute(
+            "SELECT room_id, status, countdown_start_time, game_start_time FROM rooms WHERE status IN ('COUNTDOWN', 'PLAYING')"
+        ).fetchall()
+
+    for room in waiting:
+        scheduler.arm("expire", room["room_id"], room["expires_at"])
+
+    for room in rooms:
+        if room["status"] == "COUNTDOWN":
+            start = datetime.fromisoformat(room["countdown_start_time"]) if room["countdown_start_time"] else datetime.utcnow()
+            scheduler.arm("start", room["room_id"], start + timedelta(seconds=COUNTDOWN_SECONDS))
+        else:
+            scheduler.arm("settle", room["room_id"], settle_deadline(room["game_start_time"] or datetime.utcnow().isoformat()))
+    return len(waiting) + len(rooms)
+
+# --------------------
+# Telegram Bot（按需导入）
+# --------------------
+def _import_bot():
+    """导入 aiogram 和 Bot 处理函数并创建 Bot（需要数秒，在线程中执行）"""
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.types import Update
+    from bot.main import dp  # 导入 dispatcher
+
+    # 与发送队列使用同一个 Bot API 地址（可指向本地桩服务）
+    bot = Bot(BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+    return bot, dp, Update
+
+def _bot_loaded(future: asyncio.Future) -> None:
+    """Bot 加载完成（在事件循环中回调）：aiogram 的模块对象同样常驻内存，回收一次后移出 GC 跟踪（见 lifespan）"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    gc.collect()
+    gc.freeze()
+
+def bot_loading() -> asyncio.Future:
+    """开始（或返回已开始的）Bot 加载任务"""
+    global bot_loader
+    if bot_loader is None:
+        bot_loader = asyncio.ensure_future(asyncio.to_thread(_import_bot))
+        bot_loader.add_done_callback(_bot_loaded)
+    return bot_loader
+
+async def load_bot():
+    """返回 (Bot, Dispatcher, Update)，还在加载时等待加载完成"""
+    return await asyncio.shield(bot_loading())
+
+async def register_webhook(bot) -> bool:
+    """注册 Webhook；Telegram 上已经是 WEBHOOK_URL 时跳过（不丢弃积压的更新），返回是否重新注册"""
+    info = await bot.get_webhook_info()
+    if info.url == WEBHOOK_URL:
+        return False
+    await bot.set_webhook(url=WEBHOOK_URL, drop_pending_updates=True)
+    return True
+
+async def setup_webhook() -> None:
+    """启动后的后台任务：等 Bot 加载完成后检查并注册 Webhook"""
+    try:
+        bot, _, _ = await load_bot()
+        if await register_webhook(bot):
+            print(f"✅ Telegram Webhook 已设置: {WEBHOOK_URL}")
+        else:
+            print("✅ Telegram Webhook 已是当前地址，跳过注册")
+    except Exception as e:
+        print(f"❌ 设置 Telegram Webhook 失败: {e}")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """应用生命周期管理"""
+    """
+    应用生命周期管理
+    只支持单进程运行：点击计数、余额缓存、大厅、定时器、匹配队列等都在进程内存中（见 api/instance.py），
+    同一个数据库已有其他 API 进程时拒绝启动
+    """
     # 启动时
-    init_db()
-    global cleanup_task, bot_instance
-    cleanup_task = asyncio.create_task(periodic_cleanup())
-
-    # 设置 Telegram Webhook
-    bot_instance = Bot(BOT_TOKEN)
-    await bot_instance.set_webhook(
-        url=WEBHOOK_URL,
-        drop_pending_updates=True
+    lifespan_started = time.perf_counter()
+    await instance_lock.acquire(INSTANCE_LOCK_FILE or f"{db.DB_PATH}.lock")
+    await db.run(init_db)
+    room_hub.bind(asyncio.get_running_loop())
+    loop_monitor.start()
+    tg_sender.start(BOT_TOKEN)
+    scheduler.start()
+    await db.run(load_lobby)
+    armed = await db.run(arm_pending_rooms)
+    global snapshot_task, activity_task, reconcile_task, archive_task, webhook_task, leaderboard_task
+    # 排行榜不阻塞启动：加载完成前查询排行榜的请求等待同一次加载
+    leaderboard_task = asyncio.create_task(preload_leaderboard())
+    snapshot_task = asyncio.create_task(periodic_click_snapshot())
+    activity_task = asyncio.create_task(periodic_activity_flush())
+    if RECONCILE_INTERVAL > 0:
+        reconcile_task = asyncio.create_task(periodic_reconcile())
+    if ARCHIVE_INTERVAL > 0:
+        archive_task = asyncio.create_task(periodic_archive())
+
+    if BOT_TOKEN:
+        # 在后台加载 Bot 并注册 Webhook，不阻塞启动；第一条更新到达时还没加载完就等待
+        bot_loading()
+        webhook_updates.start(handle_update)
+        webhook_task = asyncio.create_task(setup_webhook())
+
+    miniapp_files = miniapp_assets.load()
+    # 导入的模块和启动时加载的索引常驻内存，移出 GC 跟踪：否则每次全量回收都要扫描它们，
+    # 事件循环随之停顿数十毫秒（压测中最大的停顿来源）
+    gc.collect()
+    gc.freeze()
+    startup.update(
+        armed=armed,
+        import_seconds=round(IMPORT_SECONDS, 3),
+        lifespan_seconds=round(time.perf_counter() - lifespan_started, 3),
+        seconds=round(time.perf_counter() - IMPORT_STARTED, 3),
     )
 
     print("=" * 60)
-    print("🎮 LGW33 API 服务已启动")
+    print(f"🎮 LGW33 API 服务已启动 (pid {os.getpid()})")
     print("=" * 60)
     print("✅ 数据库已初始化")
-    print("✅ 后台清理任务已启动 (每30秒检查一次)")
+    print(f"✅ 点击快照任务已启动 (每{CLICK_SNAPSHOT_INTERVAL:g}秒保存一次)")
+    print(f"✅ 用户活跃记录每{ACTIVITY_FLUSH_INTERVAL:g}秒批量写回")
+    if reconcile_task:
+        print(f"✅ 余额对账任务已启动 (每{RECONCILE_INTERVAL:g}秒增量对账一次)")
+    if archive_task:
+        print(f"✅ 房间归档任务已启动 (每{ARCHIVE_INTERVAL:g}秒归档一次，结束超过{archive.ARCHIVE_AFTER_HOURS:g}小时的房间)")
+    print("✅ 排行榜在后台从账本加载")
+    print(f"✅ 房间定时器已启动 (自动开局/结算/过期回收，恢复 {armed} 个房间)")
     print("   - OPEN状态房间: 5分钟后自动关闭")
     print("   - FULL状态房间: 2分钟后自动关闭")
-    print(f"✅ Telegram Webhook 已设置: {WEBHOOK_URL}")
+    print(f"✅ Telegram 发送队列已启动 (每个群每{tg_sender.group_interval:g}秒最多1条)")
+    if BOT_TOKEN:
+        print(f"✅ Webhook 队列已启动 ({webhook_updates.workers} 个 worker，容量 {webhook_updates.size})，Bot 在后台加载")
+    else:
+        print("⚠️ 未配置 BOT_TOKEN，不处理 Telegram 更新")
+    if miniapp_assets.built:
+        print(f"✅ Mini App 静态资源: {miniapp_assets.root} ({len(miniapp_files)} 个文件，预压缩 + 内容哈希)")
+        if miniapp_assets.stale():
+            print("⚠️ miniapp/ 有比构建结果更新的文件，请重新运行 python build_assets.py")
+    else:
+        print("⚠️ Mini App 未构建，直接提供源文件（无压缩、无长期缓存），部署前运行 python build_assets.py")
+    print(f"✅ 启动用时 {startup['seconds']:.2f}秒 (导入 {startup['import_seconds']:.2f}秒)")
+    if startup["seconds"] > STARTUP_TARGET_SECONDS:
+        print(f"⚠️ 启动用时超过目标 {STARTUP_TARGET_SECONDS:g}秒")
     print("=" * 60)
 
     yield
 
     # 关闭时
-    if cleanup_task:
-        cleanup_task.cancel()
-        try:
-            await cleanup_task
-        except asyncio.CancelledError:
-            pass
-
-    # 删除 Webhook
-    if bot_instance:
-        await bot_instance.delete_webhook()
-        await bot_instance.session.close()
+    await scheduler.stop()
+    await webhook_updates.stop()
+    for task in (snapshot_task, activity_task, reconcile_task, archive_task, webhook_task, leaderboard_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    # 还没完成的排行榜重建不再等待（数据库线程中的查询自行结束）
+    if leaderboard_loader is not None:
+        leaderboard_loader.cancel()
+
+    # 尽量发完排队中的消息
+    await tg_sender.stop()
+
+    # 保存最后一次点击快照和活跃记录，处理完排队中的写命令
+    await snapshot_clicks()
+    await flush_activity()
+    await db.run(close_pool)
+    await loop_monitor.stop()
+
+    # 默认保留 Webhook（重启期间 Telegram 继续排队更新，新进程启动后照常投递）
+    if bot_loader is not None and bot_loader.done() and not bot_loader.cancelled() and bot_loader.exception() is None:
+        bot, _, _ = bot_loader.result()
+        if WEBHOOK_DELETE_ON_SHUTDOWN:
+            await bot.delete_webhook()
+        await bot.session.close()
+    # 最后释放单实例锁，等待中的新进程此时才开始启动
+    instance_lock.release()
 
     print("👋 LGW33 API 服务已关闭")
 
 app = FastAPI(title="LGW33 PK MVP", lifespan=lifespan)
+# 按路由模板记录请求耗时；Webhook 路径中含 Bot token，不能出现在标签里
+app.add_middleware(metrics.MetricsMiddleware, hidden={WEBHOOK_PATH: "/webhook/{token}"})
+
+@app.exception_handler(ServiceError)
+async def service_error_handler(request: Request, exc: ServiceError):
+    """服务层错误映射为 HTTP 错误（与 HTTPException 相同的响应格式）"""
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
 
 # --------------------
 # Telegram Webhook
 # --------------------
+async def handle_update(update_data: dict) -> None:
+    """Webhook worker：把更新交给 Bot dispatcher 处理（Bot 还在加载时先等待）"""
+    bot, dp, Update = await load_bot()
+    await dp.feed_update(bot, Update(**update_data))
+
 @app.post(WEBHOOK_PATH)
 async def telegram_webhook(request: Request):
-    """接收 Telegram Webhook 更新"""
+    """接收 Telegram Webhook 更新（入队后立即返回，由后台 worker 处理）"""
     try:
         update_data = await request.json()
-        update = Update(**update_data)
-
-        # 使用全局 bot 实例处理更新
-        if bot_instance:
-            await dp.feed_update(bot_instance, update)
-
-        return {"ok": True}
     except Exception as e:
         print(f"❌ Webhook 处理错误: {e}")
         return {"ok": False, "error": str(e)}
 
+    # 未配置 BOT_TOKEN，没有启动队列：与队列已满区分开，重试也不会成功
+    if not webhook_updates.running:
+        return JSONResponse(status_code=404, content={"ok": False, "error": "Webhook disabled"})
+
+    # 队列已满：返回 503 让 Telegram 稍后重试
+    if not webhook_updates.submit(update_data):
+        return JSONResponse(status_code=503, content={"ok": False, "error": "Webhook queue is full"})
+
+    return {"ok": True}
+
 # --------------------
 # Routes
 # --------------------
 @app.get("/api/health")
-def health():
+async def health():
     return {"ok": True}
 
 @app.get("/api/users/{user_id}")
-def get_user(user_id: int):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT user_id, username, available, frozen FROM users WHERE user_id=?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    if not row:
-        raise HTTPException(404, "Not found")
-    return dict(row)
+async def get_user(user_id: int):
+    return await get_user_info(user_id)
 
-@app.post("/api/rooms")
-def create_room(body: CreateRoomIn):
+def _create_room(conn, body: CreateRoomIn, room_id: str, invite_token: str, expires_at: datetime):
     # Debug/MVP: 先用 body.user 作为身份；上线后再换 WebApp initData 验签
-    upsert_user(body.user.user_id, body.user.username)
+    upsert_user(conn, body.user.user_id, body.user.username)
+
+    # 冻结房主押注
+    freeze(conn, body.user.user_id, body.bet_amount, room_id)
+
+    return conn.execute(
+        """INSERT INTO rooms(room_id, chat_id, host_id, host_username, bet_amount, status, invite_token, expires_at)
+           VALUES(?,?,?,?,?,?,?,?) RETURNING *""",
+        (room_id, body.chat_id, body.user.user_id, body.user.username, body.bet_amount, "OPEN", invite_token, expires_at.isoformat())
+    ).fetchone()
 
+@app.post("/api/rooms")
+async def create_room(body: CreateRoomIn):
     room_id = uuid.uuid4().hex[:12]
     invite_token = uuid.uuid4().hex  # 可以换成更短token
     # OPEN状态: 5分钟后过期
     expires_at = datetime.utcnow() + timedelta(minutes=5)
 
-    # 冻结房主押注
-    freeze(body.user.user_id, body.bet_amount, ref=f"room:{room_id}")
+    room = await db.write(_create_room, body, room_id, invite_token, expires_at)
+    scheduler.arm("expire", room_id, expires_at)
+    lobby.upsert(room)
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """INSERT INTO rooms(room_id, chat_id, host_id, host_username, bet_amount, status, invite_token, expires_at)
-           VALUES(?,?,?,?,?,?,?,?)""",
-        (room_id, body.chat_id, body.user.user_id, body.user.username, body.bet_amount, "OPEN", invite_token, expires_at.isoformat())
+    return {"room_id": room_id, "invite_token": invite_token, "bet_amount": body.bet_amount, "expires_at": expires_at.isoformat()}
+
+@app.post("/api/match")
+async def quick_match(body: MatchIn):
+    """
+    快速匹配（长轮询）：配对成功时房间已是 FULL 状态、双方押注已冻结，返回 status=matched 和 room_id；
+    wait 秒内没有配对时返回 status=waiting，客户端再次调用继续排队
+    """
+    return await matchmaking.quick_match(
+        body.user.user_id, body.user.username, body.bet_amount, body.chat_id, body.wait
     )
-    conn.commit()
-    conn.close()
 
-    return {"room_id": room_id, "invite_token": invite_token, "bet_amount": body.bet_amount, "expires_at": expires_at.isoformat()}
+@app.post("/api/match/cancel")
+async def cancel_match(body: ReadyIn):
+    """取消排队（已经配对成功时返回 cancelled=false）"""
+    return {"ok": True, "cancelled": matchmaking.cancel(body.user.user_id)}
 
 @app.post("/api/rooms/{room_id}/share")
 async def share_room(room_id: str, body: ShareRoomIn):
-    upsert_user(body.user.user_id, body.user.username)
-
     # 使用默认群组ID（如果未提供）
     chat_id = body.chat_id if body.chat_id else DEFAULT_CHAT_ID
+
+    await ensure_user(body.user.user_id, body.user.username)
+    room = await db.run(load_room, room_id)
+
     if not chat_id:
         raise HTTPException(400, "No chat_id provided and no default chat_id configured")
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM rooms WHERE room_id=?", (room_id,))
-    room = cur.fetchone()
-    conn.close()
     if not room:
         raise HTTPException(404, "Room not found")
 
@@ -362,150 +655,186 @@ async def share_room(room_id: str, body: ShareRoomIn):
         f"💡 点击下方按钮前往机器人，在【可加入房间】列表中找到此房间并加入！"
     )
 
-    try:
-        print(f"[DEBUG] Sending invite message to chat_id={chat_id}")
-        await send_invite_message(
-            bot_token=BOT_TOKEN,
-            chat_id=chat_id,
-            text=text,
-            invite_token=room["invite_token"]
-        )
-        print(f"[DEBUG] Invite message sent successfully")
-    except Exception as e:
-        print(f"[ERROR] Failed to send invite message: {e}")
-        raise HTTPException(500, f"Failed to send invite message: {str(e)}")
+    # 入队即返回，由后台发送队列按群限流发出
+    if not send_invite_message(chat_id=chat_id, text=text, invite_token=room["invite_token"]):
+        raise HTTPException(503, "Message queue unavailable")
 
     # 记录 chat_id（方便后续播报）
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE rooms SET chat_id=? WHERE room_id=?", (chat_id, room_id))
-    conn.commit()
-    conn.close()
+    def save_chat(conn):
+        conn.execute("UPDATE rooms SET chat_id=? WHERE room_id=?", (chat_id, room_id))
+
+    await db.write(save_chat)
 
     return {"ok": True}
 
 @app.get("/api/rooms/{room_id}")
-def get_room(room_id: str):
-    """获取房间完整状态"""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM rooms WHERE room_id=?", (room_id,))
-    room = cur.fetchone()
-    conn.close()
-
+async def get_room(room_id: str):
+    """获取房间完整状态（WebSocket 不可用时前端轮询使用）"""
+    room = await db.run(load_room, room_id)
     if not room:
         raise HTTPException(404, "Room not found")
 
-    return dict(room)
+    return room
+
+@app.websocket("/ws/rooms/{room_id}")
+async def room_ws(websocket: WebSocket, room_id: str):
+    """房间实时通道：连接后先发送完整状态，之后推送状态变化和点击数"""
+    await websocket.accept()
+    queue = room_hub.subscribe(room_id)
+
+    async def receive():
+        # 只用于感知客户端断开（客户端可发送任意心跳）
+        while True:
+            await websocket.receive_text()
+
+    async def send():
+        message = RESYNC
+        while True:
+            if message is RESYNC:
+                room = await db.run(load_room, room_id)
+                if not room:
+                    await websocket.close(code=4404)
+                    return
+                message = {"type": "room", "room": room}
+            await websocket.send_json(message)
+            message = await queue.get()
+
+    tasks = [asyncio.create_task(receive()), asyncio.create_task(send())]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled() and task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                print(f"❌ WebSocket 推送错误: {task.exception()}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        room_hub.unsubscribe(room_id, queue)
 
 @app.get("/api/rooms/open/list")
-def get_open_rooms():
-    """获取所有开放状态的房间列表"""
-    conn = get_conn()
-    cur = conn.cursor()
+async def get_open_rooms(
+    request: Request,
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(50, ge=1, le=100),
+    min_bet: int | None = Query(None, ge=0),
+    max_bet: int | None = Query(None, ge=0),
+):
+    """
+    获取开放状态的房间列表（按创建时间倒序，直接返回数组）
+    下一页游标在 X-Next-Cursor 响应头中；大厅没有变化时返回 304
+    """
+    if not lobby.ready:
+        await db.run(load_lobby)
 
-    # 查询所有OPEN和FULL状态的房间,按创建时间倒序
-    cur.execute("""
-        SELECT room_id, host_id, host_username, guest_id, guest_username,
-               bet_amount, status, created_at, expires_at
-        FROM rooms
-        WHERE status IN ('OPEN', 'FULL')
-        AND datetime(expires_at) > datetime('now')
-        ORDER BY created_at DESC
-        LIMIT 50
-    """)
+    etag = lobby.etag
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
 
-    rooms = cur.fetchall()
-    conn.close()
+    rooms, next_cursor = lobby.page(
+        datetime.utcnow().isoformat(), limit=limit, cursor=cursor, min_bet=min_bet, max_bet=max_bet
+    )
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
 
-    # 转换为字典列表，直接返回数组
-    room_list = [dict(room) for room in rooms]
+    return rooms
 
-    return room_list
+def _user_rooms(user_id: int) -> dict:
+    with connection() as conn:
+        cur = conn.cursor()
 
-@app.get("/api/users/{user_id}/rooms")
-def get_user_rooms(user_id: int):
-    """获取用户当前参与的房间"""
-    conn = get_conn()
-    cur = conn.cursor()
-
-    # 查询用户作为房主或客人的所有未结束房间
-    cur.execute("""
-        SELECT * FROM rooms
-        WHERE (host_id=? OR guest_id=?)
-        AND status NOT IN ('FINISHED', 'CANCELLED')
-        ORDER BY created_at DESC
-    """, (user_id, user_id))
+        # 查询用户作为房主或客人的所有未结束房间
+        cur.execute("""
+            SELECT * FROM rooms
+            WHERE (host_id=? OR guest_id=?)
+            AND status IN ('OPEN', 'FULL', 'COUNTDOWN', 'PLAYING')
+            ORDER BY created_at DESC
+        """, (user_id, user_id))
 
-    rooms = cur.fetchall()
-    conn.close()
+        rooms = cur.fetchall()
 
     # 转换为字典列表
-    room_list = [dict(room) for room in rooms]
+    room_list = [click_counter.overlay(dict(room)) for room in rooms]
 
     return {"rooms": room_list, "count": len(room_list)}
 
+@app.get("/api/users/{user_id}/rooms")
+async def get_user_rooms(user_id: int):
+    """获取用户当前参与的房间"""
+    return await db.run(_user_rooms, user_id)
+
+@app.get("/api/leaderboard")
+async def get_leaderboard(
+    metric: Literal["wins", "net", "games"] = "wins",
+    window: Literal["all", "day", "week"] = "all",
+    chat_id: int | None = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+):
+    """排行榜（window 为 day/week 时是 UTC 今日/本周；chat_id 为空时是全局榜）"""
+    if not leaderboard.ready:
+        await asyncio.shield(leaderboard_loading())
+    total, entries = leaderboard.top(metric, window, chat_id, limit, offset)
+
+    # 补上用户名（最多 limit 个主键查询）
+    if entries:
+        def usernames(user_ids):
+            marks = ",".join("?" * len(user_ids))
+            with connection() as conn:
+                return dict(conn.execute(f"SELECT user_id, username FROM users WHERE user_id IN ({marks})", user_ids).fetchall())
+        names = await db.run(usernames, [entry["user_id"] for entry in entries])
+        for entry in entries:
+            entry["username"] = names.get(entry["user_id"])
+
+    return {"metric": metric, "window": window, "chat_id": chat_id, "total": total, "entries": entries}
+
+@app.get("/api/leaderboard/users/{user_id}")
+async def get_leaderboard_rank(
+    user_id: int,
+    metric: Literal["wins", "net", "games"] = "wins",
+    window: Literal["all", "day", "week"] = "all",
+    chat_id: int | None = None,
+):
+    """用户在排行榜上的名次（不在榜上时 rank 为 null）"""
+    if not leaderboard.ready:
+        await asyncio.shield(leaderboard_loading())
+    total, entry = leaderboard.rank(user_id, metric, window, chat_id)
+    return {
+        "metric": metric, "window": window, "chat_id": chat_id, "total": total,
+        **(entry or {"rank": None, "user_id": user_id, "wins": 0, "net": 0, "games": 0}),
+    }
+
+def _user_history(user_id: int, limit: int, cursor: str | None) -> dict:
+    with connection() as conn:
+        rooms, next_cursor = archive.user_history(conn, user_id, limit, cursor)
+    return {"rooms": rooms, "next_cursor": next_cursor}
+
+@app.get("/api/users/{user_id}/history")
+async def get_user_history(user_id: int, cursor: str | None = None, limit: int = Query(20, ge=1, le=100)):
+    """获取用户已结束的对局（包括已归档的房间），按创建时间倒序；下一页传入返回的 next_cursor"""
+    return await db.run(_user_history, user_id, limit, cursor)
+
 class JoinRoomByIdIn(BaseModel):
     user: DebugUser
 
 @app.post("/api/rooms/{room_id}/join")
-def join_room_by_id(room_id: str, body: JoinRoomByIdIn):
+async def join_room_by_id(room_id: str, body: JoinRoomByIdIn):
     """用户通过房间ID加入房间（MiniApp使用）"""
-    upsert_user(body.user.user_id, body.user.username)
+    return await join_by_id(room_id, body.user.user_id, body.user.username)
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM rooms WHERE room_id=?", (room_id,))
-    room = cur.fetchone()
-    if not room:
-        conn.close()
-        raise HTTPException(404, "Room not found")
+def _ready_room(conn, room_id: str, body: ReadyIn) -> datetime | None:
+    """记录 Ready（写命令），双方都 Ready 时进入倒计时并返回倒计时开始时间"""
+    upsert_user(conn, body.user.user_id, body.user.username)
 
-    if room["status"] != "OPEN":
-        conn.close()
-        raise HTTPException(400, "Room not open")
-
-    if room["host_id"] == body.user.user_id:
-        conn.close()
-        raise HTTPException(400, "Host cannot join own room")
-
-    # 冻结挑战者押注
-    freeze(body.user.user_id, room["bet_amount"], ref=f"room:{room_id}")
-
-    # 加入房间，更新过期时间为2分钟后
-    new_expires_at = datetime.utcnow() + timedelta(minutes=2)
-    cur.execute(
-        "UPDATE rooms SET guest_id=?, guest_username=?, status='FULL', expires_at=? WHERE room_id=?",
-        (body.user.user_id, body.user.username, new_expires_at.isoformat(), room_id)
-    )
-    conn.commit()
-    conn.close()
-
-    return {
-        "ok": True,
-        "room_id": room_id,
-        "bet_amount": room["bet_amount"],
-        "host_id": room["host_id"],
-        "guest_id": body.user.user_id
-    }
-
-@app.post("/api/rooms/{room_id}/ready")
-def ready_room(room_id: str, body: ReadyIn):
-    """玩家点击Ready"""
-    upsert_user(body.user.user_id, body.user.username)
-
-    conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM rooms WHERE room_id=?", (room_id,))
-    room = cur.fetchone()
+    room = fetch_room(conn, room_id)
 
     if not room:
-        conn.close()
-        raise HTTPException(404, "Room not found")
+        raise ServiceError(404, "Room not found")
 
     if room["status"] != "FULL":
-        conn.close()
-        raise HTTPException(400, "Room is not full")
+        raise ServiceError(400, "Room is not full")
 
     # 判断是房主还是客人
     if room["host_id"] == body.user.user_id:
@@ -513,111 +842,173 @@ def ready_room(room_id: str, body: ReadyIn):
     elif room["guest_id"] == body.user.user_id:
         cur.execute("UPDATE rooms SET guest_ready=1 WHERE room_id=?", (room_id,))
     else:
-        conn.close()
-        raise HTTPException(403, "Not a player in this room")
-
-    conn.commit()
+        raise ServiceError(403, "Not a player in this room")
 
     # 检查是否双方都Ready
     cur.execute("SELECT host_ready, guest_ready FROM rooms WHERE room_id=?", (room_id,))
     ready_status = cur.fetchone()
 
-    both_ready = ready_status["host_ready"] == 1 and ready_status["guest_ready"] == 1
+    if not (ready_status["host_ready"] == 1 and ready_status["guest_ready"] == 1):
+        return None
 
-    if both_ready:
-        # 双方都Ready，进入倒计时状态（3秒后开始游戏）
-        countdown_start_time = datetime.utcnow().isoformat()
-        cur.execute(
-            "UPDATE rooms SET status='COUNTDOWN', countdown_start_time=? WHERE room_id=?",
-            (countdown_start_time, room_id)
-        )
-        conn.commit()
+    # 双方都Ready，进入倒计时状态（3秒后由服务端开始游戏）
+    countdown_start = datetime.utcnow()
+    cur.execute(
+        "UPDATE rooms SET status='COUNTDOWN', countdown_start_time=? WHERE room_id=? AND status='FULL'",
+        (countdown_start.isoformat(), room_id)
+    )
+    return countdown_start
+
+@app.post("/api/rooms/{room_id}/ready")
+async def ready_room(room_id: str, body: ReadyIn):
+    """玩家点击Ready"""
+    countdown_start = await db.write(_ready_room, room_id, body)
+    if countdown_start:
+        lobby.remove(room_id)
+        scheduler.arm("start", room_id, countdown_start + timedelta(seconds=COUNTDOWN_SECONDS))
 
-    conn.close()
+    await db.run(publish_room, room_id)
 
-    return {"ok": True, "both_ready": both_ready}
+    return {"ok": True, "both_ready": countdown_start is not None}
 
 
 @app.post("/api/rooms/{room_id}/start")
-def start_game(room_id: str, body: ReadyIn):
-    """倒计时结束后开始游戏（前端触发）"""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM rooms WHERE room_id=?", (room_id,))
-    room = cur.fetchone()
+async def start_game(room_id: str, body: ReadyIn):
+    """倒计时结束后开始游戏（服务端会自动开局，前端触发时直接返回开局时间）"""
+    return {"ok": True, "game_start_time": await begin_game(room_id)}
+
+def settle_deadline(game_start_time: str) -> datetime:
+    """自动结算时间：游戏结束后再等最后一批点击到达"""
+    return datetime.fromisoformat(game_start_time) + timedelta(seconds=settlement.GAME_SECONDS + CLICK_BATCH_GRACE)
+
+def _begin_game(conn, room_id: str):
+    """COUNTDOWN → PLAYING（写命令），返回 (房间行, 开局时间, 是否为本次开局)"""
+    room = fetch_room(conn, room_id)
 
     if not room:
-        conn.close()
-        raise HTTPException(404, "Room not found")
+        raise ServiceError(404, "Room not found")
+
+    # 已经开局（服务端定时器或另一方已触发）
+    if room["status"] == "PLAYING":
+        return room, room["game_start_time"], False
 
     # 只有 COUNTDOWN 状态才能开始
     if room["status"] != "COUNTDOWN":
-        conn.close()
-        raise HTTPException(400, f"Room is not in countdown (status: {room['status']})")
+        raise ServiceError(400, f"Room is not in countdown (status: {room['status']})")
 
     # 验证倒计时是否已过3秒
     if room["countdown_start_time"]:
         countdown_start = datetime.fromisoformat(room["countdown_start_time"])
         elapsed = (datetime.utcnow() - countdown_start).total_seconds()
-        if elapsed < 2.5:  # 留0.5秒容差
-            conn.close()
-            raise HTTPException(400, f"Countdown not finished ({3-int(elapsed)}s remaining)")
+        if elapsed < COUNTDOWN_SECONDS - 0.5:  # 留0.5秒容差
+            raise ServiceError(400, f"Countdown not finished ({COUNTDOWN_SECONDS-int(elapsed)}s remaining)")
 
-    # 开始游戏
+    # 开始游戏（写命令串行执行，状态检查之后不会被并发修改）
     game_start_time = datetime.utcnow().isoformat()
-    cur.execute(
-        "UPDATE rooms SET status='PLAYING', game_start_time=? WHERE room_id=?",
+    conn.execute(
+        "UPDATE rooms SET status='PLAYING', game_start_time=? WHERE room_id=? AND status='COUNTDOWN'",
         (game_start_time, room_id)
     )
-    conn.commit()
-    conn.close()
+    return room, game_start_time, True
 
-    return {"ok": True, "game_start_time": game_start_time}
+async def begin_game(room_id: str) -> str:
+    """开局，并安排游戏结束时自动结算，返回开局时间"""
+    room, game_start_time, started = await db.write(_begin_game, room_id)
+    if not started:
+        return game_start_time
 
-@app.post("/api/rooms/{room_id}/click")
-def click_room(room_id: str, body: ClickIn):
-    """记录玩家点击"""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM rooms WHERE room_id=?", (room_id,))
-    room = cur.fetchone()
+    # 开始在内存中计数，30秒后自动结算
+    click_counter.track({**dict(room), "game_start_time": game_start_time, "host_clicks": 0, "guest_clicks": 0})
+    scheduler.arm("settle", room_id, settle_deadline(game_start_time))
+    await db.run(publish_room, room_id)
 
-    if not room:
-        conn.close()
-        raise HTTPException(404, "Room not found")
+    return game_start_time
 
-    if room["status"] != "PLAYING":
-        conn.close()
-        raise HTTPException(400, "Game is not playing")
+async def _playing_clicks(room_id: str, grace: float = 0.0):
+    """取得 PLAYING 房间的内存计数，并返回 (计数, 已开始秒数)"""
+    entry = click_counter.get(room_id)
+    if entry is None:
+        # 内存中没有该房间（如进程重启后），从数据库快照恢复
+        room = await db.run(load_room, room_id)
+
+        if not room:
+            raise HTTPException(404, "Room not found")
+
+        if room["status"] != "PLAYING":
+            raise HTTPException(400, "Game is not playing")
+
+        entry = click_counter.track(room)
 
     # 检查游戏是否超时（30秒）
-    if room["game_start_time"]:
-        start_time = datetime.fromisoformat(room["game_start_time"])
-        elapsed = (datetime.utcnow() - start_time).total_seconds()
-        if elapsed > 30:
-            conn.close()
+    elapsed = 0.0
+    if entry.game_start:
+        elapsed = (datetime.utcnow() - entry.game_start).total_seconds()
+        if elapsed > settlement.GAME_SECONDS + grace:
             raise HTTPException(400, "Game time expired")
 
-    # 判断是房主还是客人，增加点击数
-    if room["host_id"] == body.user.user_id:
-        cur.execute("UPDATE rooms SET host_clicks=host_clicks+1 WHERE room_id=?", (room_id,))
-    elif room["guest_id"] == body.user.user_id:
-        cur.execute("UPDATE rooms SET guest_clicks=guest_clicks+1 WHERE room_id=?", (room_id,))
-    else:
-        conn.close()
-        raise HTTPException(403, "Not a player in this room")
+    return entry, elapsed
 
-    conn.commit()
+def _reject_click(entry) -> None:
+    """click_counter.add 没有接受点击：房间已开始结算，或不是本房间的玩家"""
+    if entry.closed:
+        raise HTTPException(400, "Game is not playing")
+    raise HTTPException(403, "Not a player in this room")
+
+def _click_limit(elapsed: float) -> int:
+    """按已开始时间计算单个玩家本局最多可计入的点击数"""
+    return int(MAX_TAPS_PER_SECOND * (min(elapsed, settlement.GAME_SECONDS) + CLICK_BATCH_GRACE))
+
+@app.post("/api/rooms/{room_id}/click")
+async def click_room(room_id: str, body: ClickIn):
+    """记录玩家点击（只写内存计数，结算时落库）"""
+    entry, elapsed = await _playing_clicks(room_id)
+
+    # 判断是房主还是客人，增加点击数
+    clicks = click_counter.add(room_id, body.user.user_id, limit=_click_limit(elapsed))
+    if clicks is None:
+        _reject_click(entry)
+    publish_clicks(room_id, clicks[1], clicks[2])
 
     # 返回当前点击数
-    cur.execute("SELECT host_clicks, guest_clicks FROM rooms WHERE room_id=?", (room_id,))
-    clicks = cur.fetchone()
-    conn.close()
+    return {
+        "ok": True,
+        "host_clicks": clicks[1],
+        "guest_clicks": clicks[2]
+    }
+
+@app.post("/api/rooms/{room_id}/clicks")
+async def click_room_batch(room_id: str, body: ClickBatchIn):
+    """
+    批量记录玩家点击（前端每 100~200ms 提交一次缓冲的点击）
+    客户端时间戳只用于校验批次内的点击间隔，游戏窗口以服务器时间为准
+    """
+    taps = body.taps
+    if len(taps) != body.count:
+        raise HTTPException(400, "Tap count does not match timestamps")
+    if any(b < a for a, b in zip(taps, taps[1:])):
+        raise HTTPException(400, "Tap timestamps must be in order")
+
+    span_ms = taps[-1] - taps[0]
+    if span_ms > CLICK_BATCH_MAX_SPAN_MS:
+        raise HTTPException(400, "Tap batch window too long")
+    # 批次内超过最高点击频率的部分不计入（不拒绝整批：两次间隔很短的正常连点也是合法的，
+    # 窗口至少按 1 秒计算）；整局的上限由 _click_limit 按已开始时间控制
+    count = min(body.count, MAX_TAPS_PER_SECOND * max(span_ms, 1000) // 1000)
+
+    # 最后一批点击在游戏结束后才到达，允许一定的网络延迟
+    entry, elapsed = await _playing_clicks(room_id, grace=CLICK_BATCH_GRACE)
+
+    clicks = click_counter.add(room_id, body.user.user_id, count, limit=_click_limit(elapsed))
+    if clicks is None:
+        _reject_click(entry)
+    if clicks[0]:
+        publish_clicks(room_id, clicks[1], clicks[2])
 
     return {
         "ok": True,
-        "host_clicks": clicks["host_clicks"],
-        "guest_clicks": clicks["guest_clicks"]
+        "accepted": clicks[0],
+        "host_clicks": clicks[1],
+        "guest_clicks": clicks[2]
     }
 
 class SettleIn(BaseModel):
@@ -625,170 +1016,116 @@ class SettleIn(BaseModel):
 
 @app.post("/api/rooms/{room_id}/settle")
 async def settle_room(room_id: str, body: SettleIn):
-    """结算游戏（可由任一玩家或系统触发）"""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM rooms WHERE room_id=?", (room_id,))
-    room = cur.fetchone()
+    """结算游戏（服务端会在30秒时自动结算；重复调用返回同一结果）"""
+    return {"ok": True, **await finish_room(room_id)}
 
-    if not room:
-        conn.close()
-        raise HTTPException(404, "Room not found")
+async def finish_room(room_id: str) -> dict:
+    """结算房间，首次结算时推送结果并播报到群聊"""
+    # 点击数在写命令中读取并关闭，结算开始后到达的点击被拒绝而不是丢失
+    room, result, settled = await db.write(settlement.settle_room, room_id, click_counter.close)
+    click_counter.discard(room_id)
 
-    if room["status"] != "PLAYING":
-        conn.close()
-        raise HTTPException(400, "Game is not playing")
-
-    # 检查游戏是否已经超过30秒
-    if room["game_start_time"]:
-        start_time = datetime.fromisoformat(room["game_start_time"])
-        elapsed = (datetime.utcnow() - start_time).total_seconds()
-        if elapsed < 30:
-            conn.close()
-            raise HTTPException(400, f"Game not finished yet ({int(30-elapsed)}s remaining)")
-
-    # 判断胜者
-    host_clicks = room["host_clicks"]
-    guest_clicks = room["guest_clicks"]
-    bet_amount = room["bet_amount"]
-    host_id = room["host_id"]
-    guest_id = room["guest_id"]
-
-    if host_clicks > guest_clicks:
-        winner_id = host_id
-        loser_id = guest_id
-        winner_username = room["host_username"]
-    elif guest_clicks > host_clicks:
-        winner_id = guest_id
-        loser_id = host_id
-        winner_username = room["guest_username"]
-    else:
-        # 平局，双方退回押注
-        winner_id = None
-        loser_id = None
-        winner_username = None
-
-    game_end_time = datetime.utcnow().isoformat()
+    if not settled:
+        return result
 
-    # 更新房间状态
-    cur.execute(
-        "UPDATE rooms SET status='FINISHED', game_end_time=?, winner_id=? WHERE room_id=?",
-        (game_end_time, winner_id, room_id)
-    )
-    conn.commit()
-    conn.close()
-
-    # 处理资金结算
-    if winner_id is None:
-        # 平局，双方解冻押注
-        unfreeze(host_id, bet_amount, ref=f"room:{room_id}:draw")
-        unfreeze(guest_id, bet_amount, ref=f"room:{room_id}:draw")
-        result_text = "平局"
-    else:
-        # 有胜者，转移资金
-        # 胜者：解冻自己的押注 + 获得对方的押注
-        unfreeze(winner_id, bet_amount, ref=f"room:{room_id}:win")
-        transfer_frozen(loser_id, winner_id, bet_amount, ref=f"room:{room_id}:win")
-        result_text = f"@{winner_username} 获胜"
+    await db.run(publish_room, room_id, result={"winner_id": result["winner_id"], "result": result["result"]})
 
     # 发送结果到群聊
     if room["chat_id"]:
         result_message = (
             f"🎮 <b>游戏结束！</b>\n\n"
-            f"🏆 结果：{result_text}\n"
+            f"🏆 结果：{result['result']}\n"
             f"📊 点击数：\n"
-            f"  • @{room['host_username']}: {host_clicks} 次\n"
-            f"  • @{room['guest_username']}: {guest_clicks} 次\n"
-            f"💰 押注：{bet_amount} LGW33"
+            f"  • @{room['host_username']}: {result['host_clicks']} 次\n"
+            f"  • @{room['guest_username']}: {result['guest_clicks']} 次\n"
+            f"💰 押注：{room['bet_amount']} LGW33"
         )
 
-        try:
-            await send_game_result(
-                bot_token=BOT_TOKEN,
-                chat_id=room["chat_id"],
-                text=result_message
-            )
-        except Exception as e:
-            print(f"Failed to send game result: {e}")
+        send_game_result(chat_id=room["chat_id"], text=result_message)
 
+    return result
+
+@app.get("/api/internal/stats")
+async def internal_stats(request: Request):
+    """运行状态（队列积压等）"""
+    require_internal(request)
     return {
-        "ok": True,
-        "winner_id": winner_id,
-        "host_clicks": host_clicks,
-        "guest_clicks": guest_clicks,
-        "result": result_text
+        "webhook": webhook_updates.snapshot(),
+        "telegram": {"pending": tg_sender.pending(), "sent": tg_sender.sent, "failed": tg_sender.failed},
+        "scheduler": {"pending": scheduler.pending(), "retrying": scheduler.failures()},
+        "lobby": {"rooms": len(lobby)},
+        "event_loop": loop_monitor.snapshot(),
+        "db_writer": db.writer_stats(),
+        "activity": {"pending": user_activity.pending()},
+        "wallets": wallets.snapshot(),
+        "reconcile": reconcile.last,
+        "archive": archive.last,
+        "leaderboard": leaderboard.snapshot(),
+        "matchmaking": matchmaking.queue.snapshot(),
+        "startup": {**startup, **instance_lock.snapshot()},
     }
 
+def count_live_rooms() -> dict[str, int]:
+    """各未结束状态的房间数（只读 idx_rooms_status 部分索引）"""
+    with connection() as conn:
+        counts = dict.fromkeys(("OPEN", "FULL", "COUNTDOWN", "PLAYING"), 0)
+        counts.update(conn.execute("""
+            SELECT status, COUNT(*) FROM rooms
+            WHERE status IN ('OPEN', 'FULL', 'COUNTDOWN', 'PLAYING')
+            GROUP BY status
+        """).fetchall())
+        return counts
+
+@app.get("/api/internal/metrics")
+async def internal_metrics(request: Request):
+    """Prometheus 指标（文本格式）"""
+    require_internal(request)
+    rooms = await db.run(count_live_rooms)
+    metrics.rooms_active.replace({(status,): n for status, n in rooms.items()})
+
+    webhook = webhook_updates.snapshot()
+    metrics.webhook_depth.set(value=webhook["depth"])
+    metrics.webhook_updates.replace({
+        (outcome,): webhook[outcome] for outcome in ("received", "duplicates", "rejected", "processed", "failed")
+    })
+    metrics.telegram_pending.set(value=tg_sender.pending())
+    metrics.scheduler_pending.set(value=scheduler.pending())
+    metrics.match_waiting.set(value=matchmaking.queue.waiting())
+    metrics.loop_lag_max.set(value=loop_monitor.max_ms / 1000)
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.post("/api/internal/leaderboard/rebuild")
+async def internal_rebuild_leaderboard(request: Request):
+    """从账本重建排行榜（重建期间的结算不会丢失；已有重建在进行时等待它完成）"""
+    require_internal(request)
+    started = time.perf_counter()
+    boards = await asyncio.shield(leaderboard_loading())
+    return {"ok": True, "boards": boards, "tx_id": leaderboard.tx_id, "seconds": round(time.perf_counter() - started, 3)}
+
 @app.post("/api/internal/init_user")
-def internal_init_user(request: Request, body: InitUserIn):
+async def internal_init_user(request: Request, body: InitUserIn):
     """初始化用户账户（Bot专用）"""
     require_internal(request)
-
-    upsert_user(body.user_id, body.username)
-
-    # 返回用户信息
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT user_id, username, available, frozen FROM users WHERE user_id=?", (body.user_id,))
-    row = cur.fetchone()
-    conn.close()
-
-    if not row:
-        raise HTTPException(404, "User not found")
-
-    return dict(row)
+    return await init_user(body.user_id, body.username)
 
 @app.post("/api/internal/join")
-def internal_join_room(request: Request, body: JoinRoomIn):
+async def internal_join_room(request: Request, body: JoinRoomIn):
     # 只允许 Bot 调用
     require_internal(request)
-
-    upsert_user(body.user_id, body.username)
-
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM rooms WHERE invite_token=?", (body.invite_token,))
-    room = cur.fetchone()
-    if not room:
-        conn.close()
-        raise HTTPException(404, "Room not found")
-
-    if room["status"] != "OPEN":
-        conn.close()
-        raise HTTPException(400, "Room not open")
-
-    if room["host_id"] == body.user_id:
-        conn.close()
-        raise HTTPException(400, "Host cannot join own room")
-
-    # 冻结挑战者押注
-    freeze(body.user_id, room["bet_amount"], ref=f"room:{room['room_id']}")
-
-    # 占位加入,并更新过期时间为2分钟后
-    new_expires_at = datetime.utcnow() + timedelta(minutes=2)
-    cur.execute(
-        "UPDATE rooms SET guest_id=?, guest_username=?, status='FULL', expires_at=? WHERE room_id=?",
-        (body.user_id, body.username, new_expires_at.isoformat(), room["room_id"])
-    )
-    conn.commit()
-    conn.close()
-
-    return {
-        "ok": True,
-        "room_id": room["room_id"],
-        "bet_amount": room["bet_amount"],
-        "host_id": room["host_id"],
-        "guest_id": body.user_id
-    }
+    return await join_by_invite(body.invite_token, body.user_id, body.username)
 
 # --------------------
 # Serve Mini App (static)
 # --------------------
 @app.get("/")
-def root():
+async def root():
     """根路径重定向到 Mini App"""
     return RedirectResponse(url="/miniapp/index.html")
 
-# 挂载整个 miniapp 目录为静态文件
+# Mini App 静态资源：优先使用 build_assets.py 的构建结果（dist/miniapp），没有时直接提供 miniapp 源目录
 miniapp_path = os.path.join(os.path.dirname(__file__), "..", "miniapp")
-app.mount("/miniapp", StaticFiles(directory=miniapp_path, html=True), name="miniapp")
+miniapp_dist = os.path.join(os.path.dirname(__file__), "..", "dist", "miniapp")
+miniapp_assets = StaticAssets(miniapp_dist, fallback=miniapp_path)
+app.mount("/miniapp", miniapp_assets, name="miniapp")
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
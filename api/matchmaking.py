@@ -0,0 +1,240 @@
+"""
+快速匹配
+
+玩家按 (押注金额, chat_id) 进入内存中的匹配队列，同一个桶里先到先配：
+- 每个桶是一个 OrderedDict（user_id -> 排队票），入队、取出最早的排队者、取消都是 O(1)
+- 配对成功时在一个写命令中冻结双方押注并直接创建 FULL 状态的房间（排队者为房主），
+  不会在大厅中留下等待加入的 OPEN 房间，排队期间也不冻结押注
+- 客户端用长轮询等待结果（POST /api/match 最多挂起 MATCH_WAIT_SECONDS 秒），不需要轮询大厅；
+  超时后返回 waiting，排队票保留 MATCH_TICKET_TTL 秒等待下一次轮询，过期的排队票在配对时跳过
+
+队列只在事件循环线程中访问，不需要加锁；进程重启后队列清空（排队期间没有冻结任何余额）。
+"""
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from . import metrics
+from .db import write
+from .lobby import lobby
+from .scheduler import scheduler
+from .service import ServiceError, ensure_user, freeze, get_user
+
+# 单次长轮询最长等待（秒）
+MATCH_WAIT_SECONDS = float(os.getenv("MATCH_WAIT_SECONDS", "25"))
+# 长轮询结束后排队票保留的时间（秒），期间没有再次轮询视为已离开
+MATCH_TICKET_TTL = float(os.getenv("MATCH_TICKET_TTL", "10"))
+# 配对房间的过期时间（与加入房间后相同）
+MATCH_EXPIRES_MINUTES = 2
+
+
+class Ticket:
+    """一个玩家的排队票；future 的结果是配对结果 dict 或 ServiceError"""
+
+    __slots__ = ("user_id", "username", "bet", "chat_id", "future", "created", "seen", "polls")
+
+    def __init__(self, user_id: int, username: str | None, bet: int, chat_id: int):
+        self.user_id = user_id
+        self.username = username
+        self.bet = bet
+        self.chat_id = chat_id
+        self.future = asyncio.get_running_loop().create_future()
+        self.created = self.seen = time.monotonic()
+        self.polls = 0
+
+    @property
+    def key(self) -> tuple[int, int]:
+        return self.bet, self.chat_id
+
+    def stale(self, now: float) -> bool:
+        return not self.polls and now - self.seen > MATCH_TICKET_TTL
+
+    def resolve(self, result) -> None:
+        if not self.future.done():
+            self.future.set_result(result)
+
+
+class MatchQueue:
+    """(押注金额, chat_id) -> 排队中的玩家（按入队顺序），chat_id 为 0 表示不限群"""
+
+    def __init__(self):
+        self._buckets: dict[tuple[int, int], OrderedDict[int, Ticket]] = {}
+        # 每个玩家当前的排队票（包括正在配对、已配对但还没取走结果的）
+        self._tickets: dict[int, Ticket] = {}
+        self.stats = {"queued": 0, "matched": 0, "cancelled": 0, "expired": 0, "insufficient": 0}
+
+    def ticket(self, user_id: int) -> Ticket | None:
+        return self._tickets.get(user_id)
+
+    def register(self, ticket: Ticket) -> None:
+        self._tickets[ticket.user_id] = ticket
+
+    def enqueue(self, ticket: Ticket, front: bool = False) -> None:
+        bucket = self._buckets.setdefault(ticket.key, OrderedDict())
+        bucket[ticket.user_id] = ticket
+        if front:
+            # 配对失败（对方余额不足等）时放回队首，不失去原来的位置
+            bucket.move_to_end(ticket.user_id, last=False)
+        else:
+            self.stats["queued"] += 1
+
+    def pop(self, key: tuple[int, int], now: float) -> Ticket | None:
+        """取出桶中最早的有效排队者（顺带丢弃已离开的）"""
+        bucket = self._buckets.get(key)
+        while bucket:
+            _, ticket = bucket.popitem(last=False)
+            if not ticket.stale(now):
+                if not bucket:
+                    del self._buckets[key]
+                return ticket
+            self.forget(ticket)
+            self.stats["expired"] += 1
+        self._buckets.pop(key, None)
+        return None
+
+    def discard(self, ticket: Ticket) -> bool:
+        """移出队列并忘记排队票，返回是否还在队列中"""
+        bucket = self._buckets.get(ticket.key)
+        queued = bucket is not None and bucket.pop(ticket.user_id, None) is not None
+        if bucket is not None and not bucket:
+            del self._buckets[ticket.key]
+        self.forget(ticket)
+        return queued
+
+    def forget(self, ticket: Ticket) -> None:
+        if self._tickets.get(ticket.user_id) is ticket:
+            del self._tickets[ticket.user_id]
+
+    def waiting(self, key: tuple[int, int] | None = None) -> int:
+        if key is not None:
+            return len(self._buckets.get(key, ()))
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "waiting": self.waiting(), "buckets": len(self._buckets)}
+
+    def reset(self) -> None:
+        """清空队列（测试换库时）；挂起的长轮询收到错误"""
+        for ticket in self._tickets.values():
+            ticket.resolve(ServiceError(503, "Matchmaking restarted"))
+        self._buckets.clear()
+        self._tickets.clear()
+
+
+queue = MatchQueue()
+
+
+def _create_match(conn, host: Ticket, guest: Ticket, room_id: str, invite_token: str, expires_at: datetime):
+    """
+    冻结双方押注并创建 FULL 状态的房间（写命令）
+    房主（排队者）余额不足时返回 None，不写入任何内容；挑战者余额不足时抛出 ServiceError，整个命令回滚
+    """
+    try:
+        freeze(conn, host.user_id, host.bet, room_id)
+    except ServiceError:
+        return None
+    freeze(conn, guest.user_id, guest.bet, room_id)
+
+    return conn.execute(
+        """INSERT INTO rooms(room_id, chat_id, host_id, host_username, guest_id, guest_username,
+                             bet_amount, status, invite_token, expires_at)
+           VALUES(?,?,?,?,?,?,?,'FULL',?,?) RETURNING *""",
+        (room_id, host.chat_id or None, host.user_id, host.username, guest.user_id, guest.username,
+         host.bet, invite_token, expires_at.isoformat())
+    ).fetchone()
+
+def _result(room, role: str) -> dict:
+    return {
+        "status": "matched",
+        "role": role,
+        "room_id": room["room_id"],
+        "bet_amount": room["bet_amount"],
+        "chat_id": room["chat_id"],
+        "host_id": room["host_id"],
+        "guest_id": room["guest_id"],
+        "expires_at": room["expires_at"],
+    }
+
+async def _pair(ticket: Ticket) -> None:
+    """和桶中最早的排队者配对；没有可配对的玩家时入队"""
+    while True:
+        host = queue.pop(ticket.key, time.monotonic())
+        if host is None:
+            queue.enqueue(ticket)
+            return
+
+        room_id = uuid.uuid4().hex[:12]
+        expires_at = datetime.utcnow() + timedelta(minutes=MATCH_EXPIRES_MINUTES)
+        try:
+            room = await write(_create_match, host, ticket, room_id, uuid.uuid4().hex, expires_at)
+        except BaseException:
+            # 挑战者余额不足或写入失败：排队者回到队首
+            queue.enqueue(host, front=True)
+            raise
+        if room is None:
+            queue.stats["insufficient"] += 1
+            queue.forget(host)
+            host.resolve(ServiceError(400, "Insufficient balance"))
+            continue
+
+        scheduler.arm("expire", room_id, expires_at)
+        lobby.upsert(room)
+        queue.stats["matched"] += 1
+        metrics.match_wait.observe(time.monotonic() - host.created)
+        host.resolve(_result(room, "host"))
+        ticket.resolve(_result(room, "guest"))
+        return
+
+async def quick_match(user_id: int, username: str | None, bet: int, chat_id: int | None = None,
+                      wait: float = MATCH_WAIT_SECONDS) -> dict:
+    """
+    快速匹配：加入 (bet, chat_id) 队列，等待最多 wait 秒
+    返回配对结果（status=matched，含 room_id 和自己的 role）或 status=waiting（再次调用继续等待）
+    """
+    await ensure_user(user_id, username)
+
+    ticket = queue.ticket(user_id)
+    if ticket is not None and ticket.key != (bet, chat_id or 0) and not ticket.future.done():
+        # 换了押注或群：放弃原来的排队
+        queue.discard(ticket)
+        ticket.resolve(ServiceError(409, "Match request replaced"))
+        ticket = None
+
+    if ticket is None:
+        wallet = await get_user(user_id)
+        if wallet["available"] < bet:
+            raise ServiceError(400, "Insufficient balance")
+        ticket = Ticket(user_id, username, bet, chat_id or 0)
+        # 先登记再配对：同一玩家的并发请求等待同一张排队票
+        queue.register(ticket)
+        try:
+            await _pair(ticket)
+        except BaseException:
+            queue.forget(ticket)
+            raise
+
+    ticket.polls += 1
+    try:
+        result = await asyncio.wait_for(asyncio.shield(ticket.future), wait)
+    except asyncio.TimeoutError:
+        return {"status": "waiting", "bet_amount": bet, "chat_id": chat_id, "waiting": queue.waiting(ticket.key)}
+    finally:
+        ticket.polls -= 1
+        ticket.seen = time.monotonic()
+
+    queue.forget(ticket)
+    if isinstance(result, ServiceError):
+        raise result
+    return result
+
+def cancel(user_id: int) -> bool:
+    """取消排队，返回是否取消了排队（已经配对成功的不能取消，房间照常过期退款）"""
+    ticket = queue.ticket(user_id)
+    if ticket is None or ticket.future.done() or not queue.discard(ticket):
+        return False
+    queue.stats["cancelled"] += 1
+    ticket.resolve(ServiceError(409, "Match cancelled"))
+    return True
@@ -0,0 +1,261 @@
+"""
+Prometheus 指标
+
+不依赖 prometheus_client：这里只需要计数器、瞬时值和直方图三种类型，
+记录一次观测只是在锁内做一次二分查找和两次加法，点击等热路径上的开销可以忽略。
+/api/internal/metrics 以 Prometheus 文本格式（0.0.4）输出 registry 中的全部指标；
+队列深度等瞬时值在抓取时由 main 中的路由读取后 set。
+
+约定：耗时一律以秒为单位，指标名以 lgw33_ 开头。
+"""
+import threading
+import time
+from bisect import bisect_left
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 默认的耗时桶（秒）：覆盖亚毫秒级的内存操作到数秒的外部请求
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labels
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def replace(self, values: dict[tuple, float]) -> None:
+        """整体替换为抓取时读到的值（例如各状态的房间数、其他模块自己维护的累计计数）"""
+        with self._lock:
+            self._values = dict(values)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items(), key=lambda item: tuple(map(str, item[0])))
+            lines.extend(self._render_samples(items))
+        return lines
+
+    def _render_samples(self, items) -> list[str]:
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in items]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, *labels, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels) -> None:
+        # 只记录 value 所在的桶，输出时再累加成 Prometheus 要求的累积计数
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, *labels) -> "_Timer":
+        """with metric.time(...): 代码块的耗时"""
+        return _Timer(self, labels)
+
+    def _render_samples(self, items) -> list[str]:
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def add(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# HTTP
+http_duration = registry.add(Histogram(
+    "lgw33_http_request_duration_seconds", "HTTP request latency by route template", ("method", "route")
+))
+http_responses = registry.add(Counter(
+    "lgw33_http_responses_total", "HTTP responses by route template and status code", ("method", "route", "status")
+))
+
+# SQLite
+db_query_duration = registry.add(Histogram(
+    "lgw33_db_query_duration_seconds", "Time spent running a read function on a pooled connection", ("query",)
+))
+db_command_duration = registry.add(Histogram(
+    "lgw33_db_command_duration_seconds", "Time spent running a write command inside its batch", ("command",)
+))
+db_commit_duration = registry.add(Histogram(
+    "lgw33_db_commit_duration_seconds", "COMMIT duration of a write batch"
+))
+db_lock_wait = registry.add(Histogram(
+    "lgw33_db_lock_wait_seconds", "Time BEGIN IMMEDIATE waited for the database write lock"
+))
+db_batch_size = registry.add(Histogram(
+    "lgw33_db_batch_commands", "Write commands per committed batch", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+))
+db_lock_busy = registry.add(Counter(
+    "lgw33_db_lock_busy_total",
+    "Write batches that found the write lock held by another connection and waited in the busy handler"
+))
+db_locked_errors = registry.add(Counter(
+    "lgw33_db_locked_errors_total", "Operations that failed with 'database is locked' after the busy timeout", ("op",)
+))
+
+# 房间
+rooms_active = registry.add(Gauge("lgw33_rooms", "Rooms in a non-terminal status", ("status",)))
+expiry_sweep_duration = registry.add(Histogram(
+    "lgw33_room_expiry_sweep_duration_seconds", "Duration of one expired-room sweep (cancel and refund)", ("trigger",)
+))
+rooms_expired = registry.add(Counter("lgw33_rooms_expired_total", "Rooms cancelled by expiry sweeps"))
+timer_failures = registry.add(Counter(
+    "lgw33_timer_failures_total", "Automatic start/settle attempts that failed and were re-armed with backoff", ("kind",)
+))
+rooms_expire_failed = registry.add(Counter(
+    "lgw33_rooms_expire_failed_total", "Expired rooms skipped because the frozen balance could not cover the refund"
+))
+rooms_archived = registry.add(Counter("lgw33_rooms_archived_total", "Finished or cancelled rooms moved to rooms_archive"))
+
+# 快速匹配
+match_waiting = registry.add(Gauge("lgw33_matchmaking_waiting", "Players waiting in the quick match queue"))
+match_wait = registry.add(Histogram(
+    "lgw33_matchmaking_wait_seconds", "Time the first player of a pair spent in the quick match queue",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+))
+
+# Telegram
+telegram_duration = registry.add(Histogram(
+    "lgw33_telegram_send_duration_seconds", "sendMessage request latency", ("result",)
+))
+telegram_failed = registry.add(Counter(
+    "lgw33_telegram_messages_failed_total", "Messages dropped after exhausting retries or a 4xx response"
+))
+telegram_pending = registry.add(Gauge("lgw33_telegram_queue_depth", "Messages waiting in the send queue"))
+
+# Webhook / 后台任务
+webhook_depth = registry.add(Gauge("lgw33_webhook_queue_depth", "Updates waiting in the webhook queue"))
+webhook_updates = registry.add(Counter(
+    "lgw33_webhook_updates_total", "Webhook updates by outcome", ("outcome",)
+))
+scheduler_pending = registry.add(Gauge("lgw33_scheduler_pending", "Room timers waiting to fire"))
+loop_lag_max = registry.add(Gauge("lgw33_event_loop_lag_max_seconds", "Largest event loop stall since start"))
+
+
+class MetricsMiddleware:
+    """
+    按路由模板（而不是实际路径）记录请求耗时和状态码，避免 room_id 造成标签爆炸
+    未匹配任何路由的请求记为 route="unmatched"；hidden 中的路径（如含 Bot token 的 Webhook 路径）用替代名称
+    """
+
+    def __init__(self, app, hidden: dict[str, str] | None = None):
+        self.app = app
+        self.hidden = hidden or {}
+        self._routes: dict = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = self._route(scope)
+            http_duration.observe(time.perf_counter() - start, scope["method"], route)
+            http_responses.inc(scope["method"], route, status)
+
+    def _route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self._routes.get(endpoint)
+        if route is None:
+            # 第一次遇到该 endpoint 时从路由表查出模板（路由注册后不会变化）
+            route = "unmatched"
+            for candidate in scope["app"].routes:
+                if getattr(candidate, "endpoint", getattr(candidate, "app", None)) is endpoint:
+                    route = self.hidden.get(candidate.path, candidate.path)
+                    break
+            self._routes[endpoint] = route
+        return route
@@ -0,0 +1,68 @@
+"""
+房间实时推送（WebSocket）
+
+每个房间维护一组订阅队列，房间状态变化或点击数变化时推送给所有订阅者。
+publish 可以在线程池中的同步路由里调用，消息会被转交给事件循环线程。
+"""
+import asyncio
+
+# 单个订阅者最多积压的消息数，超过后丢弃积压并让其重新同步完整状态
+QUEUE_SIZE = 64
+
+RESYNC = {"type": "resync"}
+
+
+class RoomHub:
+    """room_id -> 订阅队列集合"""
+
+    def __init__(self):
+        self._subs: dict[str, set[asyncio.Queue]] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """绑定事件循环（应用启动时调用）"""
+        self._loop = loop
+
+    def subscribe(self, room_id: str) -> asyncio.Queue:
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self._subs.setdefault(room_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, room_id: str, queue: asyncio.Queue) -> None:
+        subs = self._subs.get(room_id)
+        if subs is None:
+            return
+        subs.discard(queue)
+        if not subs:
+            del self._subs[room_id]
+
+    def subscribers(self, room_id: str) -> int:
+        return len(self._subs.get(room_id, ()))
+
+    def publish(self, room_id: str, message: dict) -> None:
+        """向房间的所有订阅者推送消息（线程安全）"""
+        if room_id not in self._subs or self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._deliver(room_id, message)
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._deliver, room_id, message)
+
+    def _deliver(self, room_id: str, message: dict) -> None:
+        for queue in list(self._subs.get(room_id, ())):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # 客户端消费太慢：清空积压，让它重新拉取完整状态
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC)
+
+
+hub = RoomHub()
@@ -0,0 +1,152 @@
+"""
+余额对账
+
+每个用户的 users.available / frozen 应当等于其全部账本记录按 ledger.EFFECTS 累加的结果。
+每次都汇总整个账本太慢，因此保存检查点：balance_checkpoints 是截至 reconcile_state.tx_id
+为止由账本推算出的每个用户余额。对账时：
+- 按 tx_id 范围分块（走主键）汇总检查点之后新增的账本记录，加到检查点上得到期望余额
+- 与 users 表逐个比较，报告不一致（drift）的用户
+- 把新的期望余额写为检查点（检查点只来自账本，users 表的错误不会被写进去，下次对账仍会报告）
+
+汇总和比较在同一个读事务（WAL 快照）中完成；余额和账本总在同一个写事务里修改，所以快照内二者一致。
+"""
+import time
+
+from . import ledger
+from .db import connection, run, write
+
+# 每次汇总的账本记录数（按 tx_id 范围）
+CHUNK_ROWS = 500_000
+# 后台对账时最多打印多少个不一致的用户
+PRINT_LIMIT = 20
+
+_AVAILABLE = " ".join(f"WHEN {code} THEN {a} * amount" for code, (a, _) in ledger.EFFECTS.items())
+_FROZEN = " ".join(f"WHEN {code} THEN {f} * amount" for code, (_, f) in ledger.EFFECTS.items())
+_DELTA_SQL = f"""
+    SELECT user_id, COUNT(*), SUM(CASE type {_AVAILABLE} ELSE 0 END), SUM(CASE type {_FROZEN} ELSE 0 END)
+    FROM ledger
+    WHERE tx_id > ? AND tx_id <= ?
+    GROUP BY user_id
+"""
+
+# 最近一次对账的摘要（/api/internal/stats）
+last: dict = {}
+
+
+class Report:
+    """一次对账的结果"""
+    __slots__ = ("base_tx", "tx_id", "rows", "users", "balances", "drift", "seconds")
+
+    def __init__(self, base_tx: int, tx_id: int, rows: int, users: int,
+                 balances: dict[int, tuple[int, int]], drift: list, seconds: float):
+        self.base_tx = base_tx
+        self.tx_id = tx_id
+        self.rows = rows
+        self.users = users
+        # 本次有新账本记录的用户的期望余额（新检查点）
+        self.balances = balances
+        # [(user_id, available, frozen, 期望 available, 期望 frozen)]，users 表中没有的用户余额为 None
+        self.drift = drift
+        self.seconds = seconds
+
+    def summary(self) -> dict:
+        return {
+            "tx_id": self.tx_id,
+            "rows": self.rows,
+            "users": self.users,
+            "drift": len(self.drift),
+            "seconds": round(self.seconds, 3),
+        }
+
+
+def scan(conn, rebuild: bool = False) -> Report:
+    """
+    汇总上次检查点之后的账本记录并与 users 表比较（只读）
+    rebuild=True 时忽略已有检查点，从头汇总整个账本
+    """
+    start = time.perf_counter()
+    conn.execute("BEGIN")
+    try:
+        row = None if rebuild else conn.execute("SELECT tx_id FROM reconcile_state WHERE id=1").fetchone()
+        base_tx = row[0] if row else 0
+        tx_id = conn.execute("SELECT COALESCE(MAX(tx_id), 0) FROM ledger").fetchone()[0]
+
+        rows = 0
+        deltas: dict[int, tuple[int, int]] = {}
+        for low in range(base_tx, tx_id, CHUNK_ROWS):
+            for user_id, count, available, frozen in conn.execute(_DELTA_SQL, (low, min(low + CHUNK_ROWS, tx_id))):
+                rows += count
+                before = deltas.get(user_id, (0, 0))
+                deltas[user_id] = (before[0] + available, before[1] + frozen)
+
+        expected = {} if rebuild else {
+            user_id: (available, frozen)
+            for user_id, available, frozen in conn.execute("SELECT user_id, available, frozen FROM balance_checkpoints")
+        }
+        balances = {}
+        for user_id, (available, frozen) in deltas.items():
+            before = expected.get(user_id, (0, 0))
+            expected[user_id] = balances[user_id] = (before[0] + available, before[1] + frozen)
+
+        drift = []
+        users = 0
+        for user_id, available, frozen in conn.execute("SELECT user_id, available, frozen FROM users"):
+            users += 1
+            balance = expected.pop(user_id, (0, 0))
+            if (available, frozen) != balance:
+                drift.append((user_id, available, frozen, *balance))
+        # 有账本记录却没有账户的用户
+        drift.extend((user_id, None, None, *balance) for user_id, balance in expected.items() if balance != (0, 0))
+    finally:
+        conn.rollback()
+
+    return Report(base_tx, tx_id, rows, users, balances, drift, time.perf_counter() - start)
+
+def save_checkpoint(conn, report: Report) -> bool:
+    """把对账结果写为新的检查点（写命令）；检查点已被其他对账推进时放弃，返回是否写入"""
+    row = conn.execute("SELECT tx_id FROM reconcile_state WHERE id=1").fetchone()
+    if (row[0] if row else 0) != report.base_tx:
+        return False
+
+    conn.executemany(
+        """INSERT INTO balance_checkpoints(user_id, available, frozen) VALUES(?,?,?)
+           ON CONFLICT(user_id) DO UPDATE SET available=excluded.available, frozen=excluded.frozen""",
+        [(user_id, available, frozen) for user_id, (available, frozen) in report.balances.items()]
+    )
+    conn.execute(
+        """INSERT INTO reconcile_state(id, tx_id, checked_at, drift) VALUES(1,?,?,?)
+           ON CONFLICT(id) DO UPDATE SET tx_id=excluded.tx_id, checked_at=excluded.checked_at, drift=excluded.drift""",
+        (report.tx_id, int(time.time()), len(report.drift))
+    )
+    return True
+
+def replace_checkpoint(conn, report: Report) -> bool:
+    """用从头汇总的结果（scan(rebuild=True)）替换全部检查点（写命令）"""
+    conn.execute("DELETE FROM balance_checkpoints")
+    conn.execute("DELETE FROM reconcile_state")
+    return save_checkpoint(conn, report)
+
+def print_drift(report: Report, limit: int | None = None) -> None:
+    for user_id, available, frozen, expected_available, expected_frozen in report.drift[:limit]:
+        if available is None:
+            print(f"❌ 用户 {user_id} 不存在，账本余额 {expected_available}/{expected_frozen}")
+        else:
+            print(
+                f"❌ 用户 {user_id} 余额不一致: available={available} frozen={frozen}，"
+                f"账本应为 available={expected_available} frozen={expected_frozen}"
+            )
+    if limit is not None and len(report.drift) > limit:
+        print(f"   ... 另有 {len(report.drift) - limit} 个用户")
+
+async def reconcile() -> Report:
+    """对账一次并推进检查点（API 后台任务使用）"""
+    def read():
+        with connection() as conn:
+            return scan(conn)
+
+    report = await run(read)
+    await write(save_checkpoint, report)
+    last.clear()
+    last.update(report.summary(), checked_at=int(time.time()))
+    print_drift(report, PRINT_LIMIT)
+    return report
@@ -0,0 +1,140 @@
+"""
+服务端定时器
+
+用一个按截止时间排序的堆保存各房间的待办事项（倒计时结束开局、游戏结束结算等），
+后台任务睡到最早的截止时间，把同一时刻到期的同类事项一次性交给对应的处理函数。
+arm 可以在线程池中的同步路由里调用。
+处理失败的事项由处理函数调用 retry 按指数退避重新登记，成功后调用 done 清除失败次数。
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+
+Handler = Callable[[list[str]], Awaitable[None]]
+
+# 失败重试的最长等待时间（秒）
+RETRY_MAX_SECONDS = 300
+
+
+def to_timestamp(value: datetime | str) -> float:
+    """把 UTC 时间（naive datetime 或 ISO 字符串）转换为时间戳"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class DeadlineScheduler:
+    """截止时间堆 + 按类型注册的批量处理函数"""
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, str, str]] = []
+        self._seq = itertools.count()
+        self._handlers: dict[str, Handler] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        # (kind, key) -> 连续失败次数
+        self._failures: dict[tuple[str, str], int] = {}
+
+    def on(self, kind: str, handler: Handler) -> None:
+        """注册某类事项到期时的处理函数，参数为同一批到期的 key 列表"""
+        self._handlers[kind] = handler
+
+    def arm(self, kind: str, key: str, deadline: datetime | str | float) -> None:
+        """在 deadline 时刻触发 kind 类事项（线程安全）"""
+        ts = deadline if isinstance(deadline, (int, float)) else to_timestamp(deadline)
+        if self._loop is None:
+            # 尚未启动：直接入堆，启动后统一处理
+            heapq.heappush(self._heap, (ts, next(self._seq), kind, key))
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._push(ts, kind, key)
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._push, ts, kind, key)
+
+    def retry(self, kind: str, key: str, base: float) -> float:
+        """
+        处理失败后重新登记：第 n 次连续失败后等待 base * 2^(n-1) 秒（最多 RETRY_MAX_SECONDS），返回等待时间
+        在事件循环线程中调用（处理函数内）
+        """
+        failures = self._failures.get((kind, key), 0)
+        self._failures[(kind, key)] = failures + 1
+        delay = min(base * 2 ** failures, RETRY_MAX_SECONDS)
+        self.arm(kind, key, time.time() + delay)
+        return delay
+
+    def done(self, kind: str, key: str) -> None:
+        """事项处理成功，清除失败次数"""
+        self._failures.pop((kind, key), None)
+
+    def failures(self) -> int:
+        """正在退避重试的事项数量"""
+        return len(self._failures)
+
+    def pending(self) -> int:
+        return len(self._heap)
+
+    def _push(self, ts: float, kind: str, key: str) -> None:
+        heapq.heappush(self._heap, (ts, next(self._seq), kind, key))
+        # 新的截止时间比当前最早的还早时唤醒后台任务重新计算睡眠时间
+        if self._heap[0][0] == ts and self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._loop = None
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # 取出所有已到期的事项，按类型分批
+            now = time.time()
+            due: dict[str, dict[str, None]] = defaultdict(dict)
+            while self._heap and self._heap[0][0] <= now:
+                _, _, kind, key = heapq.heappop(self._heap)
+                due[kind][key] = None
+
+            for kind, keys in due.items():
+                handler = self._handlers.get(kind)
+                if handler is None:
+                    continue
+                try:
+                    await handler(list(keys))
+                except Exception as e:
+                    print(f"❌ 定时任务 {kind} 出错: {e}")
+
+
+scheduler = DeadlineScheduler()
@@ -0,0 +1,187 @@
+"""
+房间 / 钱包服务层
+
+与传输方式无关的业务操作：FastAPI 路由和同进程内的 Bot 处理函数都直接调用这里，
+错误统一抛出 ServiceError（HTTP 层映射为对应状态码，Bot 直接展示）。
+Bot 单独部署时仍通过 bot/api_client.py 走 HTTP 内部接口。
+
+只读函数是同步的（通过 db.run 在数据库线程中调用）；
+写操作的 fn(conn, ...) 是写命令（交给 db.write，不自己提交），入口函数是协程。
+"""
+import os
+from datetime import datetime, timedelta
+
+from . import ledger
+from .archive import fetch_archived_room
+from .activity import activity
+from .wallets import wallets
+from .db import after_commit, connection, run, write
+from .clicks import counter as click_counter
+from .realtime import hub as room_hub
+from .lobby import lobby
+from .scheduler import scheduler
+
+DEFAULT_BALANCE = int(os.getenv("DEFAULT_BALANCE", "1000"))
+
+
+class ServiceError(Exception):
+    """业务错误，status_code 沿用 HTTP 状态码的含义"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+# --------------------
+# Wallet
+# --------------------
+def upsert_user(conn, user_id: int, username: str | None) -> None:
+    """
+    确保用户存在（写命令）：首次出现时插入并发放初始余额（只发放一次）
+    用户名和活跃时间交给 activity 延迟写回，已知用户不执行任何 SQL
+    """
+    if not activity.known(user_id):
+        cur = conn.execute(
+            "INSERT INTO users(user_id, username, available, frozen) VALUES(?,?,?,0) ON CONFLICT(user_id) DO NOTHING",
+            (user_id, username, DEFAULT_BALANCE)
+        )
+        if cur.rowcount == 1:
+            ledger.record(conn, [(user_id, ledger.CREDIT, DEFAULT_BALANCE, ledger.SIGNUP, None)])
+        after_commit(lambda: activity.remember(user_id))
+    _touch(user_id, username)
+
+async def ensure_user(user_id: int, username: str | None) -> None:
+    """确保用户存在并记录活跃；已知用户不产生写事务"""
+    if activity.known(user_id):
+        _touch(user_id, username)
+    else:
+        await write(upsert_user, user_id, username)
+
+def _touch(user_id: int, username: str | None) -> None:
+    activity.touch(user_id, username)
+    wallets.rename(user_id, username)
+
+def freeze(conn, user_id: int, amount: int, room_id: str) -> None:
+    """冻结房间押注"""
+    cur = conn.cursor()
+    cur.execute("SELECT available, frozen FROM users WHERE user_id=?", (user_id,))
+    row = cur.fetchone()
+    if not row:
+        raise ServiceError(404, "User not found")
+    if row["available"] < amount:
+        raise ServiceError(400, "Insufficient balance")
+    wallet = dict(cur.execute(
+        """UPDATE users SET available=available-?, frozen=frozen+?, last_active=datetime('now') WHERE user_id=?
+           RETURNING user_id, username, available, frozen""",
+        (amount, amount, user_id)
+    ).fetchone())
+    ledger.record(conn, [(user_id, ledger.FREEZE, amount, ledger.BET, room_id)])
+    after_commit(lambda: wallets.put(wallet))
+
+def load_user(user_id: int) -> dict:
+    """从数据库读取用户余额并回填缓存"""
+    version = wallets.version
+    with connection() as conn:
+        row = conn.execute(
+            "SELECT user_id, username, available, frozen FROM users WHERE user_id=?", (user_id,)
+        ).fetchone()
+    if not row:
+        raise ServiceError(404, "Not found")
+    wallets.fill(dict(row), version)
+    return dict(row)
+
+async def get_user(user_id: int) -> dict:
+    """查询用户余额（优先读缓存）"""
+    wallet = wallets.get(user_id)
+    if wallet is not None:
+        return wallet
+    return await run(load_user, user_id)
+
+async def init_user(user_id: int, username: str | None) -> dict:
+    """初始化用户账户（首次使用时发放初始余额），返回余额信息"""
+    await ensure_user(user_id, username)
+    return await get_user(user_id)
+
+# --------------------
+# Rooms
+# --------------------
+def fetch_room(conn, room_id: str):
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM rooms WHERE room_id=?", (room_id,))
+    return cur.fetchone()
+
+def load_room(room_id: str) -> dict | None:
+    """读取房间完整状态（包含内存中的实时点击数；已归档的房间从归档表读取）"""
+    with connection() as conn:
+        room = fetch_room(conn, room_id) or fetch_archived_room(conn, room_id)
+    if not room:
+        return None
+    return click_counter.overlay(dict(room))
+
+def publish_room(room_id: str, **extra) -> None:
+    """房间状态变化后推送给 WebSocket 订阅者"""
+    if not room_hub.subscribers(room_id):
+        return
+    room = load_room(room_id)
+    if room:
+        room_hub.publish(room_id, {"type": "room", "room": room, **extra})
+
+def join_room(conn, room, user_id: int, username: str | None):
+    """冻结挑战者押注并占位加入房间（写命令），返回 (加入前的房间行, 新的过期时间)"""
+    if not room:
+        raise ServiceError(404, "Room not found")
+
+    if room["status"] != "OPEN":
+        raise ServiceError(400, "Room not open")
+
+    if room["host_id"] == user_id:
+        raise ServiceError(400, "Host cannot join own room")
+
+    # 冻结挑战者押注
+    freeze(conn, user_id, room["bet_amount"], room["room_id"])
+
+    # 占位加入,并更新过期时间为2分钟后（并发加入时只有一人成功）
+    new_expires_at = datetime.utcnow() + timedelta(minutes=2)
+    cur = conn.execute(
+        "UPDATE rooms SET guest_id=?, guest_username=?, status='FULL', expires_at=? WHERE room_id=? AND status='OPEN'",
+        (user_id, username, new_expires_at.isoformat(), room["room_id"])
+    )
+    if cur.rowcount != 1:
+        raise ServiceError(400, "Room not open")
+    return room, new_expires_at
+
+async def _joined(joined, user_id: int, username: str | None) -> dict:
+    """加入提交后：登记过期定时器、更新大厅并推送"""
+    room, expires_at = joined
+    scheduler.arm("expire", room["room_id"], expires_at)
+    lobby.update(
+        room["room_id"], guest_id=user_id, guest_username=username,
+        status="FULL", expires_at=expires_at.isoformat()
+    )
+    await run(publish_room, room["room_id"])
+    return {
+        "ok": True,
+        "room_id": room["room_id"],
+        "bet_amount": room["bet_amount"],
+        "host_id": room["host_id"],
+        "guest_id": user_id
+    }
+
+def _join_by_id(conn, room_id: str, user_id: int, username: str | None):
+    upsert_user(conn, user_id, username)
+    return join_room(conn, fetch_room(conn, room_id), user_id, username)
+
+def _join_by_invite(conn, invite_token: str, user_id: int, username: str | None):
+    upsert_user(conn, user_id, username)
+    room = conn.execute("SELECT * FROM rooms WHERE invite_token=?", (invite_token,)).fetchone()
+    return join_room(conn, room, user_id, username)
+
+async def join_by_id(room_id: str, user_id: int, username: str | None) -> dict:
+    """通过房间ID加入房间（MiniApp）"""
+    joined = await write(_join_by_id, room_id, user_id, username)
+    return await _joined(joined, user_id, username)
+
+async def join_by_invite(invite_token: str, user_id: int, username: str | None) -> dict:
+    """通过邀请码加入房间（Bot）"""
+    joined = await write(_join_by_invite, invite_token, user_id, username)
+    return await _joined(joined, user_id, username)
@@ -0,0 +1,121 @@
+"""
+房间结算
+
+状态切换（PLAYING → FINISHED）、双方余额变动和全部账本记录
+在同一个写命令（db.write）中完成，要么全部生效要么全部回滚，中途崩溃不会留下冻结资金。
+重复结算（双方前端在计时结束时都会调用 settle）直接返回已有结果。
+"""
+import time
+from datetime import datetime
+from typing import Callable
+
+from . import ledger
+from .archive import fetch_archived_room
+from .db import after_commit
+from .leaderboard import leaderboard
+from .service import ServiceError
+from .wallets import wallets
+
+# 游戏时长（秒）
+GAME_SECONDS = 30
+
+def result_text(room, winner_id: int | None) -> str:
+    if winner_id is None:
+        return "平局"
+    if winner_id == room["host_id"]:
+        return f"@{room['host_username']} 获胜"
+    return f"@{room['guest_username']} 获胜"
+
+def settle_room(conn, room_id: str, close_clicks: Callable[[dict], tuple[int, int]] | None = None):
+    """
+    结算房间（写命令），返回 (房间行, 结算结果, 是否为本次结算)
+    close_clicks(房间行) 在确认可以结算后停止内存计数并返回最终的 (host_clicks, guest_clicks)，
+    为空时使用数据库中的快照
+    """
+    room = conn.execute("SELECT * FROM rooms WHERE room_id=?", (room_id,)).fetchone()
+    if not room:
+        # 已归档的房间一定已经结束，只可能是重复结算
+        room = fetch_archived_room(conn, room_id)
+
+    if not room:
+        raise ServiceError(404, "Room not found")
+
+    # 已经结算过：直接返回已有结果
+    if room["status"] == "FINISHED":
+        return room, {
+            "winner_id": room["winner_id"],
+            "host_clicks": room["host_clicks"],
+            "guest_clicks": room["guest_clicks"],
+            "result": result_text(room, room["winner_id"]),
+        }, False
+
+    if room["status"] != "PLAYING":
+        raise ServiceError(400, "Game is not playing")
+
+    # 检查游戏是否已经超过30秒
+    if room["game_start_time"]:
+        start_time = datetime.fromisoformat(room["game_start_time"])
+        elapsed = (datetime.utcnow() - start_time).total_seconds()
+        if elapsed < GAME_SECONDS:
+            raise ServiceError(400, f"Game not finished yet ({int(GAME_SECONDS-elapsed)}s remaining)")
+
+    # 判断胜者
+    host_clicks, guest_clicks = close_clicks(room) if close_clicks else (room["host_clicks"], room["guest_clicks"])
+    bet = room["bet_amount"]
+    host_id = room["host_id"]
+    guest_id = room["guest_id"]
+
+    if host_clicks > guest_clicks:
+        winner_id, loser_id = host_id, guest_id
+    elif guest_clicks > host_clicks:
+        winner_id, loser_id = guest_id, host_id
+    else:
+        winner_id = loser_id = None
+
+    # 余额变动 (available 增量, frozen 减量, user_id) 和账本记录
+    if winner_id is None:
+        # 平局，双方解冻押注
+        balances = [(bet, bet, host_id), (bet, bet, guest_id)]
+        entries = [
+            (host_id, ledger.UNFREEZE, bet, ledger.DRAW, room_id),
+            (guest_id, ledger.UNFREEZE, bet, ledger.DRAW, room_id),
+        ]
+    else:
+        # 胜者：解冻自己的押注 + 获得对方的押注；败者：扣除冻结押注
+        balances = [(bet * 2, bet, winner_id), (0, bet, loser_id)]
+        entries = [
+            (winner_id, ledger.UNFREEZE, bet, ledger.WIN, room_id),
+            (loser_id, ledger.DEBIT, bet, ledger.WIN, room_id),
+            (winner_id, ledger.CREDIT, bet, ledger.WIN, room_id),
+        ]
+
+    conn.execute(
+        "UPDATE rooms SET status='FINISHED', game_end_time=?, winner_id=?, host_clicks=?, guest_clicks=? WHERE room_id=?",
+        (datetime.utcnow().isoformat(), winner_id, host_clicks, guest_clicks, room_id)
+    )
+    changed = []
+    for available, frozen, user_id in balances:
+        wallet = conn.execute(
+            """UPDATE users SET available=available+?, frozen=frozen-?, last_active=datetime('now')
+               WHERE user_id=? AND frozen>=? RETURNING user_id, username, available, frozen""",
+            (available, frozen, user_id, frozen)
+        ).fetchone()
+        if wallet is None:
+            raise ServiceError(400, "Insufficient frozen balance")
+        changed.append(dict(wallet))
+    ledger.record(conn, entries)
+    tx_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    results = [
+        (user_id, user_id == winner_id, 0 if winner_id is None else (bet if user_id == winner_id else -bet))
+        for user_id in (host_id, guest_id)
+    ]
+    # 提交后立即更新余额缓存和排行榜
+    after_commit(lambda: wallets.put(*changed))
+    after_commit(lambda: leaderboard.record(tx_id, time.time(), room["chat_id"], results))
+
+    return room, {
+        "winner_id": winner_id,
+        "host_clicks": host_clicks,
+        "guest_clicks": guest_clicks,
+        "result": result_text(room, winner_id),
+    }, True
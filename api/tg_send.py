@@ -1,43 +1,261 @@
+"""
+Telegram 消息发送
+
+所有发往 Telegram 的消息先进入发送队列，由后台任务通过一个长连接 httpx 客户端
+（安装了 h2 时使用 HTTP/2）发出，调用方只负责入队，不等待 Telegram 响应。
+
+限流遵循 Telegram 的建议：
+- 同一个群每分钟不超过 20 条（每 3 秒 1 条）
+- 同一个私聊每秒不超过 1 条
+- 全局每秒不超过 30 条
+收到 429 时按 retry_after 暂停该会话，消息保留在队首稍后重发。
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+
 import httpx
 
-async def send_invite_message(
-    bot_token: str,
-    chat_id: int,
-    text: str,
-    invite_token: str
-) -> None:
-    """发送房间邀请消息到群聊"""
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+from . import metrics
+
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+
+GROUP_INTERVAL = 60 / 20
+PRIVATE_INTERVAL = 1.0
+GLOBAL_RATE = 30
+# 同时在途的请求数
+SEND_CONCURRENCY = 8
+# 非 429 错误的最大尝试次数
+MAX_ATTEMPTS = 3
+# 队列中最多积压的消息数，超过后丢弃新消息
+QUEUE_LIMIT = 10000
+
+
+class TelegramSender:
+    """按会话排队、限流的 sendMessage 发送器"""
+
+    def __init__(
+        self,
+        api_url: str = TELEGRAM_API_URL,
+        group_interval: float = GROUP_INTERVAL,
+        private_interval: float = PRIVATE_INTERVAL,
+        global_rate: float = GLOBAL_RATE,
+    ):
+        self.api_url = api_url
+        self.group_interval = group_interval
+        self.private_interval = private_interval
+        self.global_rate = global_rate
+        self.sent = 0
+        self.failed = 0
+
+        self._token = ""
+        self._client: httpx.AsyncClient | None = None
+        self._chats: dict[int, deque] = {}
+        self._next_at: dict[int, float] = {}
+        self._inflight: set[int] = set()
+        self._ready: list[tuple[float, int, int]] = []
+        self._seq = itertools.count()
+        self._queued = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._idle: asyncio.Event | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._task: asyncio.Task | None = None
+        self._sending: set[asyncio.Task] = set()
+        self._last_send = 0.0
+
+    @property
+    def client(self) -> httpx.AsyncClient | None:
+        return self._client
+
+    def start(self, bot_token: str) -> None:
+        """创建共享客户端并启动发送任务（应用启动时调用）"""
+        self._token = bot_token
+        self._loop = asyncio.get_running_loop()
+        self._client = httpx.AsyncClient(
+            http2=HTTP2,
+            timeout=15,
+            limits=httpx.Limits(max_connections=SEND_CONCURRENCY, max_keepalive_connections=SEND_CONCURRENCY),
+        )
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._slots = asyncio.Semaphore(SEND_CONCURRENCY)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """尽量发完队列中的消息后关闭客户端"""
+        if self._task:
+            try:
+                await asyncio.wait_for(self.drain(), timeout=timeout)
+            except asyncio.TimeoutError:
+                print(f"⚠️ 关闭时仍有 {self._queued} 条 Telegram 消息未发送")
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+        self._loop = None
+
+    async def drain(self) -> None:
+        """等待队列清空"""
+        if self._idle is not None:
+            await self._idle.wait()
+
+    def pending(self) -> int:
+        return self._queued
+
+    def enqueue(self, chat_id: int, payload: dict) -> bool:
+        """把一条 sendMessage 放入队列（线程安全），队列已满或未启动时返回 False"""
+        if self._loop is None or self._loop.is_closed():
+            print(f"❌ Telegram 发送队列未启动，丢弃发往 {chat_id} 的消息")
+            return False
+        if self._queued >= QUEUE_LIMIT:
+            print(f"❌ Telegram 发送队列已满，丢弃发往 {chat_id} 的消息")
+            return False
+        message = {"chat_id": chat_id, **payload}
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._push(chat_id, message)
+        else:
+            self._loop.call_soon_threadsafe(self._push, chat_id, message)
+        return True
 
+    def _interval(self, chat_id: int) -> float:
+        # 群组/频道的 chat_id 为负数
+        return self.group_interval if chat_id < 0 else self.private_interval
+
+    def _push(self, chat_id: int, message: dict) -> None:
+        chat = self._chats.setdefault(chat_id, deque())
+        chat.append([message, 0])
+        self._queued += 1
+        self._idle.clear()
+        if len(chat) == 1 and chat_id not in self._inflight:
+            self._schedule(chat_id)
+
+    def _schedule(self, chat_id: int) -> None:
+        ready_at = max(time.monotonic(), self._next_at.get(chat_id, 0.0))
+        heapq.heappush(self._ready, (ready_at, next(self._seq), chat_id))
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            if not self._ready:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._ready[0][0] - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # 全局限速
+            gap = self._last_send + 1 / self.global_rate - time.monotonic()
+            if gap > 0:
+                await asyncio.sleep(gap)
+            await self._slots.acquire()
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            self._inflight.add(chat_id)
+            self._last_send = time.monotonic()
+            task = asyncio.create_task(self._send(chat_id))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chat_id: int) -> None:
+        chat = self._chats[chat_id]
+        entry = chat[0]
+        message, attempts = entry
+        interval = self._interval(chat_id)
+        start = time.perf_counter()
+        result = "error"
+        try:
+            r = await self._client.post(f"{self.api_url}/bot{self._token}/sendMessage", json=message)
+            if r.status_code == 429:
+                result = "rate_limited"
+                retry_after = _retry_after(r)
+                print(f"⚠️ Telegram 限流 chat_id={chat_id}，{retry_after}s 后重试")
+                self._next_at[chat_id] = time.monotonic() + retry_after
+                return
+            r.raise_for_status()
+            result = "ok"
+            chat.popleft()
+            self._queued -= 1
+            self.sent += 1
+            self._next_at[chat_id] = time.monotonic() + interval
+        except Exception as e:
+            entry[1] = attempts + 1
+            # 4xx（例如 chat not found）重试也不会成功
+            if isinstance(e, httpx.HTTPStatusError) and e.response.is_client_error:
+                entry[1] = MAX_ATTEMPTS
+            if entry[1] >= MAX_ATTEMPTS:
+                chat.popleft()
+                self._queued -= 1
+                self.failed += 1
+                metrics.telegram_failed.inc()
+                print(f"❌ 发送 Telegram 消息失败 chat_id={chat_id}: {e}")
+            self._next_at[chat_id] = time.monotonic() + interval * 2 ** entry[1]
+        finally:
+            metrics.telegram_duration.observe(time.perf_counter() - start, result)
+            self._inflight.discard(chat_id)
+            self._slots.release()
+            if chat:
+                self._schedule(chat_id)
+            else:
+                del self._chats[chat_id]
+                if not self._queued:
+                    self._idle.set()
+
+
+def _retry_after(response: httpx.Response) -> float:
+    try:
+        return float(response.json()["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return float(response.headers.get("retry-after", 1))
+
+
+sender = TelegramSender()
+
+
+def send_invite_message(chat_id: int, text: str, invite_token: str) -> bool:
+    """发送房间邀请消息到群聊（入队即返回）"""
     # 构建按钮 - 使用URL按钮跳转到机器人
     buttons = [
         [{"text": "🎮 前往机器人查看房间", "url": "https://t.me/lgw33tokenbot"}]
     ]
 
-    payload = {
-        "chat_id": chat_id,
+    return sender.enqueue(chat_id, {
         "text": text,
         "parse_mode": "HTML",
         "reply_markup": {
             "inline_keyboard": buttons
         }
-    }
-    async with httpx.AsyncClient(timeout=15) as client:
-        r = await client.post(url, json=payload)
-        r.raise_for_status()
-
-async def send_game_result(
-    bot_token: str,
-    chat_id: int,
-    text: str
-) -> None:
-    """发送游戏结果到群聊"""
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    payload = {
-        "chat_id": chat_id,
+    })
+
+
+def send_game_result(chat_id: int, text: str) -> bool:
+    """发送游戏结果到群聊（入队即返回）"""
+    return sender.enqueue(chat_id, {
         "text": text,
         "parse_mode": "HTML"
-    }
-    async with httpx.AsyncClient(timeout=15) as client:
-        r = await client.post(url, json=payload)
-        r.raise_for_status()
+    })
@@ -0,0 +1,83 @@
+"""
+用户余额缓存
+
+GET /api/users/{user_id}（MiniApp 每次打开页面、每局结束，Bot 的查询余额按钮）优先读这里。
+- 有界 LRU，容量 WALLET_CACHE_SIZE
+- 修改余额的写命令（冻结、结算、过期退款）通过 db.after_commit 在提交后、调用方拿到结果前
+  写入新余额（put）或使缓存失效（discard），不会在结算后读到旧余额
+- 未命中时从数据库读取后回填（fill）；读取期间如果有余额被修改（version 变化）则放弃回填，
+  避免把提交前读到的旧值写进缓存
+"""
+import os
+import threading
+from collections import OrderedDict
+
+WALLET_CACHE_SIZE = int(os.getenv("WALLET_CACHE_SIZE", "10000"))
+
+
+class WalletCache:
+    """user_id -> {"user_id", "username", "available", "frozen"}（线程安全）"""
+
+    def __init__(self, size: int = WALLET_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+        self._wallets: OrderedDict[int, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._wallets)
+
+    def get(self, user_id: int) -> dict | None:
+        with self._lock:
+            wallet = self._wallets.get(user_id)
+            if wallet is None:
+                self.misses += 1
+                return None
+            self._wallets.move_to_end(user_id)
+            self.hits += 1
+            return dict(wallet)
+
+    def fill(self, wallet: dict, version: int) -> None:
+        """回填从数据库读到的余额；version 为开始读取前的 self.version"""
+        with self._lock:
+            if version == self.version:
+                self._store(wallet)
+
+    def put(self, *wallets: dict) -> None:
+        """写入刚提交的新余额"""
+        with self._lock:
+            self.version += 1
+            for wallet in wallets:
+                self._store(wallet)
+
+    def discard(self, *user_ids: int) -> None:
+        with self._lock:
+            self.version += 1
+            for user_id in user_ids:
+                self._wallets.pop(user_id, None)
+
+    def rename(self, user_id: int, username: str | None) -> None:
+        """同步缓存中的用户名（用户名不影响余额，不需要使在途的回填失效）"""
+        with self._lock:
+            wallet = self._wallets.get(user_id)
+            if wallet is not None:
+                wallet["username"] = username
+
+    def reset(self) -> None:
+        with self._lock:
+            self.version += 1
+            self._wallets.clear()
+
+    def snapshot(self) -> dict:
+        return {"size": len(self._wallets), "capacity": self.size, "hits": self.hits, "misses": self.misses}
+
+    def _store(self, wallet: dict) -> None:
+        self._wallets[wallet["user_id"]] = dict(wallet)
+        self._wallets.move_to_end(wallet["user_id"])
+        while len(self._wallets) > self.size:
+            self._wallets.popitem(last=False)
+
+
+wallets = WalletCache()
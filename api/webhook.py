@@ -0,0 +1,128 @@
+"""
+Telegram Webhook 更新队列
+
+Webhook 路由只做去重和入队，立即返回 200；由固定数量的 worker 调用处理函数。
+- 按 update_id 去重（保留最近 DEDUP_WINDOW 个），Telegram 重试投递的更新只处理一次
+- 队列满时拒绝新更新（路由返回 503），让 Telegram 稍后重试，而不是无限堆积
+- 没有启动队列（未配置 BOT_TOKEN）时路由返回 404，不会被当成积压让 Telegram 一直重试
+- 记录积压深度等指标，积压超过高水位时打印告警
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+# 去重窗口：记住最近多少个 update_id
+DEDUP_WINDOW = 2048
+# 积压超过队列容量的这个比例时告警
+HIGH_WATER = 0.8
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+class UpdateQueue:
+    """有界更新队列 + worker 池"""
+
+    def __init__(self, size: int = WEBHOOK_QUEUE_SIZE, workers: int = WEBHOOK_WORKERS):
+        self.size = size
+        self.workers = workers
+        self._queue: asyncio.Queue | None = None
+        self._seen: OrderedDict[int, None] = OrderedDict()
+        self._tasks: list[asyncio.Task] = []
+        self._handler: Handler | None = None
+        self._warned_at = 0.0
+        self.stats = {
+            "received": 0,
+            "duplicates": 0,
+            "rejected": 0,
+            "processed": 0,
+            "failed": 0,
+            "max_depth": 0,
+        }
+
+    def start(self, handler: Handler) -> None:
+        self._handler = handler
+        self._queue = asyncio.Queue(maxsize=self.size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """处理完已入队的更新（最多等待 timeout 秒）后停止 worker"""
+        if self._queue is not None and self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=timeout)
+            except asyncio.TimeoutError:
+                print(f"⚠️ 关闭时仍有 {self._queue.qsize()} 个 Webhook 更新未处理")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    @property
+    def running(self) -> bool:
+        """已经 start() 且没有 stop()（配置了 BOT_TOKEN 时在启动时调用）"""
+        return self._queue is not None
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "depth": self.depth(), "capacity": self.size, "workers": len(self._tasks)}
+
+    def submit(self, update: dict) -> bool:
+        """
+        入队一个更新，重复的更新直接忽略
+        返回 False 表示队列已满（或尚未启动），调用方应让 Telegram 稍后重试
+        """
+        self.stats["received"] += 1
+        update_id = update.get("update_id")
+        if update_id is not None and update_id in self._seen:
+            self.stats["duplicates"] += 1
+            return True
+
+        if self._queue is None:
+            self.stats["rejected"] += 1
+            return False
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            self._warn()
+            return False
+
+        if update_id is not None:
+            self._seen[update_id] = None
+            if len(self._seen) > DEDUP_WINDOW:
+                self._seen.popitem(last=False)
+
+        depth = self._queue.qsize()
+        if depth > self.stats["max_depth"]:
+            self.stats["max_depth"] = depth
+        if depth >= self.size * HIGH_WATER:
+            self._warn()
+        return True
+
+    def _warn(self) -> None:
+        # 每 10 秒最多告警一次
+        now = time.monotonic()
+        if now - self._warned_at >= 10:
+            self._warned_at = now
+            print(f"⚠️ Webhook 队列积压 {self.depth()}/{self.size}，已拒绝 {self.stats['rejected']} 个更新")
+
+    async def _worker(self) -> None:
+        while True:
+            update = await self._queue.get()
+            try:
+                await self._handler(update)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"❌ Webhook 处理错误: {e}")
+            finally:
+                self._queue.task_done()
+
+
+updates = UpdateQueue()
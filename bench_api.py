@@ -0,0 +1,118 @@
+"""
+API 压测脚本 - 测量 创建房间 → 加入房间 → 点击 路径的吞吐量（requests/sec）
+直接在进程内调用 ASGI 应用（不经过网络、不启动 Bot），使用临时数据库
+同时记录每个阶段事件循环的最大阻塞时间（压测客户端和服务共用事件循环，随 --concurrency 增长，见 api/looplag.py）
+
+用法:
+    python bench_api.py --games 200 --clicks 20 --concurrency 16
+"""
+import argparse
+import asyncio
+import gc
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+async def run_phase(name, calls, concurrency):
+    """并发执行一组请求，返回 (名称, 请求数, 耗时, 失败数, 事件循环最大阻塞毫秒)"""
+    from api.looplag import monitor
+    # 等监控任务完成一次采样，避免把压测脚本自身的准备工作算进去
+    await asyncio.sleep(monitor.interval * 2)
+    monitor.reset()
+    pending = iter(calls)
+    failures = 0
+
+    async def worker():
+        nonlocal failures
+        for call in pending:
+            # 进程内的 ASGI 调用可能全程不挂起；让出一次事件循环，模拟请求从网络陆续到达
+            await asyncio.sleep(0)
+            r = await call()
+            if r.status_code != 200:
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return name, len(calls), time.perf_counter() - start, failures, monitor.max_ms
+
+async def bench(games: int, clicks: int, concurrency: int, db_path: str):
+    import api.db
+    api.db.DB_PATH = db_path
+    from api.main import app
+    from api.looplag import monitor
+    api.db.init_db()
+    # 与 lifespan 相同：启动时已有的对象不再参与 GC
+    gc.collect()
+    gc.freeze()
+    monitor.start()
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        hosts = [{"user_id": 1_000_000 + i, "username": f"host{i}"} for i in range(games)]
+        guests = [{"user_id": 2_000_000 + i, "username": f"guest{i}"} for i in range(games)]
+        room_ids = [None] * games
+
+        async def create(i):
+            r = await client.post("/api/rooms", json={"user": hosts[i], "bet_amount": 10})
+            if r.status_code == 200:
+                room_ids[i] = r.json()["room_id"]
+            return r
+
+        results = [await run_phase("create", [lambda i=i: create(i) for i in range(games)], concurrency)]
+        results.append(await run_phase(
+            "join",
+            [lambda i=i: client.post(f"/api/rooms/{room_ids[i]}/join", json={"user": guests[i]}) for i in range(games)],
+            concurrency
+        ))
+
+        # 准备阶段不计时：双方 Ready，跳过3秒倒计时后开始游戏
+        for i in range(games):
+            await client.post(f"/api/rooms/{room_ids[i]}/ready", json={"user": hosts[i]})
+            await client.post(f"/api/rooms/{room_ids[i]}/ready", json={"user": guests[i]})
+        conn = sqlite3.connect(db_path)
+        conn.execute(
+            "UPDATE rooms SET countdown_start_time=?",
+            ((datetime.utcnow() - timedelta(seconds=5)).isoformat(),)
+        )
+        conn.commit()
+        conn.close()
+        for i in range(games):
+            await client.post(f"/api/rooms/{room_ids[i]}/start", json={"user": hosts[i]})
+
+        click_calls = []
+        for _ in range(clicks):
+            for i in range(games):
+                user = hosts[i] if len(click_calls) % 2 == 0 else guests[i]
+                click_calls.append(lambda i=i, user=user: client.post(f"/api/rooms/{room_ids[i]}/click", json={"user": user}))
+        results.append(await run_phase("click", click_calls, concurrency))
+
+    await monitor.stop()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="LGW33 API 吞吐量测试")
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--clicks", type=int, default=20, help="每局点击次数")
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="lgw33-bench-"), "bench.db")
+    results = asyncio.run(bench(args.games, args.clicks, args.concurrency, db_path))
+
+    print("=" * 60)
+    print(f"games={args.games} clicks/game={args.clicks} concurrency={args.concurrency}")
+    print("=" * 60)
+    total_n = total_t = max_lag = 0
+    for name, n, elapsed, failures, lag in results:
+        total_n += n
+        total_t += elapsed
+        max_lag = max(max_lag, lag)
+        print(f"{name:<8} {n:>7} req  {elapsed:>7.2f}s  {n / elapsed:>9.1f} req/s  失败: {failures}  最大循环阻塞: {lag:.1f}ms")
+    print(f"{'total':<8} {total_n:>7} req  {total_t:>7.2f}s  {total_n / total_t:>9.1f} req/s  最大循环阻塞: {max_lag:.1f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+完整对局压测 - 模拟大量玩家同时进行完整对局，测量各接口延迟和数据一致性
+直接在进程内调用 ASGI 应用（包括启动/关闭流程、后台任务和 Telegram 发送队列），
+Telegram Bot API 由子进程中的本地桩服务（tg_stub.py）代替，使用临时数据库
+
+每对玩家按前端的流程走完 --rounds 局：
+    创建房间 → 分享到群 → 对方加入 → 双方 Ready → 倒计时后开局 → 批量提交点击 → 结算 → 查询余额
+
+结束时输出：
+- 每个接口的请求数、失败数（按状态码）、吞吐量和 p50/p95/p99/max 延迟
+- 写线程统计（批次、等待写锁和提交耗时）、事件循环最大阻塞
+- Telegram 消息发送/失败数和桩服务收到的消息数
+- 一致性：从头汇总账本与 users 表的差异、总余额守恒、冻结余额清零、房间状态分布
+
+用法:
+    python bench_game.py --games 500 --game-seconds 5 --json bench_game.json
+
+同样的参数和 --seed 产生同样的玩家行为（点击速度、开局错峰时间）。
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class Recorder:
+    """按接口（路由模板）记录每个请求的延迟和状态码"""
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+        self.details: dict[str, Counter] = defaultdict(Counter)
+        self.start = self.end = 0.0
+
+    async def call(self, client: httpx.AsyncClient, method: str, route: str, url: str, **kwargs) -> httpx.Response:
+        # 进程内的 ASGI 调用可能全程不挂起；让出一次事件循环，模拟请求从网络陆续到达
+        await asyncio.sleep(0)
+        start = time.perf_counter()
+        r = await client.request(method, url, **kwargs)
+        self.latencies[f"{method} {route}"].append((time.perf_counter() - start) * 1000)
+        self.statuses[f"{method} {route}"][r.status_code] += 1
+        if r.status_code >= 400:
+            self.details[f"{method} {route}"][f"{r.status_code} {r.json().get('detail')}"] += 1
+        return r
+
+    def report(self) -> dict:
+        seconds = self.end - self.start
+        endpoints = {}
+        for name in sorted(self.latencies):
+            samples = self.latencies[name]
+            if len(samples) > 1:
+                cuts = statistics.quantiles(samples, n=100, method="inclusive")
+                p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+            else:
+                p50 = p95 = p99 = samples[0]
+            statuses = self.statuses[name]
+            endpoints[name] = {
+                "requests": len(samples),
+                "errors": sum(n for status, n in statuses.items() if status >= 400),
+                "statuses": {str(status): n for status, n in sorted(statuses.items())},
+                "error_details": dict(self.details[name].most_common(5)),
+                "rps": round(len(samples) / seconds, 1),
+                "p50_ms": round(p50, 2),
+                "p95_ms": round(p95, 2),
+                "p99_ms": round(p99, 2),
+                "max_ms": round(max(samples), 2),
+            }
+        requests = sum(len(samples) for samples in self.latencies.values())
+        return {
+            "seconds": round(seconds, 2),
+            "requests": requests,
+            "errors": sum(e["errors"] for e in endpoints.values()),
+            "rps": round(requests / seconds, 1),
+            "endpoints": endpoints,
+        }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_stub() -> tuple[subprocess.Popen, str]:
+    """在子进程中启动 Telegram 桩服务，返回 (进程, 地址)"""
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "tg_stub.py"), "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            httpx.post(f"{url}/_stub/reset")
+            return proc, url
+        except httpx.TransportError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                proc.kill()
+                raise RuntimeError("Telegram 桩服务启动失败")
+            time.sleep(0.05)
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def click_until_end(rec, client, room_id, user, tps, interval, game_end):
+    """按 tps 次/秒点击，每 interval 秒提交一批，直到游戏结束（game_end 为服务器时间戳）"""
+    spacing = max(1000 / tps, 1000 / 20)  # 不超过服务端允许的最高频率（MAX_TAPS_PER_SECOND 默认 20）
+    while True:
+        # 最后一批在游戏结束时提交
+        await asyncio.sleep(max(0.0, min(interval, game_end - time.time())))
+        now = time.time()
+        count = max(1, round(interval * 1000 / spacing))
+        end_ms = int(time.time() * 1000)
+        taps = [end_ms - int((count - 1 - k) * spacing) for k in range(count)]
+        await rec.call(
+            client, "POST", "/api/rooms/{room_id}/clicks", f"/api/rooms/{room_id}/clicks",
+            json={"user": user, "count": count, "taps": taps}
+        )
+        if now >= game_end:
+            return
+
+async def play_game(rec, client, host, guest, chat_id, bet, host_tps, guest_tps, args, settlement):
+    """一局完整对局，返回是否走完全部流程"""
+    from api.scheduler import to_timestamp
+
+    r = await rec.call(client, "POST", "/api/rooms", "/api/rooms", json={"user": host, "bet_amount": bet})
+    if r.status_code != 200:
+        return False
+    room_id = r.json()["room_id"]
+    await rec.call(
+        client, "POST", "/api/rooms/{room_id}/share", f"/api/rooms/{room_id}/share",
+        json={"user": host, "chat_id": chat_id}
+    )
+
+    # 对方从大厅列表找到房间后加入
+    await rec.call(client, "GET", "/api/rooms/open/list", "/api/rooms/open/list", params={"limit": 20})
+    r = await rec.call(
+        client, "POST", "/api/rooms/{room_id}/join", f"/api/rooms/{room_id}/join", json={"user": guest}
+    )
+    if r.status_code != 200:
+        return False
+
+    for user in (host, guest):
+        await rec.call(client, "GET", "/api/rooms/{room_id}", f"/api/rooms/{room_id}")
+        await rec.call(client, "POST", "/api/rooms/{room_id}/ready", f"/api/rooms/{room_id}/ready", json={"user": user})
+
+    # 倒计时结束后双方都请求开局（先到的开局，另一方拿到同一个开局时间）
+    await asyncio.sleep(args.countdown_seconds)
+
+    async def start(user):
+        for _ in range(50):
+            r = await rec.call(
+                client, "POST", "/api/rooms/{room_id}/start", f"/api/rooms/{room_id}/start", json={"user": user}
+            )
+            if r.status_code != 400:
+                return r.json()["game_start_time"] if r.status_code == 200 else None
+            await asyncio.sleep(0.1)
+        return None
+
+    started = await asyncio.gather(start(host), start(guest))
+    if None in started:
+        return False
+
+    # 和前端一样按服务器返回的开局时间计时
+    game_end = to_timestamp(started[0]) + settlement.GAME_SECONDS
+    await asyncio.gather(
+        click_until_end(rec, client, room_id, host, host_tps, args.click_interval, game_end),
+        click_until_end(rec, client, room_id, guest, guest_tps, args.click_interval, game_end),
+    )
+
+    # 结束后双方都请求结算（服务端也会自动结算，结果相同），然后查看余额
+    await asyncio.sleep(max(0.0, game_end - time.time()) + 0.05)
+    for user in (host, guest):
+        r = await rec.call(
+            client, "POST", "/api/rooms/{room_id}/settle", f"/api/rooms/{room_id}/settle", json={"user": user}
+        )
+        await rec.call(client, "GET", "/api/users/{user_id}", f"/api/users/{user['user_id']}")
+    return r.status_code == 200
+
+async def play_pair(rec, client, i, args, settlement, rng):
+    host = {"user_id": 1_000_000 + i, "username": f"host{i}"}
+    guest = {"user_id": 2_000_000 + i, "username": f"guest{i}"}
+    chat_id = -1_000_000_000 - i
+    # 行为参数在开始前一次性生成，和调度顺序无关
+    delay = rng.uniform(0, args.ramp)
+    plan = [(rng.choice((5, 10, 20, 50)), rng.uniform(4, 15), rng.uniform(4, 15)) for _ in range(args.rounds)]
+
+    await asyncio.sleep(delay)
+    completed = 0
+    for bet, host_tps, guest_tps in plan:
+        completed += await play_game(rec, client, host, guest, chat_id, bet, host_tps, guest_tps, args, settlement)
+    return completed
+
+def check_consistency(expected_users: int) -> dict:
+    """对局全部结束后检查账本与余额（只读）"""
+    from api import reconcile
+    from api.db import connection
+    from api.service import DEFAULT_BALANCE
+
+    with connection() as conn:
+        report = reconcile.scan(conn, rebuild=True)
+        users, available, frozen = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(available), 0), COALESCE(SUM(frozen), 0) FROM users"
+        ).fetchone()
+        rooms = dict(conn.execute("SELECT status, COUNT(*) FROM rooms GROUP BY status").fetchall())
+
+    total = available + frozen
+    return {
+        "ok": not report.drift and users == expected_users and total == users * DEFAULT_BALANCE and frozen == 0,
+        "ledger_rows": report.rows,
+        "ledger_drift": len(report.drift),
+        "drift_sample": [list(row) for row in report.drift[:10]],
+        "users": users,
+        "total_balance": total,
+        "expected_total_balance": users * DEFAULT_BALANCE,
+        "frozen_balance": frozen,
+        "rooms": rooms,
+    }
+
+async def bench(args, stub_url: str) -> dict:
+    from api import db, settlement
+    import api.main as api_main
+
+    # 缩短对局时间，保持流程不变
+    settlement.GAME_SECONDS = args.game_seconds
+    api_main.COUNTDOWN_SECONDS = args.countdown_seconds
+    api_main.tg_sender.global_rate = args.tg_rate
+
+    rec = Recorder()
+    rng = random.Random(args.seed)
+    rngs = [random.Random(rng.getrandbits(64)) for _ in range(args.games)]
+    app = api_main.app
+
+    async with app.router.lifespan_context(app):
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits) as client:
+            # Bot 在后台线程导入（数秒，期间持有 GIL），等加载完再开始计时，只测稳定运行时的延迟
+            await api_main.bot_loading()
+            api_main.loop_monitor.reset()
+            rec.start = time.perf_counter()
+            completed = await asyncio.gather(*(
+                play_pair(rec, client, i, args, settlement, rngs[i]) for i in range(args.games)
+            ))
+            rec.end = time.perf_counter()
+            loop_lag = api_main.loop_monitor.snapshot()
+
+        # 等最后的结果消息发完再统计
+        try:
+            await asyncio.wait_for(api_main.tg_sender.drain(), timeout=30)
+        except asyncio.TimeoutError:
+            pass
+        telegram = {
+            "sent": api_main.tg_sender.sent,
+            "failed": api_main.tg_sender.failed,
+            "pending": api_main.tg_sender.pending(),
+            "stub_received": len(httpx.get(f"{stub_url}/_stub/messages").json()),
+        }
+        writer = db.writer_stats()
+        consistency = await db.run(check_consistency, args.games * 2)
+
+    return {
+        "games": {"planned": args.games * args.rounds, "completed": sum(completed)},
+        **rec.report(),
+        "db_writer": writer,
+        "event_loop": loop_lag,
+        "telegram": telegram,
+        "consistency": consistency,
+    }
+
+def print_report(result: dict) -> None:
+    print("=" * 100)
+    config = result["config"]
+    print(
+        f"pairs={config['games']} rounds={config['rounds']} game={config['game_seconds']}s "
+        f"seed={config['seed']} rev={result['git_rev']}"
+    )
+    print(f"对局: {result['games']['completed']}/{result['games']['planned']} 完成  "
+          f"{result['requests']} req / {result['seconds']}s = {result['rps']} req/s  失败: {result['errors']}")
+    print("=" * 100)
+    print(f"{'endpoint':<38} {'req':>7} {'err':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} (ms)")
+    for name, e in result["endpoints"].items():
+        print(
+            f"{name:<38} {e['requests']:>7} {e['errors']:>5} {e['rps']:>8} "
+            f"{e['p50_ms']:>8} {e['p95_ms']:>8} {e['p99_ms']:>8} {e['max_ms']:>8}"
+        )
+    writer = result["db_writer"]
+    print("-" * 100)
+    print(
+        f"写线程: {writer.get('batches')} 批 / {writer.get('commands')} 条命令 (最大批 {writer.get('max_batch')})  "
+        f"等待写锁 {writer.get('lock_wait_ms')}ms (最大 {writer.get('max_lock_wait_ms')}ms)  "
+        f"提交 {writer.get('commit_ms')}ms (最大 {writer.get('max_commit_ms')}ms)"
+    )
+    print(f"事件循环最大阻塞: {result['event_loop']['max_ms']}ms")
+    tg = result["telegram"]
+    print(f"Telegram: 发送 {tg['sent']} 失败 {tg['failed']} 未发送 {tg['pending']} 桩服务收到 {tg['stub_received']}")
+    c = result["consistency"]
+    print(
+        f"一致性: {'✅' if c['ok'] else '❌'} 账本 {c['ledger_rows']} 条，差异 {c['ledger_drift']} 个用户；"
+        f"总余额 {c['total_balance']}/{c['expected_total_balance']}；冻结 {c['frozen_balance']}；房间 {c['rooms']}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="LGW33 完整对局压测")
+    parser.add_argument("--games", type=int, default=500, help="同时对战的玩家对数")
+    parser.add_argument("--rounds", type=int, default=1, help="每对玩家连续进行的局数")
+    parser.add_argument("--game-seconds", type=float, default=5, help="每局时长（生产环境为30秒）")
+    parser.add_argument("--countdown-seconds", type=float, default=1, help="开局倒计时（生产环境为3秒）")
+    parser.add_argument("--click-interval", type=float, default=0.2, help="前端提交一批点击的间隔（秒）")
+    parser.add_argument("--ramp", type=float, default=2, help="各对玩家在这段时间内随机错开开始（秒）")
+    parser.add_argument("--tg-rate", type=float, default=1000, help="Telegram 全局发送速率（条/秒）")
+    parser.add_argument("--seed", type=int, default=33)
+    parser.add_argument("--json", help="把结果写入 JSON 文件（- 表示只向标准输出打印 JSON）")
+    args = parser.parse_args()
+
+    stub, stub_url = start_stub()
+    # 必须在导入 api 之前设置
+    os.environ.update({
+        "DB_PATH": os.path.join(tempfile.mkdtemp(prefix="lgw33-game-"), "bench.db"),
+        "TELEGRAM_API_URL": stub_url,
+        "BOT_TOKEN": "123456:BENCH",
+        "RECONCILE_INTERVAL": "0",
+    })
+    try:
+        # 只输出 JSON 时，把服务启动/关闭日志打到标准错误
+        with contextlib.redirect_stdout(sys.stderr) if args.json == "-" else contextlib.nullcontext():
+            result = asyncio.run(bench(args, stub_url))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    result = {"config": vars(args), "git_rev": git_revision(), **result}
+    if args.json == "-":
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_report(result)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            print(f"结果已写入 {args.json}")
+    sys.exit(0 if result["consistency"]["ok"] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+账本写入压测 - 对比旧版账本（UUID 文本主键 + ref 字符串）和当前的紧凑账本
+按批次（每批一个事务，相当于写线程的一次批量提交）追加记录，
+每写完 1/10 打印一次该段的写入速度，最后输出文件大小
+
+用法:
+    python bench_ledger.py --rows 10000000 --batch 100
+    python bench_ledger.py --rows 1000000 --layout compact
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import api.db
+from api import ledger
+from api.db import _m1_base_schema, migrate
+
+# 每种操作对应的 (类型, 原因)：注册赠送、冻结押注、结算、过期退款
+OPERATIONS = [
+    (ledger.CREDIT, ledger.SIGNUP),
+    (ledger.FREEZE, ledger.BET),
+    (ledger.FREEZE, ledger.BET),
+    (ledger.UNFREEZE, ledger.WIN),
+    (ledger.DEBIT, ledger.WIN),
+    (ledger.CREDIT, ledger.WIN),
+    (ledger.UNFREEZE, ledger.DRAW),
+    (ledger.UNFREEZE, ledger.EXPIRED),
+]
+
+def entries(n: int, users: int, seed: int = 42):
+    """生成 n 条 (user_id, type, amount, reason, room_id) 账本记录"""
+    rng = random.Random(seed)
+    for _ in range(n):
+        kind, reason = rng.choice(OPERATIONS)
+        room_id = None if reason == ledger.SIGNUP else "%012x" % rng.getrandbits(48)
+        yield rng.randint(1, users), kind, rng.choice((10, 50, 100, 500)), reason, room_id
+
+def legacy_ref(reason: int, room_id: str | None) -> str:
+    if reason == ledger.SIGNUP:
+        return "signup"
+    if reason == ledger.BET:
+        return f"room:{room_id}"
+    return f"room:{room_id}:{ledger.REASONS[reason]}"
+
+def open_db(path: str, layout: str):
+    api.db.DB_PATH = path
+    conn = api.db.get_conn()
+    if layout == "legacy":
+        _m1_base_schema(conn)
+        conn.commit()
+    else:
+        migrate(conn)
+    return conn
+
+def insert_batch(conn, layout: str, batch: list, started: datetime) -> None:
+    if layout == "compact":
+        ledger.record(conn, batch)
+        return
+    conn.executemany(
+        "INSERT INTO ledger(tx_id, user_id, type, amount, ref, created_at) VALUES(?,?,?,?,?,?)",
+        [
+            (str(uuid.uuid4()), user_id, ledger.TYPES[kind], amount, legacy_ref(reason, room_id),
+             (started + timedelta(microseconds=i)).strftime("%Y-%m-%d %H:%M:%S"))
+            for i, (user_id, kind, amount, reason, room_id) in enumerate(batch)
+        ]
+    )
+
+def file_size(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+def bench(layout: str, rows: int, batch_size: int, users: int, directory: str) -> dict:
+    path = os.path.join(directory, f"ledger-{layout}.db")
+    conn = open_db(path, layout)
+    report_every = max(rows // 10, batch_size)
+    started = datetime.utcnow()
+
+    print(f"\n[{layout}]")
+    segment_start = total_start = time.perf_counter()
+    written = next_report = 0
+    next_report = report_every
+    batch = []
+    last_rate = 0.0
+    for entry in entries(rows, users):
+        batch.append(entry)
+        if len(batch) < batch_size:
+            continue
+        insert_batch(conn, layout, batch, started)
+        conn.commit()
+        written += len(batch)
+        batch = []
+        if written >= next_report:
+            now = time.perf_counter()
+            last_rate = report_every / (now - segment_start)
+            print(f"  {written:>11,} 行  {last_rate:>10,.0f} 行/秒  文件 {file_size(path) / 1e6:>9.1f} MB")
+            segment_start = now
+            next_report += report_every
+    if batch:
+        insert_batch(conn, layout, batch, started)
+        conn.commit()
+    elapsed = time.perf_counter() - total_start
+
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    size = file_size(path)
+    conn.close()
+    os.remove(path)
+    return {"layout": layout, "rows": rows, "seconds": elapsed, "rate": rows / elapsed,
+            "last_rate": last_rate, "bytes": size}
+
+def main():
+    parser = argparse.ArgumentParser(description="LGW33 账本写入吞吐量与文件大小测试")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--batch", type=int, default=100, help="每个事务写入的记录数")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--layout", choices=["legacy", "compact", "both"], default="both")
+    args = parser.parse_args()
+
+    layouts = ["legacy", "compact"] if args.layout == "both" else [args.layout]
+    directory = tempfile.mkdtemp(prefix="lgw33-ledger-")
+    results = [bench(layout, args.rows, args.batch, args.users, directory) for layout in layouts]
+
+    print("=" * 72)
+    print(f"rows={args.rows:,} batch={args.batch} users={args.users:,}")
+    print("=" * 72)
+    for r in results:
+        print(
+            f"{r['layout']:<8} {r['seconds']:>8.1f}s  平均 {r['rate']:>10,.0f} 行/秒  "
+            f"最后10% {r['last_rate']:>10,.0f} 行/秒  "
+            f"{r['bytes'] / 1e6:>9.1f} MB ({r['bytes'] / r['rows']:.0f} 字节/行)"
+        )
+
+if __name__ == "__main__":
+    main()
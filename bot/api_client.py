@@ -1,11 +1,28 @@
+"""
+Bot 访问房间/钱包服务的客户端
+
+与 API 同进程运行（Webhook 模式，由 api/main.py 调用 use_local）时直接调用 api.service，
+单独部署（python -m bot.main 轮询模式）时通过 HTTP 内部接口访问 API。
+"""
 import os
 import httpx
 
 API_URL = os.getenv("API_URL", "http://127.0.0.1:8000")
 INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY", "change_me")
 
+# 同进程时的服务模块（api.service），为 None 时走 HTTP
+_service = None
+
+def use_local(service) -> None:
+    """切换为进程内调用"""
+    global _service
+    _service = service
+
 async def init_user(user_id: int, username: str | None) -> dict:
     """初始化用户账户"""
+    if _service is not None:
+        return await _service.init_user(user_id, username)
+
     url = f"{API_URL}/api/internal/init_user"
     headers = {"x-internal-key": INTERNAL_API_KEY}
     payload = {"user_id": user_id, "username": username}
@@ -16,6 +33,9 @@ async def init_user(user_id: int, username: str | None) -> dict:
         return r.json()
 
 async def join_room_as_user(invite_token: str, user_id: int, username: str | None) -> dict:
+    if _service is not None:
+        return await _service.join_by_invite(invite_token, user_id, username)
+
     url = f"{API_URL}/api/internal/join"
     headers = {"x-internal-key": INTERNAL_API_KEY}
     payload = {"invite_token": invite_token, "user_id": user_id, "username": username}
@@ -27,6 +47,9 @@ async def join_room_as_user(invite_token: str, user_id: int, username: str | Non
 
 async def get_user_balance(user_id: int) -> dict:
     """获取用户余额"""
+    if _service is not None:
+        return await _service.get_user(user_id)
+
     url = f"{API_URL}/api/users/{user_id}"
     async with httpx.AsyncClient(timeout=15) as client:
         r = await client.get(url)
@@ -0,0 +1,139 @@
+"""
+Mini App 静态资源构建脚本
+
+把 miniapp/ 构建到 dist/miniapp/，由 API 的静态资源处理器（api/assets.py）直接提供：
+- 图片等资源按内容哈希改名（logo.webp -> logo.1a2b3c4d.webp），HTML 中的引用同步替换
+- HTML 中的内联 <style> / <script> 提取成带哈希的 .css / .js 文件
+- 可压缩的文件另外生成 .br（需要 brotli 包）和 .gz 预压缩版本，请求时不再压缩
+- manifest.json 记录 原路径 -> 带哈希的路径；带哈希的文件可以永久缓存（immutable），
+  HTML 入口保持原名，每次打开通过 ETag 重新验证
+
+运行: python build_assets.py（部署时在启动服务之前执行；修改 miniapp/ 后需要重新构建）
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+
+try:
+    import brotli
+except ImportError:  # 没有 brotli 时只生成 .gz
+    brotli = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(ROOT, "miniapp")
+BUILD_DIR = os.path.join(ROOT, "dist", "miniapp")
+
+MANIFEST = "manifest.json"
+# 值得压缩的文本类型；webp/png 等本身已压缩
+COMPRESSIBLE = {".html", ".css", ".js", ".json", ".svg", ".txt", ".map"}
+# 压缩后至少小这么多才保留压缩版本
+MIN_SAVING = 0.05
+
+_INLINE = re.compile(r"<(style|script)>(.*?)</\1>", re.S)
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:8]
+
+def hashed_name(path: str, data: bytes) -> str:
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{content_hash(data)}{ext}"
+
+def write(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+def compress(path: str, data: bytes) -> list[tuple[str, int]]:
+    """生成预压缩版本，返回 [(编码, 大小)]"""
+    if os.path.splitext(path)[1] not in COMPRESSIBLE:
+        return []
+    variants = [("gz", gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.insert(0, ("br", brotli.compress(data, quality=11)))
+    kept = []
+    for suffix, packed in variants:
+        if len(packed) <= len(data) * (1 - MIN_SAVING):
+            write(f"{path}.{suffix}", packed)
+            kept.append((suffix, len(packed)))
+    return kept
+
+def build(source: str = SOURCE_DIR, target: str = BUILD_DIR) -> dict[str, str]:
+    """构建到 target（先清空），返回 manifest"""
+    files = {}
+    for dirpath, _, filenames in os.walk(source):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, source).replace(os.sep, "/")] = f.read()
+
+    # 1. 非 HTML 资源按内容哈希改名
+    manifest = {
+        name: hashed_name(name, data)
+        for name, data in sorted(files.items())
+        if not name.endswith(".html")
+    }
+    outputs = {manifest[name]: data for name, data in files.items() if name in manifest}
+
+    # 2. HTML：替换资源引用（长路径先替换，避免前缀冲突），提取内联样式和脚本
+    for name, data in files.items():
+        if not name.endswith(".html"):
+            continue
+        html = data.decode("utf-8")
+        for original in sorted(manifest, key=len, reverse=True):
+            html = html.replace(original, manifest[original])
+
+        base = os.path.splitext(name)[0]
+
+        def extract(match):
+            tag, body = match.group(1), match.group(2)
+            ext = ".css" if tag == "style" else ".js"
+            data = body.strip().encode("utf-8") + b"\n"
+            original = f"assets/{base}{ext}"
+            hashed = manifest[original] = hashed_name(original, data)
+            outputs[hashed] = data
+            if tag == "style":
+                return f'<link rel="stylesheet" href="{hashed}">'
+            return f'<script src="{hashed}"></script>'
+
+        outputs[name] = _INLINE.sub(extract, html).encode("utf-8")
+
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    report = []
+    for name, data in sorted(outputs.items()):
+        path = os.path.join(target, name)
+        write(path, data)
+        report.append((name, len(data), compress(path, data)))
+    write(os.path.join(target, MANIFEST), json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+
+    for name, size, variants in report:
+        packed = "  ".join(f"{suffix} {packed_size:,}" for suffix, packed_size in variants)
+        print(f"   {name:<48} {size:>9,}  {packed}")
+    return manifest
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="构建 Mini App 静态资源")
+    parser.add_argument("--source", default=SOURCE_DIR, help="源目录（默认 miniapp/）")
+    parser.add_argument("--out", default=BUILD_DIR, help="输出目录（默认 dist/miniapp/）")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print(f"构建 Mini App 静态资源: {args.source} -> {args.out}")
+    print("=" * 70)
+    if brotli is None:
+        print("⚠️ 未安装 brotli（pip install brotli），只生成 gzip 版本")
+
+    start = time.perf_counter()
+    manifest = build(args.source, args.out)
+    print(f"\n✅ 构建完成：{len(manifest)} 个带哈希的资源，用时 {time.perf_counter() - start:.2f}秒")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
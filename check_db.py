@@ -1,6 +1,9 @@
 import sqlite3
 
+from api.ledger import describe
+
 conn = sqlite3.connect('lgw33.db')
+conn.row_factory = sqlite3.Row
 cur = conn.cursor()
 
 print("=" * 70)
@@ -28,13 +31,15 @@ if rooms:
         print()
 else:
     print("  (无房间)")
+archived = cur.execute('SELECT COUNT(*) FROM rooms_archive').fetchone()[0]
+print(f"  已归档房间: {archived}\n")
 
 print("=== 账本 ===")
-cur.execute('SELECT user_id, type, amount, ref FROM ledger ORDER BY created_at')
+cur.execute('SELECT * FROM ledger ORDER BY tx_id')
 ledger = cur.fetchall()
 if ledger:
     for row in ledger:
-        print(f"  user_id={row[0]}, {row[1]}: {row[2]} ({row[3]})")
+        print(f"  user_id={row['user_id']}, {describe(row)}")
 else:
     print("  (无记录)")
 
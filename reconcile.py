@@ -0,0 +1,64 @@
+"""
+余额对账脚本
+只汇总上次检查点之后新增的账本记录，与 users 表逐个比较，报告余额不一致的用户并推进检查点。
+API 服务会定期在后台执行同样的对账（RECONCILE_INTERVAL），此脚本用于手动检查。
+
+用法:
+    python reconcile.py             # 增量对账
+    python reconcile.py --dry-run   # 只检查，不写检查点
+    python reconcile.py --rebuild   # 丢弃检查点，从头汇总整个账本
+"""
+import argparse
+import sys
+
+from api.db import DB_PATH, SCHEMA_VERSION, get_conn, schema_version
+from api.reconcile import print_drift, replace_checkpoint, save_checkpoint, scan
+
+def write(conn, fn, *args):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = fn(conn, *args)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="LGW33 余额对账")
+    parser.add_argument("--dry-run", action="store_true", help="只检查，不写检查点")
+    parser.add_argument("--rebuild", action="store_true", help="丢弃检查点，从头汇总整个账本")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print(f"余额对账  数据库: {DB_PATH}")
+    print("=" * 70)
+
+    conn = get_conn()
+    try:
+        if schema_version(conn) < SCHEMA_VERSION:
+            print("❌ 数据库版本过旧，请先执行 python migrate_db.py")
+            return 1
+
+        report = scan(conn, rebuild=args.rebuild)
+        print(f"账本记录: tx_id {report.base_tx} → {report.tx_id}，本次汇总 {report.rows} 条")
+        print(f"用户数: {report.users}  耗时: {report.seconds:.2f}s")
+        print_drift(report)
+
+        if not args.dry_run:
+            if write(conn, replace_checkpoint if args.rebuild else save_checkpoint, report):
+                print(f"✅ 检查点已推进到 tx_id {report.tx_id}")
+            else:
+                print("⚠️ 检查点已被其他对账推进，本次未写入")
+    finally:
+        conn.close()
+
+    print("=" * 70)
+    if report.drift:
+        print(f"❌ {len(report.drift)} 个用户余额与账本不一致")
+        return 1
+    print("✅ 所有用户余额与账本一致")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
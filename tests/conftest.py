@@ -0,0 +1,104 @@
+"""
+测试共用的 fixture 和辅助函数
+每个测试使用 tmp_path 下的临时数据库；不会连接真实的 Telegram
+
+运行: python -m pytest -q
+"""
+import asyncio
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+import uvicorn
+from fastapi.testclient import TestClient
+
+import api.db
+import api.main
+import tg_stub
+from api.activity import activity
+from api.clicks import counter
+from api.leaderboard import leaderboard
+from api.lobby import lobby
+from api.matchmaking import queue
+from api.wallets import wallets
+
+HOST = {"user_id": 111111, "username": "player1"}
+GUEST = {"user_id": 222222, "username": "player2"}
+
+def reset_db() -> None:
+    """关闭连接池，清空缓存了上一个数据库内容的进程内状态（测试换库时调用）"""
+    api.db.close_pool()
+    for state in (activity, counter, leaderboard, lobby, queue, wallets):
+        state.reset()
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """切换到已迁移的临时数据库"""
+    monkeypatch.setattr(api.db, "DB_PATH", tmp_path / "test.db")
+    reset_db()
+    api.db.init_db()
+    yield api.db.DB_PATH
+    reset_db()
+
+@pytest.fixture
+def app(db_path, monkeypatch):
+    """临时数据库上的 API 应用；不启动开局/结算/过期定时器，需要时由测试改时间后直接调用接口"""
+    monkeypatch.setattr(api.main.scheduler, "arm", lambda *args: None)
+    return api.main.app
+
+@pytest.fixture
+def client(app):
+    return TestClient(app)
+
+@pytest.fixture
+def run(app):
+    """run(scenario)：在同一个事件循环中用异步客户端执行 scenario(client)，用于并发请求"""
+    def run(scenario):
+        async def main():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await scenario(client)
+        return asyncio.run(main())
+    return run
+
+def backdate(column: str, room_id: str, seconds: int) -> None:
+    """把房间的时间列改到 seconds 秒之前（ISO 格式，UTC）"""
+    conn = sqlite3.connect(api.db.DB_PATH)
+    conn.execute(
+        f"UPDATE rooms SET {column}=? WHERE room_id=?",
+        ((datetime.utcnow() - timedelta(seconds=seconds)).isoformat(), room_id)
+    )
+    conn.commit()
+    conn.close()
+
+def start_game(client, host: dict = HOST, guest: dict = GUEST, bet: int = 10, chat_id: int | None = None) -> str:
+    """创建房间、加入、双方 Ready 并跳过倒计时开局，返回 PLAYING 状态的房间ID"""
+    body = {"user": host, "bet_amount": bet}
+    if chat_id:
+        body["chat_id"] = chat_id
+    room_id = client.post("/api/rooms", json=body).json()["room_id"]
+    assert client.post(f"/api/rooms/{room_id}/join", json={"user": guest}).status_code == 200
+    for user in (host, guest):
+        assert client.post(f"/api/rooms/{room_id}/ready", json={"user": user}).status_code == 200
+    backdate("countdown_start_time", room_id, 5)
+    assert client.post(f"/api/rooms/{room_id}/start", json={"user": host}).status_code == 200
+    return room_id
+
+@pytest.fixture(scope="session")
+def stub_url():
+    """在后台线程中运行 Telegram Bot API 桩服务（tg_stub.py），返回其地址"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(tg_stub.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    thread.join()
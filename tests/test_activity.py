@@ -0,0 +1,47 @@
+"""
+用户注册 / 活跃记录测试
+并发注册只发放一次初始余额；已知用户的活跃记录不产生写事务，合并后批量写回
+
+运行: python -m pytest -q tests/test_activity.py
+"""
+import asyncio
+import sqlite3
+
+import api.db
+import api.main
+from api import ledger, service
+from api.activity import activity
+
+def test_signup_credited_once(db_path):
+    async def main():
+        return await asyncio.gather(*(service.init_user(42, "alice") for _ in range(20)))
+
+    users = asyncio.run(main())
+    assert {user["available"] for user in users} == {service.DEFAULT_BALANCE}
+
+    conn = sqlite3.connect(db_path)
+    signups = conn.execute(
+        "SELECT COUNT(*) FROM ledger WHERE user_id=42 AND reason=?", (ledger.SIGNUP,)
+    ).fetchone()[0]
+    conn.close()
+    assert signups == 1
+    assert activity.known(42)
+
+def test_known_users_are_written_behind(db_path):
+    asyncio.run(service.init_user(42, "alice"))
+    asyncio.run(api.main.flush_activity())
+    commands = api.db.writer_stats()["commands"]
+
+    async def main():
+        await service.init_user(42, "alice2")
+        await service.ensure_user(42, "alice3")
+
+    asyncio.run(main())
+    assert api.db.writer_stats()["commands"] == commands
+    assert activity.pending() == 1
+
+    # 两次更新合并为一次写回，以最后一次为准
+    assert asyncio.run(api.main.flush_activity()) == 1
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT username FROM users WHERE user_id=42").fetchone()[0] == "alice3"
+    conn.close()
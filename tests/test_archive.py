@@ -0,0 +1,69 @@
+"""
+房间归档测试
+已结束的旧房间分批移到 rooms_archive，按房间ID查询、重复结算和对局历史仍然能读到
+
+运行: python -m pytest -q tests/test_archive.py
+"""
+import asyncio
+import sqlite3
+
+import api.db
+import api.main
+from api import archive
+from conftest import GUEST, HOST, backdate
+
+def execute(sql: str, *params) -> list:
+    conn = sqlite3.connect(api.db.DB_PATH)
+    rows = conn.execute(sql, params).fetchall()
+    conn.commit()
+    conn.close()
+    return rows
+
+def play(client, days_ago: int) -> str:
+    """完成一局并把创建时间改到 days_ago 天前"""
+    room_id = client.post("/api/rooms", json={"user": HOST, "bet_amount": 10}).json()["room_id"]
+    assert client.post(f"/api/rooms/{room_id}/join", json={"user": GUEST}).status_code == 200
+    for user in (HOST, GUEST):
+        assert client.post(f"/api/rooms/{room_id}/ready", json={"user": user}).status_code == 200
+    backdate("countdown_start_time", room_id, 5)
+    assert client.post(f"/api/rooms/{room_id}/start", json={"user": HOST}).status_code == 200
+    assert client.post(f"/api/rooms/{room_id}/click", json={"user": GUEST}).status_code == 200
+    backdate("game_start_time", room_id, 40)
+    assert client.post(f"/api/rooms/{room_id}/settle", json={"user": HOST}).status_code == 200
+    backdate("created_at", room_id, days_ago * 86400 + 60)
+    return room_id
+
+def test_archive_in_batches(client):
+    old = [play(client, days) for days in (3, 2, 2)]
+    recent = play(client, 0)
+    # 未结束的旧房间不归档
+    live = client.post("/api/rooms", json={"user": HOST, "bet_amount": 10}).json()["room_id"]
+    backdate("created_at", live, 3 * 86400)
+
+    assert asyncio.run(archive.archive_rooms(hours=24, batch=2)) == 3
+    assert archive.last["batches"] == 2
+    assert {row[0] for row in execute("SELECT room_id FROM rooms")} == {recent, live}
+    assert {row[0] for row in execute("SELECT room_id FROM rooms_archive")} == set(old)
+
+    # 按ID查询和重复结算读归档表
+    room = client.get(f"/api/rooms/{old[0]}").json()
+    assert (room["status"], room["winner_id"], room["guest_clicks"]) == ("FINISHED", GUEST["user_id"], 1)
+    r = client.post(f"/api/rooms/{old[0]}/settle", json={"user": HOST})
+    assert r.status_code == 200 and r.json()["winner_id"] == GUEST["user_id"]
+
+    assert asyncio.run(archive.archive_rooms(hours=24, batch=2)) == 0
+
+def test_history_across_hot_and_cold(client):
+    rooms = [play(client, days) for days in (3, 2, 1, 0)]
+    assert asyncio.run(archive.archive_rooms(hours=36)) == 2
+
+    # 从新到旧，跨越 rooms / rooms_archive 分页
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        page = client.get(f"/api/users/{GUEST['user_id']}/history", params=params).json()
+        seen += [room["room_id"] for room in page["rooms"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert seen == rooms[::-1]
@@ -0,0 +1,75 @@
+"""
+Mini App 静态资源测试
+构建出带哈希、预压缩的资源；带哈希的文件永久缓存，HTML 入口通过 ETag 重新验证
+
+运行: python -m pytest -q tests/test_assets.py
+"""
+import gzip
+import json
+import re
+
+import brotli
+import pytest
+from fastapi.testclient import TestClient
+
+import api.main
+import build_assets
+from api.assets import IMMUTABLE, StaticAssets
+
+@pytest.fixture
+def serve(tmp_path, monkeypatch):
+    def serve(directory):
+        assets = StaticAssets(str(directory), fallback=build_assets.SOURCE_DIR)
+        monkeypatch.setattr(api.main, "miniapp_assets", assets)
+        routes = [route for route in api.main.app.routes if getattr(route, "path", None) == "/miniapp"]
+        monkeypatch.setattr(routes[0], "app", assets)
+        return TestClient(api.main.app), assets
+    return serve
+
+def test_build_and_serve(tmp_path, serve):
+    out = tmp_path / "dist"
+    manifest = build_assets.build(target=str(out))
+    client, assets = serve(out)
+
+    pk_js = manifest["assets/pk.js"]
+    logo = manifest["image/logo.webp"]
+    assert re.fullmatch(r"assets/pk\.[0-9a-f]{8}\.js", pk_js)
+    html = (out / "index.html").read_text()
+    assert logo in html and "image/logo.webp" not in html
+    assert "<style>" not in (out / "pk.html").read_text()
+    assert json.loads((out / "manifest.json").read_text()) == manifest
+
+    # HTML 入口：预压缩版本 + ETag 重新验证
+    r = client.get("/miniapp/pk.html", headers={"Accept-Encoding": "gzip, br"})
+    assert r.status_code == 200 and assets.built
+    assert (r.headers["content-encoding"], r.headers["cache-control"]) == ("br", "no-cache")
+    assert r.headers["vary"] == "Accept-Encoding"
+    assert r.content == (out / "pk.html").read_bytes()  # httpx 已解压
+    assert brotli.decompress((out / "pk.html.br").read_bytes()) == r.content
+    etag = r.headers["etag"]
+    r = client.get("/miniapp/pk.html", headers={"Accept-Encoding": "br", "If-None-Match": etag})
+    assert r.status_code == 304 and not r.content
+
+    # 带哈希的资源：永久缓存
+    r = client.get(f"/miniapp/{pk_js}", headers={"Accept-Encoding": "gzip"})
+    assert (r.headers["content-encoding"], r.headers["cache-control"]) == ("gzip", IMMUTABLE)
+    assert gzip.decompress((out / f"{pk_js}.gz").read_bytes()) == r.content
+    r = client.get(f"/miniapp/{pk_js}", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in r.headers and r.headers["content-type"].startswith("text/javascript")
+
+    # 图片本身已压缩，不生成压缩版本
+    r = client.get(f"/miniapp/{logo}", headers={"Accept-Encoding": "gzip, br"})
+    assert "content-encoding" not in r.headers and r.headers["content-type"] == "image/webp"
+    assert r.headers["cache-control"] == IMMUTABLE
+
+    assert client.get("/miniapp/").content == (out / "index.html").read_bytes()
+    assert client.get("/miniapp/image/logo.webp").status_code == 404
+    assert client.head(f"/miniapp/{logo}").headers["content-length"] == str((out / logo).stat().st_size)
+
+def test_serves_source_without_build(tmp_path, serve):
+    client, assets = serve(tmp_path / "missing")
+    r = client.get("/miniapp/index.html", headers={"Accept-Encoding": "gzip, br"})
+    assert r.status_code == 200 and not assets.built
+    assert "content-encoding" not in r.headers and r.headers["cache-control"] == "no-cache"
+    assert client.get("/miniapp/index.html", headers={"If-None-Match": r.headers["etag"]}).status_code == 304
+    assert client.get("/miniapp/image/logo.webp").status_code == 200
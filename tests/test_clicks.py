@@ -0,0 +1,168 @@
+"""
+点击计数测试
+批量提交的校验：超过最高频率的部分不计入而不是拒绝整批，整局上限按已开始时间计算，结束后有网络延迟容差；
+内存计数的快照写回数据库，进程重启后从快照恢复；结算在写命令中关闭计数，之前接受的点击都计入结果
+
+运行: python -m pytest -q tests/test_clicks.py
+"""
+import asyncio
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import api.db
+import api.main
+from api.clicks import STALE_AFTER, ClickCounter, counter, save_counts
+from api.main import CLICK_BATCH_GRACE, MAX_TAPS_PER_SECOND
+from api.settlement import GAME_SECONDS
+from conftest import GUEST, HOST, backdate, start_game
+
+def db_clicks(room_id: str) -> tuple[int, int]:
+    conn = sqlite3.connect(api.db.DB_PATH)
+    row = conn.execute("SELECT host_clicks, guest_clicks FROM rooms WHERE room_id=?", (room_id,)).fetchone()
+    conn.close()
+    return row
+
+def batch(client, room_id: str, taps: list[int], user: dict = HOST, count: int | None = None):
+    body = {"user": user, "count": len(taps) if count is None else count, "taps": taps}
+    return client.post(f"/api/rooms/{room_id}/clicks", json=body)
+
+def test_batch_validation(client):
+    room_id = start_game(client)
+    assert batch(client, room_id, [1000, 1100], count=3).json()["detail"] == "Tap count does not match timestamps"
+    assert batch(client, room_id, [1000, 1100, 1050]).json()["detail"] == "Tap timestamps must be in order"
+    r = batch(client, room_id, [1000, 1000 + api.main.CLICK_BATCH_MAX_SPAN_MS + 1])
+    assert (r.status_code, r.json()["detail"]) == (400, "Tap batch window too long")
+    assert batch(client, room_id, [1000], user={"user_id": 1, "username": "x"}).status_code == 403
+    assert counter.counts(room_id) == (0, 0)
+
+def test_batch_rate_is_clamped(client):
+    room_id = start_game(client)
+    # 两次间隔很短的正常连点全部计入
+    r = batch(client, room_id, [1000, 1010])
+    assert r.status_code == 200 and r.json()["accepted"] == 2
+
+    # 一批中超过最高频率的部分不计入（1 秒窗口内最多 MAX_TAPS_PER_SECOND 次）
+    r = batch(client, room_id, [2000 + i for i in range(30)], user=GUEST)
+    assert r.status_code == 200 and r.json()["accepted"] == MAX_TAPS_PER_SECOND
+
+    # 整局上限：刚开局时最多 MAX_TAPS_PER_SECOND * (0 + 容差) 次
+    limit = int(MAX_TAPS_PER_SECOND * CLICK_BATCH_GRACE)
+    r = batch(client, room_id, [3000 + 50 * i for i in range(limit)])
+    assert r.json()["accepted"] == limit - 2
+    assert client.post(f"/api/rooms/{room_id}/click", json={"user": HOST}).json()["host_clicks"] == limit
+    assert counter.counts(room_id) == (limit, MAX_TAPS_PER_SECOND)
+
+def test_grace_after_game_time(client):
+    room_id = start_game(client)
+    entry = counter.get(room_id)
+
+    # 游戏时间刚到：最后一批在容差内到达仍然计入
+    entry.game_start = datetime.utcnow() - timedelta(seconds=GAME_SECONDS + CLICK_BATCH_GRACE / 2)
+    r = batch(client, room_id, [1000, 1100, 1200])
+    assert r.status_code == 200 and r.json()["accepted"] == 3
+    # 单次点击没有容差
+    assert client.post(f"/api/rooms/{room_id}/click", json={"user": HOST}).json()["detail"] == "Game time expired"
+
+    entry.game_start = datetime.utcnow() - timedelta(seconds=GAME_SECONDS + CLICK_BATCH_GRACE + 0.5)
+    r = batch(client, room_id, [5000])
+    assert (r.status_code, r.json()["detail"]) == (400, "Game time expired")
+    assert counter.counts(room_id) == (3, 0)
+
+def test_take_and_restore_dirty():
+    clicks = ClickCounter()
+    now = datetime.utcnow()
+    for room_id, started in (("live", now), ("stale", now - timedelta(seconds=STALE_AFTER + 1))):
+        clicks.track({"room_id": room_id, "host_id": 1, "guest_id": 2, "game_start_time": started.isoformat(),
+                      "host_clicks": 0, "guest_clicks": 0})
+    assert clicks.add("live", 1, 3) == (3, 3, 0) and clicks.add("live", 2) == (1, 3, 1)
+    assert clicks.add("live", 9) is None and clicks.add("missing", 1) is None
+
+    # 取出后清除脏标记；早已超时却没有结算的房间被丢弃
+    rows = clicks.take_dirty()
+    assert rows == [(3, 1, "live")]
+    assert clicks.take_dirty() == [] and clicks.get("stale") is None
+
+    # 写入失败：恢复脏标记，下次快照重试（期间新增的点击一起写入）
+    clicks.restore_dirty(rows + [(0, 0, "stale")])
+    clicks.add("live", 1, 2, limit=4)
+    assert clicks.take_dirty() == [(4, 1, "live")]
+
+def test_snapshot_and_restart(client, monkeypatch):
+    room_id = start_game(client)
+    for user, n in ((HOST, 3), (GUEST, 2)):
+        for _ in range(n):
+            assert client.post(f"/api/rooms/{room_id}/click", json={"user": user}).status_code == 200
+    # 点击只在内存中累加
+    assert db_clicks(room_id) == (0, 0)
+
+    def broken(conn, rows):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(api.main, "save_counts", broken)
+    with pytest.raises(sqlite3.OperationalError):
+        asyncio.run(api.main.snapshot_clicks())
+    monkeypatch.setattr(api.main, "save_counts", save_counts)
+    assert asyncio.run(api.main.snapshot_clicks()) == 1
+    assert db_clicks(room_id) == (3, 2)
+    assert asyncio.run(api.main.snapshot_clicks()) == 0
+
+    # 进程重启：内存计数丢失，下一次点击从数据库快照恢复后继续累加
+    counter.reset()
+    r = client.post(f"/api/rooms/{room_id}/click", json={"user": GUEST})
+    assert (r.json()["host_clicks"], r.json()["guest_clicks"]) == (3, 3)
+    assert client.get(f"/api/rooms/{room_id}").json()["guest_clicks"] == 3
+
+    # 快照只更新仍在进行中的房间，不会覆盖已结算的结果
+    backdate("game_start_time", room_id, GAME_SECONDS + 1)
+    counter.get(room_id).game_start = datetime.utcnow() - timedelta(seconds=GAME_SECONDS + 1)
+    assert client.post(f"/api/rooms/{room_id}/settle", json={"user": HOST}).json()["winner_id"] is None
+    api.db.get_writer().submit(save_counts, [(9, 9, room_id)]).result(timeout=5)
+    assert db_clicks(room_id) == (3, 3)
+
+def test_clicks_until_settle_are_counted(client, run):
+    room_id = start_game(client)
+    backdate("game_start_time", room_id, GAME_SECONDS + 1)
+    # 最后一批点击在容差内到达
+    counter.get(room_id).game_start = datetime.utcnow() - timedelta(seconds=GAME_SECONDS + CLICK_BATCH_GRACE / 2)
+
+    async def scenario(client):
+        # 写线程被占用：结算命令排队期间到达的点击
+        running, release = threading.Event(), threading.Event()
+
+        def blocker(conn):
+            running.set()
+            assert release.wait(5)
+
+        blocked = asyncio.ensure_future(api.db.write(blocker))
+        assert await asyncio.to_thread(running.wait, 5)
+        settle = asyncio.ensure_future(client.post(f"/api/rooms/{room_id}/settle", json={"user": HOST}))
+        await asyncio.sleep(0.1)
+        late = await client.post(f"/api/rooms/{room_id}/clicks", json={"user": GUEST, "count": 1, "taps": [1000]})
+        release.set()
+        await blocked
+        return late, await settle
+
+    late, settled = run(scenario)
+    # 被接受的点击计入结算结果（而不是返回 200 却丢失）
+    assert late.status_code == 200 and late.json()["accepted"] == 1
+    assert settled.json()["winner_id"] == GUEST["user_id"] and settled.json()["guest_clicks"] == 1
+    assert db_clicks(room_id) == (0, 1)
+    r = batch(client, room_id, [2000], user=HOST)
+    assert (r.status_code, r.json()["detail"]) == (400, "Game is not playing")
+
+def test_closed_counter_rejects_clicks(client):
+    room_id = start_game(client)
+    assert client.post(f"/api/rooms/{room_id}/click", json={"user": HOST}).status_code == 200
+    room = dict(api.main.load_room(room_id))
+    # 结算写命令关闭计数后（提交之前）到达的点击被拒绝
+    assert counter.close(room) == (1, 0)
+    r = client.post(f"/api/rooms/{room_id}/click", json={"user": GUEST})
+    assert (r.status_code, r.json()["detail"]) == (400, "Game is not playing")
+    assert counter.close(room) == (1, 0)
+
+    # 内存中没有该房间时从数据库快照开始
+    counter.discard(room_id)
+    assert counter.close(room) == (room["host_clicks"], room["guest_clicks"])
@@ -0,0 +1,137 @@
+"""
+批量提交（GroupWriter）测试
+同一批次中出错的命令只回滚自己的 SAVEPOINT；提交后回调在调用方拿到结果之前执行；COMMIT 失败时整批命令都失败；
+写命令中的业务错误（ServiceError）映射为 HTTP 错误
+
+运行: python -m pytest -q tests/test_db.py
+"""
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+import api.db
+import api.main
+from api.db import GroupWriter
+from conftest import GUEST, HOST
+
+@pytest.fixture
+def writer(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE items (name TEXT PRIMARY KEY)")
+    conn.commit()
+    conn.close()
+    writer = GroupWriter()
+    yield writer
+    writer.close()
+
+def names() -> list[str]:
+    conn = sqlite3.connect(api.db.DB_PATH)
+    rows = [row[0] for row in conn.execute("SELECT name FROM items ORDER BY name")]
+    conn.close()
+    return rows
+
+def insert(conn, name: str, fail: bool = False, hook=None) -> str:
+    conn.execute("INSERT INTO items(name) VALUES(?)", (name,))
+    if hook:
+        hook()
+    if fail:
+        raise ValueError(f"{name} failed")
+    return name
+
+def submit_batch(writer: GroupWriter, commands: list[tuple]) -> list[Future]:
+    """先用一个阻塞的命令占住写线程，让其余命令排在同一批中"""
+    running, release = threading.Event(), threading.Event()
+
+    def block(conn):
+        running.set()
+        release.wait(5)
+
+    blocker = writer.submit(block)
+    assert running.wait(5)
+    futures = [writer.submit(fn, *args) for fn, *args in commands]
+    release.set()
+    blocker.result(timeout=5)
+    return futures
+
+def test_failed_command_rolls_back_only_itself(writer):
+    ran = []
+    futures = submit_batch(writer, [
+        (insert, "a"),
+        (insert, "b", True, lambda: writer.after_commit(lambda: ran.append("b"))),
+        (insert, "c", False, lambda: writer.after_commit(lambda: ran.append("c"))),
+    ])
+
+    assert futures[0].result(timeout=5) == "a" and futures[2].result(timeout=5) == "c"
+    with pytest.raises(ValueError, match="b failed"):
+        futures[1].result(timeout=5)
+    assert names() == ["a", "c"]
+    # 回滚的命令登记的回调不执行
+    assert ran == ["c"]
+    assert writer.stats["batches"] == 2 and writer.stats["max_batch"] == 3
+    assert (writer.stats["errors"], writer.stats["failed_batches"]) == (1, 0)
+
+def test_after_commit_runs_before_result(writer):
+    events = []
+
+    def command(conn, name: str) -> str:
+        conn.execute("INSERT INTO items(name) VALUES(?)", (name,))
+        # 回调执行时数据已提交，其他连接可以读到
+        writer.after_commit(lambda: events.append((f"hook {name}", name in names())))
+        return name
+
+    futures = submit_batch(writer, [(command, "a"), (command, "b")])
+    for future in futures:
+        future.add_done_callback(lambda f: events.append((f"done {f.result()}", True)))
+        future.result(timeout=5)
+    # 回调在写线程中、结果交给调用方之前执行（结果在 add_done_callback 之前已完成时回调立即执行，顺序不变）
+    assert events == [("hook a", True), ("done a", True), ("hook b", True), ("done b", True)]
+
+def test_failed_commit_fails_every_command(writer):
+    class FailingCommit:
+        """COMMIT 时报错的连接（模拟磁盘错误）"""
+        def __init__(self, conn):
+            self.conn = conn
+
+        def execute(self, sql, *args):
+            if sql == "COMMIT":
+                raise sqlite3.OperationalError("disk I/O error")
+            return self.conn.execute(sql, *args)
+
+        @property
+        def in_transaction(self):
+            return self.conn.in_transaction
+
+    conn = api.db.get_conn()
+    conn.isolation_level = None
+    batch = [(Future(), insert, (name,), {}) for name in ("a", "b", "c")]
+    writer._apply(FailingCommit(conn), batch)
+    conn.close()
+
+    for future, *_ in batch:
+        with pytest.raises(sqlite3.OperationalError, match="disk I/O error"):
+            future.result(timeout=0)
+    assert names() == []
+    assert writer.stats["failed_batches"] == 1 and writer.stats["commands"] == 0
+
+def test_service_errors_from_write_commands(client):
+    # 写命令抛出 ServiceError（不依赖 FastAPI），由路由层的异常处理映射为 HTTP 错误
+    r = client.post("/api/rooms/missing/ready", json={"user": HOST})
+    assert (r.status_code, r.json()) == (404, {"detail": "Room not found"})
+
+    room_id = client.post("/api/rooms", json={"user": HOST, "bet_amount": 10}).json()["room_id"]
+    assert client.post(f"/api/rooms/{room_id}/ready", json={"user": HOST}).json()["detail"] == "Room is not full"
+    assert client.post(f"/api/rooms/{room_id}/join", json={"user": GUEST}).status_code == 200
+    r = client.post(f"/api/rooms/{room_id}/ready", json={"user": {"user_id": 1, "username": "x"}})
+    assert (r.status_code, r.json()["detail"]) == (403, "Not a player in this room")
+    r = client.post(f"/api/rooms/{room_id}/start", json={"user": HOST})
+    assert (r.status_code, r.json()["detail"]) == (400, "Room is not in countdown (status: FULL)")
+
+    for user in (HOST, GUEST):
+        assert client.post(f"/api/rooms/{room_id}/ready", json={"user": user}).json()["ok"]
+    assert client.post(f"/api/rooms/{room_id}/start", json={"user": HOST}).json()["detail"].startswith("Countdown not finished")
+    # 定时器触发时房间还没到时间或已不在倒计时：ServiceError 被忽略，不重新安排
+    asyncio.run(api.main.on_countdown_due([room_id, "missing"]))
+    assert client.get(f"/api/rooms/{room_id}").json()["status"] == "COUNTDOWN"
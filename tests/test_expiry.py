@@ -0,0 +1,124 @@
+"""
+过期房间回收测试：同一时刻到期的 OPEN/FULL 房间在一个写命令里取消并退还冻结的押注；
+没到期、已开局的房间以数据库为准跳过；冻结余额不足的房间跳过且不影响同批的其他房间，
+并移出大厅、计数、按指数退避重试
+
+运行: python -m pytest -q tests/test_expiry.py
+"""
+import asyncio
+import sqlite3
+import time
+
+import api.db
+import api.main
+from api import expiry, ledger
+from api.scheduler import scheduler
+from api.wallets import wallets
+from conftest import GUEST, HOST, backdate, start_game
+
+PLAYERS = [{"user_id": 333333 + i, "username": f"player{3 + i}"} for i in range(4)]
+
+def balance(client, user: dict) -> tuple[int, int]:
+    data = client.get(f"/api/users/{user['user_id']}").json()
+    return data["available"], data["frozen"]
+
+def status(client, room_id: str) -> str:
+    return client.get(f"/api/rooms/{room_id}").json()["status"]
+
+def create(client, host: dict, guest: dict | None = None, bet: int = 10) -> str:
+    room_id = client.post("/api/rooms", json={"user": host, "bet_amount": bet}).json()["room_id"]
+    if guest:
+        assert client.post(f"/api/rooms/{room_id}/join", json={"user": guest}).status_code == 200
+    return room_id
+
+def set_frozen(user: dict, frozen: int) -> None:
+    conn = sqlite3.connect(api.db.DB_PATH)
+    conn.execute("UPDATE users SET frozen=? WHERE user_id=?", (frozen, user["user_id"]))
+    conn.commit()
+    conn.close()
+    wallets.discard(user["user_id"])
+
+def expire_failed(client) -> float:
+    r = client.get("/api/internal/metrics", headers={"x-internal-key": api.main.INTERNAL_API_KEY})
+    samples = [line.split()[1] for line in r.text.splitlines() if line.startswith("lgw33_rooms_expire_failed_total ")]
+    return float(samples[0]) if samples else 0.0
+
+def spy_batches(monkeypatch) -> list[list[str]]:
+    """记录每个写命令收到的房间ID"""
+    batches = []
+    expire = expiry.expire_rooms
+
+    def spy(conn, room_ids, now):
+        batches.append(list(room_ids))
+        return expire(conn, room_ids, now)
+
+    monkeypatch.setattr(expiry, "expire_rooms", spy)
+    return batches
+
+def test_expired_rooms_cancelled_in_one_batch(client, monkeypatch):
+    a, b, c, d = PLAYERS
+    open_room = create(client, a, bet=20)
+    full_room = create(client, b, c, bet=30)
+    fresh_room = create(client, d)
+    playing_room = start_game(client)
+    for room_id in (open_room, full_room, playing_room):
+        backdate("expires_at", room_id, 1)
+    assert [balance(client, user) for user in PLAYERS] == [(980, 20), (970, 30), (970, 30), (990, 10)]
+
+    batches = spy_batches(monkeypatch)
+    assert asyncio.run(api.main.cleanup_expired_rooms()) == 2
+    assert len(batches) == 1 and sorted(batches[0]) == sorted([open_room, full_room])
+
+    assert [status(client, room_id) for room_id in (open_room, full_room, fresh_room, playing_room)] == [
+        "CANCELLED", "CANCELLED", "OPEN", "PLAYING"
+    ]
+    assert [balance(client, user) for user in PLAYERS] == [(1000, 0), (1000, 0), (1000, 0), (990, 10)]
+    assert balance(client, HOST) == (990, 10)
+
+    conn = sqlite3.connect(api.db.DB_PATH)
+    refunds = conn.execute(
+        "SELECT room_id, user_id, amount FROM ledger WHERE type=? AND reason=? ORDER BY tx_id",
+        (ledger.UNFREEZE, ledger.EXPIRED)
+    ).fetchall()
+    conn.close()
+    assert sorted(refunds) == sorted([
+        (open_room, a["user_id"], 20), (full_room, b["user_id"], 30), (full_room, c["user_id"], 30)
+    ])
+    lobby = {room["room_id"] for room in client.get("/api/rooms/open/list").json()}
+    assert lobby == {fresh_room}
+
+    # 定时器的截止时间已过时：没到期、已开局、已取消的房间都以数据库为准跳过
+    assert asyncio.run(api.main.expire_rooms([open_room, fresh_room, playing_room])) == 0
+
+def test_insufficient_frozen_balance(client, monkeypatch, caplog):
+    a, b, _, _ = PLAYERS
+    broken_room = create(client, a)
+    other_room = create(client, b)
+    for room_id in (broken_room, other_room):
+        backdate("expires_at", room_id, 1)
+    # 冻结余额与房间不一致（例如手工改过数据库）
+    set_frozen(a, 5)
+    armed = []
+    monkeypatch.setattr(scheduler, "arm", lambda kind, key, deadline: armed.append((kind, key, round(deadline - time.time()))))
+    failed_before = expire_failed(client)
+
+    batches = spy_batches(monkeypatch)
+    assert asyncio.run(api.main.expire_rooms([broken_room, other_room])) == 1
+    assert len(batches) == 1
+    assert f"清理房间 {broken_room} 失败: Insufficient frozen balance" in caplog.text
+
+    # 出问题的房间原样保留（不退任何一方），同批的其他房间照常取消
+    assert (status(client, broken_room), status(client, other_room)) == ("OPEN", "CANCELLED")
+    assert [balance(client, user) for user in (a, b)] == [(990, 5), (1000, 0)]
+    # 已过期：移出大厅，计数，按指数退避重新登记
+    assert client.get("/api/rooms/open/list").json() == []
+    assert expire_failed(client) == failed_before + 1
+    assert armed == [("expire", broken_room, api.main.EXPIRE_RETRY_SECONDS)]
+    assert asyncio.run(api.main.expire_rooms([broken_room])) == 0
+    assert armed[-1] == ("expire", broken_room, 2 * api.main.EXPIRE_RETRY_SECONDS)
+
+    # 修复余额后下一次重试时取消并退款
+    set_frozen(a, 10)
+    assert asyncio.run(api.main.expire_rooms([broken_room])) == 1
+    assert status(client, broken_room) == "CANCELLED" and balance(client, a) == (1000, 0)
+    assert ("expire", broken_room) not in scheduler._failures and len(armed) == 2
@@ -0,0 +1,175 @@
+"""
+排行榜测试
+结算提交后榜单立即更新，从账本重建得到相同的榜单；同时发起的重建依次执行，期间的结算不丢失；
+启动时在后台加载，不等待；加载完成前的查询共用同一次加载
+
+运行: python -m pytest -q tests/test_leaderboard.py
+"""
+import asyncio
+import random
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+import api.db
+import api.main
+from api import archive
+from api.leaderboard import Leaderboard, RankedList, leaderboard
+from conftest import GUEST, HOST, backdate
+
+THIRD = {"user_id": 333333, "username": "player3"}
+CHAT_ID = -100123
+
+def play(client, host, guest, host_clicks: int, guest_clicks: int, bet: int = 10, chat_id: int | None = None) -> None:
+    body = {"user": host, "bet_amount": bet}
+    if chat_id:
+        body["chat_id"] = chat_id
+    room_id = client.post("/api/rooms", json=body).json()["room_id"]
+    assert client.post(f"/api/rooms/{room_id}/join", json={"user": guest}).status_code == 200
+    for user in (host, guest):
+        assert client.post(f"/api/rooms/{room_id}/ready", json={"user": user}).status_code == 200
+    backdate("countdown_start_time", room_id, 5)
+    assert client.post(f"/api/rooms/{room_id}/start", json={"user": host}).status_code == 200
+    for user, clicks in ((host, host_clicks), (guest, guest_clicks)):
+        for _ in range(clicks):
+            assert client.post(f"/api/rooms/{room_id}/click", json={"user": user}).status_code == 200
+    backdate("game_start_time", room_id, 40)
+    assert client.post(f"/api/rooms/{room_id}/settle", json={"user": host}).status_code == 200
+
+def board(client, **params) -> list[tuple]:
+    entries = client.get("/api/leaderboard", params=params).json()["entries"]
+    return [(e["rank"], e["user_id"], e["wins"], e["net"], e["games"]) for e in entries]
+
+def test_ranked_list_matches_sorted_list():
+    rng = random.Random(7)
+    RankedList.LOAD, load = 4, RankedList.LOAD
+    try:
+        naive = sorted(rng.sample(range(1000), 50))
+        ranked = RankedList(naive)
+        for _ in range(2000):
+            if naive and rng.random() < 0.45:
+                value = naive.pop(rng.randrange(len(naive)))
+                ranked.remove(value)
+            else:
+                value = rng.randrange(10**6)
+                if value in naive:
+                    continue
+                ranked.add(value)
+                naive.append(value)
+                naive.sort()
+            assert len(ranked) == len(naive)
+            if naive:
+                probe = rng.choice(naive)
+                assert ranked.index(probe) == naive.index(probe)
+                start = rng.randrange(len(naive))
+                assert ranked.slice(start, start + 7) == naive[start:start + 7]
+    finally:
+        RankedList.LOAD = load
+
+def test_settlement_updates_and_rebuild(client):
+    play(client, HOST, GUEST, 3, 1, chat_id=CHAT_ID)
+    play(client, GUEST, HOST, 2, 1, bet=30, chat_id=CHAT_ID)
+    play(client, HOST, THIRD, 1, 1)
+    play(client, THIRD, GUEST, 4, 0, bet=5)
+
+    expected_wins = [(1, HOST["user_id"], 1, -20, 3), (2, GUEST["user_id"], 1, 15, 3), (3, THIRD["user_id"], 1, 5, 2)]
+    assert board(client) == expected_wins
+    assert board(client, metric="net") == [
+        (1, GUEST["user_id"], 1, 15, 3), (2, THIRD["user_id"], 1, 5, 2), (3, HOST["user_id"], 1, -20, 3),
+    ]
+    assert board(client, chat_id=CHAT_ID) == [(1, HOST["user_id"], 1, -20, 2), (2, GUEST["user_id"], 1, 20, 2)]
+    assert board(client, window="day", metric="games", limit=1, offset=1) == [(2, GUEST["user_id"], 1, 15, 3)]
+    assert client.get("/api/leaderboard").json()["entries"][0]["username"] == HOST["username"]
+
+    me = client.get(f"/api/leaderboard/users/{THIRD['user_id']}", params={"metric": "net"}).json()
+    assert (me["rank"], me["total"], me["net"]) == (2, 3, 5)
+    outsider = client.get(f"/api/leaderboard/users/{THIRD['user_id']}", params={"chat_id": CHAT_ID}).json()
+    assert outsider["rank"] is None and outsider["total"] == 2
+
+    # 清空后从账本重建（包括已归档的房间）得到相同结果
+    with api.db.connection() as conn:
+        conn.execute("UPDATE rooms SET created_at = strftime('%Y-%m-%dT%H:%M:%f', 'now', '-2 days')")
+        conn.commit()
+    assert asyncio.run(archive.archive_rooms()) == 4
+    tx_id = leaderboard.tx_id
+    leaderboard.reset()
+    assert board(client) == expected_wins
+    assert board(client, chat_id=CHAT_ID) == [(1, HOST["user_id"], 1, -20, 2), (2, GUEST["user_id"], 1, 20, 2)]
+    assert leaderboard.tx_id == tx_id
+
+    assert client.get("/api/leaderboard", params={"metric": "clicks"}).status_code == 422
+
+def test_concurrent_loads():
+    boards = Leaderboard()
+    now = time.time()
+    first_fetching, release_first = threading.Event(), threading.Event()
+    ledger = [(1, [(1, 0, now, 1, 10, 1), (2, 0, now, 0, -10, 1)])]
+
+    def fetch():
+        tx_id, rows = ledger[-1]
+        if tx_id == 1:
+            first_fetching.set()
+            assert release_first.wait(5)
+        return tx_id, rows
+
+    errors = []
+    def load():
+        try:
+            boards.load(fetch)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=load) for _ in range(2)]
+    threads[0].start()
+    assert first_fetching.wait(5)
+    threads[1].start()
+    # 第一次重建读取账本期间提交的一局：排队，在第一次重建完成后补上
+    boards.record(2, now, None, [(2, True, 10), (1, False, -10)])
+    ledger.append((2, [(1, 0, now, 1, 0, 2), (2, 0, now, 1, 0, 2)]))
+    release_first.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert errors == [] and boards.ready and boards.tx_id == 2
+    assert boards.top("wins")[1] == [
+        {"rank": 1, "user_id": 1, "wins": 1, "net": 0, "games": 2},
+        {"rank": 2, "user_id": 2, "wins": 1, "net": 0, "games": 2},
+    ]
+
+def test_loaded_in_background(app, monkeypatch):
+    calls, release = [], threading.Event()
+    load = api.main.load_leaderboard
+
+    def slow_load():
+        calls.append(1)
+        assert release.wait(5)
+        return load()
+
+    monkeypatch.setattr(api.main, "load_leaderboard", slow_load)
+    with TestClient(app) as client:
+        # 启动没有等排行榜加载完成
+        assert not leaderboard.ready
+        deadline = time.monotonic() + 5
+        while not calls:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        responses = []
+        readers = [
+            threading.Thread(target=lambda path=path: responses.append(client.get(path)))
+            for path in ("/api/leaderboard", f"/api/leaderboard/users/{HOST['user_id']}")
+        ]
+        for thread in readers:
+            thread.start()
+        time.sleep(0.2)
+        assert responses == []
+        release.set()
+        for thread in readers:
+            thread.join(5)
+        assert [r.status_code for r in responses] == [200, 200]
+        # 启动时的加载和两个查询共用一次
+        assert calls == [1] and leaderboard.ready
+        assert api.main.startup["leaderboard_seconds"] > 0
+
+        assert client.post("/api/internal/leaderboard/rebuild", headers={"x-internal-key": api.main.INTERNAL_API_KEY}).json()["ok"]
+        assert calls == [1, 1]
@@ -0,0 +1,86 @@
+"""
+大厅列表测试
+ETag / If-None-Match 返回 304，游标分页，押注筛选，翻页期间房间状态变化不会重复或遗漏
+
+运行: python -m pytest -q tests/test_lobby.py
+"""
+from conftest import GUEST
+
+HOSTS = [{"user_id": 1000 + i, "username": f"host{i}"} for i in range(5)]
+BETS = [10, 20, 30, 40, 50]
+
+def create_rooms(client) -> list[str]:
+    return [
+        client.post("/api/rooms", json={"user": host, "bet_amount": bet}).json()["room_id"]
+        for host, bet in zip(HOSTS, BETS)
+    ]
+
+def pages(client, **params) -> list[list[str]]:
+    """沿着 X-Next-Cursor 取完所有页，返回每页的房间ID"""
+    result, cursor = [], None
+    while True:
+        r = client.get("/api/rooms/open/list", params={**params, **({"cursor": cursor} if cursor else {})})
+        assert r.status_code == 200
+        result.append([room["room_id"] for room in r.json()])
+        cursor = r.headers.get("x-next-cursor")
+        if not cursor:
+            return result
+
+def test_etag(client):
+    create_rooms(client)
+    r = client.get("/api/rooms/open/list")
+    etag = r.headers["etag"]
+    assert len(r.json()) == 5 and r.headers["cache-control"] == "no-cache"
+
+    r = client.get("/api/rooms/open/list", headers={"If-None-Match": etag})
+    assert r.status_code == 304 and not r.content and r.headers["etag"] == etag
+
+    # 大厅变化后旧 ETag 不再匹配
+    client.post("/api/rooms", json={"user": GUEST, "bet_amount": 10})
+    r = client.get("/api/rooms/open/list", headers={"If-None-Match": etag})
+    assert r.status_code == 200 and len(r.json()) == 6 and r.headers["etag"] != etag
+
+def test_cursor_pages_and_bet_filter(client):
+    rooms = create_rooms(client)
+    listed = client.get("/api/rooms/open/list").json()
+    newest_first = [room["room_id"] for room in listed]
+    assert sorted(newest_first) == sorted(rooms)
+    # 按创建时间倒序（同一毫秒内创建的按房间ID倒序）
+    keys = [(room["created_at"], room["room_id"]) for room in listed]
+    assert keys == sorted(keys, reverse=True)
+
+    assert pages(client, limit=2) == [newest_first[:2], newest_first[2:4], newest_first[4:]]
+    assert pages(client, limit=5) == [newest_first]
+
+    by_bet = {room_id: bet for room_id, bet in zip(rooms, BETS)}
+    filtered = [room_id for room_id in newest_first if 20 <= by_bet[room_id] <= 40]
+    assert pages(client, min_bet=20, max_bet=40) == [filtered]
+    # 筛选和分页一起使用：游标指向筛选后的最后一个房间
+    assert pages(client, min_bet=20, max_bet=40, limit=1) == [[room_id] for room_id in filtered]
+    assert pages(client, min_bet=60) == [[]]
+
+def test_rooms_change_between_pages(client):
+    hosts = dict(zip(create_rooms(client), HOSTS))
+    newest_first = [room["room_id"] for room in client.get("/api/rooms/open/list").json()]
+
+    r = client.get("/api/rooms/open/list", params={"limit": 2})
+    assert [room["room_id"] for room in r.json()] == newest_first[:2]
+    cursor = r.headers["x-next-cursor"]
+
+    # 翻页之间：第一页的房间被加入（仍在大厅），第二页的一个房间开始倒计时（移出大厅），又创建了新房间
+    joined, started = newest_first[1], newest_first[2]
+    challenger = {"user_id": 2001, "username": "challenger"}
+    assert client.post(f"/api/rooms/{joined}/join", json={"user": GUEST}).status_code == 200
+    assert client.post(f"/api/rooms/{started}/join", json={"user": challenger}).status_code == 200
+    for user in (hosts[started], challenger):
+        assert client.post(f"/api/rooms/{started}/ready", json={"user": user}).status_code == 200
+    client.post("/api/rooms", json={"user": {"user_id": 2002, "username": "late"}, "bet_amount": 10})
+
+    # 第二页从游标之后继续：不重复第一页，不包含已移出的房间，也不包含游标之后新建的房间
+    r = client.get("/api/rooms/open/list", params={"limit": 2, "cursor": cursor})
+    assert [room["room_id"] for room in r.json()] == newest_first[3:5]
+    assert "x-next-cursor" not in r.headers
+
+    # 被加入的房间在第一页中更新为 FULL
+    first = client.get("/api/rooms/open/list", params={"limit": 3}).json()
+    assert {room["room_id"]: room["status"] for room in first}[joined] == "FULL"
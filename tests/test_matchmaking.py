@@ -0,0 +1,79 @@
+"""
+快速匹配测试
+同押注（同群）的玩家配对后直接得到 FULL 房间，双方押注已冻结；长轮询中的玩家立即收到结果
+
+运行: python -m pytest -q tests/test_matchmaking.py
+"""
+import asyncio
+import time
+
+from api import matchmaking
+from conftest import GUEST, HOST
+
+THIRD = {"user_id": 333333, "username": "player3"}
+FOURTH = {"user_id": 444444, "username": "player4"}
+
+async def match(client, user, bet: int, wait: float = 0, chat_id: int | None = None):
+    return await client.post("/api/match", json={"user": user, "bet_amount": bet, "wait": wait, "chat_id": chat_id})
+
+def test_long_poll_pairs_players(run):
+    async def scenario(client):
+        waiting = asyncio.create_task(match(client, HOST, 10, wait=5))
+        await asyncio.sleep(0.1)
+        started = time.perf_counter()
+        guest = await match(client, GUEST, 10)
+        host = await waiting
+        elapsed = time.perf_counter() - started
+
+        assert guest.status_code == host.status_code == 200
+        guest, host = guest.json(), host.json()
+        assert (host["status"], host["role"], guest["role"]) == ("matched", "host", "guest")
+        assert host["room_id"] == guest["room_id"]
+        assert elapsed < 1
+
+        room = (await client.get(f"/api/rooms/{host['room_id']}")).json()
+        assert (room["status"], room["host_id"], room["guest_id"]) == ("FULL", HOST["user_id"], GUEST["user_id"])
+        for user in (HOST, GUEST):
+            wallet = (await client.get(f"/api/users/{user['user_id']}")).json()
+            assert (wallet["available"], wallet["frozen"]) == (990, 10)
+
+        # 配对后的房间照常准备开局
+        for user in (HOST, GUEST):
+            r = await client.post(f"/api/rooms/{host['room_id']}/ready", json={"user": user})
+            assert r.status_code == 200
+        assert matchmaking.queue.snapshot()["waiting"] == 0
+
+    run(scenario)
+
+def test_buckets_cancel_and_insufficient_balance(run):
+    async def scenario(client):
+        assert (await match(client, HOST, 10)).json()["status"] == "waiting"
+        # 不同押注、不同群不会配对
+        assert (await match(client, GUEST, 20)).json()["status"] == "waiting"
+        assert (await match(client, THIRD, 10, chat_id=-100)).json()["status"] == "waiting"
+        assert matchmaking.queue.snapshot()["buckets"] == 3
+
+        r = await client.post("/api/match/cancel", json={"user": HOST})
+        assert r.json()["cancelled"] is True
+        assert (await match(client, FOURTH, 10)).json()["status"] == "waiting"
+
+        # 排队者之后把余额押在别处：轮到它时配对失败，挑战者继续排队
+        assert (await match(client, HOST, 900)).json()["status"] == "waiting"
+        r = await client.post("/api/rooms", json={"user": HOST, "bet_amount": 500})
+        assert r.status_code == 200
+        polling = asyncio.create_task(match(client, HOST, 900, wait=5))
+        await asyncio.sleep(0.1)
+        r = await match(client, GUEST, 900)
+        assert r.json()["status"] == "waiting"
+        r = await polling
+        assert r.status_code == 400 and r.json()["detail"] == "Insufficient balance"
+
+        # 挑战者余额不足：直接拒绝，不进入队列
+        r = await match(client, THIRD, 5000)
+        assert r.status_code == 400
+
+        r = await match(client, HOST, 10)
+        assert r.json()["status"] == "matched" and r.json()["role"] == "guest"
+        assert r.json()["host_id"] == FOURTH["user_id"]
+
+    run(scenario)
@@ -0,0 +1,46 @@
+"""
+Prometheus 指标测试
+指标按路由模板聚合，房间数按状态统计，Webhook 路径中的 Bot token 不会出现在输出中
+
+运行: python -m pytest -q tests/test_metrics.py
+"""
+import api.main
+from conftest import GUEST, HOST
+
+def scrape(client) -> dict[str, float]:
+    r = client.get("/api/internal/metrics", headers={"x-internal-key": api.main.INTERNAL_API_KEY})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = {}
+    for line in r.text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+def test_requires_internal_key(client):
+    assert client.get("/api/internal/metrics").status_code == 401
+
+def test_metrics_by_route_template(client):
+    # 指标在进程内累计，只比较本测试期间的增量
+    before = scrape(client)
+    for i in range(3):
+        room_id = client.post("/api/rooms", json={"user": HOST, "bet_amount": 10}).json()["room_id"]
+        assert client.get(f"/api/rooms/{room_id}").status_code == 200
+    assert client.post(f"/api/rooms/{room_id}/join", json={"user": GUEST}).status_code == 200
+    assert client.get("/api/rooms/missing").status_code == 404
+    client.post(api.main.WEBHOOK_PATH, content=b"{}")
+
+    samples = scrape(client)
+    delta = {name: value - before.get(name, 0) for name, value in samples.items()}
+    route = 'method="GET",route="/api/rooms/{room_id}"'
+    assert delta[f"lgw33_http_request_duration_seconds_count{{{route}}}"] == 4
+    assert delta[f'lgw33_http_responses_total{{{route},status="200"}}'] == 3
+    assert delta[f'lgw33_http_responses_total{{{route},status="404"}}'] == 1
+    assert delta['lgw33_db_command_duration_seconds_count{command="_create_room"}'] == 3
+    assert delta["lgw33_db_batch_commands_count"] >= 1
+    # 房间数是抓取时的统计值
+    assert samples['lgw33_rooms{status="OPEN"}'] == 2
+    assert samples['lgw33_rooms{status="FULL"}'] == 1
+    assert not any(api.main.BOT_TOKEN in name for name in samples if api.main.BOT_TOKEN)
+    assert any('route="/webhook/{token}"' in name for name in samples)
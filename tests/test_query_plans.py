@@ -0,0 +1,171 @@
+"""
+查询计划回归测试
+在临时数据库上跑一遍完整的房间流程，记录实际执行的 SQL，
+逐条 EXPLAIN QUERY PLAN，确认没有对 rooms / users / ledger 的全表扫描。
+同时检查旧版本数据库能被迁移到最新版本。
+
+运行: python -m pytest -q tests/test_query_plans.py
+"""
+import asyncio
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api.db
+import api.main
+from api import archive, ledger
+from api.db import SCHEMA_VERSION, get_conn, migrate, schema_version
+from conftest import GUEST, HOST, backdate
+
+@pytest.fixture
+def captured(db_path, monkeypatch):
+    """切换到临时数据库，返回执行过的 SQL 列表"""
+    statements: list[str] = []
+    open_conn = api.db.get_conn
+
+    def traced_conn():
+        conn = open_conn()
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(api.db, "get_conn", traced_conn)
+    return statements
+
+def full_scans(statements: list[str]) -> dict[str, list[str]]:
+    """返回 {SQL: [全表扫描的计划行]}"""
+    conn = sqlite3.connect(api.db.DB_PATH)
+    scans = {}
+    for sql in dict.fromkeys(statements):
+        head = sql.lstrip().split(None, 1)[0].upper()
+        if head not in ("SELECT", "UPDATE", "DELETE"):
+            continue
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+        # 按索引顺序扫描（部分索引 + ORDER BY ... LIMIT）是预期的计划；其他 SCAN 都算全表扫描
+        # （SCAN CONSTANT ROW 是不读表的 SELECT，如 last_insert_rowid()）
+        ordered = "ORDER BY" in sql.upper()
+        bad = [
+            line for line in plan
+            if line.startswith("SCAN") and line != "SCAN CONSTANT ROW" and not (ordered and "INDEX" in line)
+        ]
+        if bad:
+            scans[sql] = bad
+    conn.close()
+    return scans
+
+def test_hot_queries_use_indexes(captured, monkeypatch):
+    monkeypatch.setattr(api.main.scheduler, "arm", lambda *args: None)
+    client = TestClient(api.main.app)
+    internal = {"x-internal-key": api.main.INTERNAL_API_KEY}
+
+    r = client.post("/api/rooms", json={"user": HOST, "bet_amount": 10})
+    assert r.status_code == 200
+    room_id = r.json()["room_id"]
+
+    assert client.get("/api/rooms/open/list").status_code == 200
+    assert client.post(f"/api/rooms/{room_id}/join", json={"user": GUEST}).status_code == 200
+    assert client.get(f"/api/users/{HOST['user_id']}/rooms").status_code == 200
+    assert client.post(f"/api/rooms/{room_id}/ready", json={"user": HOST}).status_code == 200
+    assert client.post(f"/api/rooms/{room_id}/ready", json={"user": GUEST}).status_code == 200
+
+    backdate("countdown_start_time", room_id, 5)
+    assert client.post(f"/api/rooms/{room_id}/start", json={"user": HOST}).status_code == 200
+    assert client.post(f"/api/rooms/{room_id}/click", json={"user": HOST}).status_code == 200
+    assert client.get(f"/api/rooms/{room_id}").status_code == 200
+    assert asyncio.run(api.main.snapshot_clicks()) >= 0
+    assert api.main.arm_pending_rooms() == 1
+
+    backdate("game_start_time", room_id, 40)
+    assert client.post(f"/api/rooms/{room_id}/settle", json={"user": HOST}).status_code == 200
+    assert client.get(f"/api/users/{HOST['user_id']}").status_code == 200
+
+    # 通过邀请码加入，然后让房间过期被清理
+    r = client.post("/api/rooms", json={"user": HOST, "bet_amount": 10})
+    token = r.json()["invite_token"]
+    r = client.post("/api/internal/join", headers=internal, json={"invite_token": token, **GUEST})
+    assert r.status_code == 200
+    backdate("expires_at", r.json()["room_id"], 60)
+    assert asyncio.run(api.main.cleanup_expired_rooms()) == 1
+    assert client.get("/api/internal/metrics", headers=internal).status_code == 200
+
+    # 归档已结束的房间后查询历史
+    backdate("created_at", room_id, 3 * 86400)
+    assert asyncio.run(archive.archive_rooms(hours=24)) == 1
+    assert client.get(f"/api/rooms/{room_id}").status_code == 200
+    r = client.get(f"/api/users/{GUEST['user_id']}/history", params={"limit": 1})
+    assert r.status_code == 200 and r.json()["next_cursor"]
+    assert client.get(f"/api/users/{GUEST['user_id']}/history", params={"cursor": r.json()["next_cursor"]}).status_code == 200
+
+    assert captured
+    assert full_scans(captured) == {}
+
+def test_migrates_legacy_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(api.db, "DB_PATH", tmp_path / "legacy.db")
+    conn = sqlite3.connect(api.db.DB_PATH)
+    # 最早版本的 rooms 表：没有 Ready / 点击数列，时间用 datetime('now') 格式
+    conn.execute("""
+    CREATE TABLE rooms (
+      room_id TEXT PRIMARY KEY,
+      chat_id INTEGER,
+      host_id INTEGER NOT NULL,
+      host_username TEXT,
+      guest_id INTEGER,
+      guest_username TEXT,
+      bet_amount INTEGER NOT NULL,
+      status TEXT NOT NULL,
+      invite_token TEXT NOT NULL,
+      created_at TEXT NOT NULL DEFAULT (datetime('now')),
+      expires_at TEXT NOT NULL
+    )
+    """)
+    conn.execute(
+        "INSERT INTO rooms(room_id, host_id, bet_amount, status, invite_token, created_at, expires_at) "
+        "VALUES('r1', 1, 10, 'OPEN', 't1', '2024-01-02 03:00:00', '2024-01-02 03:04:05')"
+    )
+    # 旧版账本：UUID 主键，ref 为拼接的字符串
+    conn.execute("""
+    CREATE TABLE ledger (
+      tx_id TEXT PRIMARY KEY,
+      user_id INTEGER NOT NULL,
+      type TEXT NOT NULL,
+      amount INTEGER NOT NULL,
+      ref TEXT,
+      created_at TEXT NOT NULL DEFAULT (datetime('now'))
+    )
+    """)
+    conn.executemany("INSERT INTO ledger VALUES(?,?,?,?,?,?)", [
+        ("c9e0", 2, "DEBIT", 10, "room:r0:win", "2024-01-01 00:00:02"),
+        ("5a1f", 1, "CREDIT", 1000, "signup", "2024-01-01 00:00:00"),
+        ("0b7d", 1, "FREEZE", 10, "room:r1", "2024-01-01 00:00:01"),
+        ("e3c2", 1, "CREDIT", 5, "manual adjust", "2024-01-01 00:00:03"),
+    ])
+    conn.commit()
+    conn.close()
+
+    conn = get_conn()
+    assert [version for version, _ in migrate(conn)] == list(range(1, SCHEMA_VERSION + 1))
+    assert schema_version(conn) == SCHEMA_VERSION
+    assert migrate(conn) == []
+
+    room = conn.execute("SELECT * FROM rooms WHERE room_id='r1'").fetchone()
+    assert room["expires_at"] == "2024-01-02T03:04:05.000"
+    assert room["created_at"] == "2024-01-02T03:00:00.000"
+    assert room["host_clicks"] == 0 and room["countdown_start_time"] is None
+    # 重建 rooms 表后新房间的默认创建时间也是 ISO 格式，索引都还在
+    conn.execute("INSERT INTO rooms(room_id, host_id, bet_amount, status, invite_token, expires_at) VALUES('r2', 1, 10, 'OPEN', 't2', '')")
+    assert conn.execute("SELECT created_at FROM rooms WHERE room_id='r2'").fetchone()[0][10] == "T"
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='rooms'")}
+    assert {"idx_rooms_lobby", "idx_rooms_terminal", "idx_rooms_status", "idx_rooms_invite_token"} <= indexes
+    conn.rollback()
+
+    # 账本按时间顺序分配整数 tx_id，ref 拆分为原因和房间
+    rows = [tuple(row) for row in conn.execute(
+        "SELECT tx_id, user_id, type, amount, reason, room_id, note, created_at FROM ledger ORDER BY tx_id"
+    )]
+    assert rows == [
+        (1, 1, ledger.CREDIT, 1000, ledger.SIGNUP, None, None, 1704067200),
+        (2, 1, ledger.FREEZE, 10, ledger.BET, "r1", None, 1704067201),
+        (3, 2, ledger.DEBIT, 10, ledger.WIN, "r0", None, 1704067202),
+        (4, 1, ledger.CREDIT, 5, ledger.OTHER, None, "manual adjust", 1704067203),
+    ]
+    conn.close()
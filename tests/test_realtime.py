@@ -0,0 +1,95 @@
+"""
+房间实时推送测试：加入、Ready、开局、点击、结算都推送给订阅者；
+断线后取消订阅，前端回退到轮询或重连后先收到完整状态；消费太慢的订阅者收到 resync
+
+运行: python -m pytest -q tests/test_realtime.py
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from api.clicks import counter
+from api.realtime import QUEUE_SIZE, RESYNC, RoomHub, hub
+from api.settlement import GAME_SECONDS
+from conftest import GUEST, HOST, backdate
+
+def receive_room(ws) -> dict:
+    message = ws.receive_json()
+    assert message["type"] == "room", message
+    return message
+
+def wait_unsubscribed(room_id: str) -> None:
+    # 服务端在另一个线程的事件循环中感知断开
+    deadline = time.monotonic() + 5
+    while hub.subscribers(room_id):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_push_on_join_start_settle(client):
+    with client:
+        room_id = client.post("/api/rooms", json={"user": HOST, "bet_amount": 10}).json()["room_id"]
+        with client.websocket_connect(f"/ws/rooms/{room_id}") as ws:
+            # 连接后先收到完整状态
+            assert receive_room(ws)["room"]["status"] == "OPEN"
+
+            assert client.post(f"/api/rooms/{room_id}/join", json={"user": GUEST}).status_code == 200
+            room = receive_room(ws)["room"]
+            assert room["status"] == "FULL" and room["guest_id"] == GUEST["user_id"]
+
+            for user in (HOST, GUEST):
+                assert client.post(f"/api/rooms/{room_id}/ready", json={"user": user}).status_code == 200
+            assert receive_room(ws)["room"]["host_ready"]
+            assert receive_room(ws)["room"]["status"] == "COUNTDOWN"
+
+            backdate("countdown_start_time", room_id, 5)
+            assert client.post(f"/api/rooms/{room_id}/start", json={"user": HOST}).status_code == 200
+            assert receive_room(ws)["room"]["status"] == "PLAYING"
+
+            client.post(f"/api/rooms/{room_id}/click", json={"user": HOST})
+            assert ws.receive_json() == {"type": "clicks", "host_clicks": 1, "guest_clicks": 0}
+
+            backdate("game_start_time", room_id, GAME_SECONDS + 1)
+            counter.get(room_id).game_start = datetime.utcnow() - timedelta(seconds=GAME_SECONDS + 1)
+            assert client.post(f"/api/rooms/{room_id}/settle", json={"user": HOST}).status_code == 200
+            message = receive_room(ws)
+            assert message["room"]["status"] == "FINISHED"
+            assert message["result"]["winner_id"] == HOST["user_id"] and message["room"]["host_clicks"] == 1
+        wait_unsubscribed(room_id)
+
+def test_socket_drop(client):
+    with client:
+        room_id = client.post("/api/rooms", json={"user": HOST, "bet_amount": 10}).json()["room_id"]
+        with client.websocket_connect(f"/ws/rooms/{room_id}") as ws:
+            receive_room(ws)
+            assert hub.subscribers(room_id) == 1
+        # 断开后取消订阅，之后的变化不再推送
+        wait_unsubscribed(room_id)
+        assert client.post(f"/api/rooms/{room_id}/join", json={"user": GUEST}).status_code == 200
+
+        # 回退到轮询：完整状态照样可以拉取
+        assert client.get(f"/api/rooms/{room_id}").json()["status"] == "FULL"
+        # 重连：先收到断线期间变化后的完整状态
+        with client.websocket_connect(f"/ws/rooms/{room_id}") as ws:
+            assert receive_room(ws)["room"]["status"] == "FULL"
+
+        with pytest.raises(WebSocketDisconnect) as e:
+            with client.websocket_connect("/ws/rooms/missing") as ws:
+                ws.receive_json()
+        assert e.value.code == 4404
+        wait_unsubscribed("missing")
+
+def test_slow_subscriber_resyncs():
+    async def main():
+        rooms = RoomHub()
+        queue = rooms.subscribe("r1")
+        for i in range(QUEUE_SIZE + 1):
+            rooms.publish("r1", {"type": "clicks", "host_clicks": i, "guest_clicks": 0})
+        # 积压超过上限：丢弃积压，只留下一条 resync
+        assert queue.qsize() == 1 and queue.get_nowait() is RESYNC
+        rooms.unsubscribe("r1", queue)
+        assert rooms.subscribers("r1") == 0
+        rooms.publish("r1", {"type": "clicks"})
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+"""
+余额对账测试
+在临时数据库上跑创建/加入房间，检查增量对账只汇总新增的账本记录，并能发现余额被篡改的用户
+
+运行: python -m pytest -q tests/test_reconcile.py
+"""
+import asyncio
+import sqlite3
+
+import api.db
+import api.main
+from api import reconcile
+from conftest import GUEST, HOST
+
+def run_reconcile() -> reconcile.Report:
+    return asyncio.run(reconcile.reconcile())
+
+def test_incremental_reconcile(client):
+    room_id = client.post("/api/rooms", json={"user": HOST, "bet_amount": 10}).json()["room_id"]
+    assert client.post(f"/api/rooms/{room_id}/join", json={"user": GUEST}).status_code == 200
+
+    # 两条注册赠送 + 两条冻结押注
+    report = run_reconcile()
+    assert (report.base_tx, report.tx_id, report.rows, report.users) == (0, 4, 4, 2)
+    assert report.drift == []
+    assert report.balances == {HOST["user_id"]: (990, 10), GUEST["user_id"]: (990, 10)}
+
+    # 没有新记录：不需要再汇总
+    report = run_reconcile()
+    assert (report.base_tx, report.rows, report.drift) == (4, 0, [])
+
+    # 只汇总检查点之后的记录
+    assert client.post("/api/rooms", json={"user": HOST, "bet_amount": 5}).status_code == 200
+    report = run_reconcile()
+    assert (report.base_tx, report.tx_id, report.rows) == (4, 5, 1)
+    assert report.balances == {HOST["user_id"]: (985, 15)}
+    assert report.drift == []
+
+def test_reports_drift_until_fixed(client):
+    assert client.post("/api/rooms", json={"user": HOST, "bet_amount": 10}).status_code == 200
+    assert run_reconcile().drift == []
+
+    conn = sqlite3.connect(api.db.DB_PATH)
+    conn.execute("UPDATE users SET available=available+5 WHERE user_id=?", (HOST["user_id"],))
+    conn.commit()
+
+    expected = [(HOST["user_id"], 995, 10, 990, 10)]
+    assert run_reconcile().drift == expected
+    # 检查点来自账本，被篡改的余额不会写进检查点
+    assert run_reconcile().drift == expected
+
+    conn.execute("UPDATE users SET available=available-5 WHERE user_id=?", (HOST["user_id"],))
+    conn.commit()
+    conn.close()
+    assert run_reconcile().drift == []
+
+    # 从头汇总与增量结果一致
+    with api.db.connection() as conn:
+        report = reconcile.scan(conn, rebuild=True)
+    assert (report.base_tx, report.rows, report.drift) == (0, 2, [])
@@ -0,0 +1,128 @@
+"""
+服务端定时器测试：把倒计时和游戏时长缩短到 1 秒，不调用 /start 和 /settle，
+由定时器自动开局、自动结算；重启时 arm_pending_rooms 从数据库恢复未结束房间的定时器；
+自动结算失败时记录、计数并按指数退避重试，房间不会一直停在 PLAYING
+
+运行: python -m pytest -q tests/test_scheduler.py
+"""
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api.db
+import api.main
+from api import metrics, settlement
+from api.scheduler import scheduler
+from conftest import GUEST, HOST, backdate
+
+@pytest.fixture
+def short_clock(db_path, monkeypatch):
+    monkeypatch.setattr(api.main, "COUNTDOWN_SECONDS", 1)
+    monkeypatch.setattr(settlement, "GAME_SECONDS", 1)
+    monkeypatch.setattr(api.main, "CLICK_BATCH_GRACE", 0.2)
+    yield
+    # 不把本测试的定时器留给后面的测试
+    scheduler._heap.clear()
+    scheduler._failures.clear()
+
+@contextmanager
+def timers_off():
+    """准备数据时不登记定时器（模拟停机期间的房间）"""
+    with pytest.MonkeyPatch.context() as m:
+        m.setattr(scheduler, "arm", lambda *args: None)
+        yield
+
+def wait_status(client, room_id: str, status: str, timeout: float = 5) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        room = client.get(f"/api/rooms/{room_id}").json()
+        if room["status"] == status:
+            return room
+        assert time.monotonic() < deadline, room
+        time.sleep(0.05)
+
+def balances(client) -> list[tuple[int, int]]:
+    users = [client.get(f"/api/users/{user['user_id']}").json() for user in (HOST, GUEST)]
+    return [(user["available"], user["frozen"]) for user in users]
+
+def test_auto_start_and_settle(short_clock):
+    with TestClient(api.main.app) as client:
+        room_id = client.post("/api/rooms", json={"user": HOST, "bet_amount": 10}).json()["room_id"]
+        assert client.post(f"/api/rooms/{room_id}/join", json={"user": GUEST}).status_code == 200
+        for user in (HOST, GUEST):
+            assert client.post(f"/api/rooms/{room_id}/ready", json={"user": user}).status_code == 200
+
+        started = time.monotonic()
+        wait_status(client, room_id, "PLAYING")
+        assert client.post(f"/api/rooms/{room_id}/click", json={"user": GUEST}).status_code == 200
+        room = wait_status(client, room_id, "FINISHED")
+        # 倒计时 1 秒 + 游戏 1 秒 + 0.2 秒容差
+        assert 2 <= time.monotonic() - started < 4
+        assert (room["winner_id"], room["guest_clicks"]) == (GUEST["user_id"], 1)
+        assert balances(client) == [(990, 0), (1010, 0)]
+        # 只剩创建/加入时登记的过期检查（到期时以数据库为准跳过已开局的房间）
+        assert {kind for _, _, kind, _ in scheduler._heap} == {"expire"}
+
+def test_arm_pending_rooms(short_clock):
+    # 上一个进程留下的房间：倒计时已结束、游戏已结束、已过期、还没到期
+    client = TestClient(api.main.app)
+    with timers_off():
+        rooms = {}
+        for name in ("countdown", "playing", "expired", "open"):
+            rooms[name] = client.post("/api/rooms", json={"user": HOST, "bet_amount": 10}).json()["room_id"]
+        for name in ("countdown", "playing"):
+            room_id = rooms[name]
+            assert client.post(f"/api/rooms/{room_id}/join", json={"user": GUEST}).status_code == 200
+            for user in (HOST, GUEST):
+                assert client.post(f"/api/rooms/{room_id}/ready", json={"user": user}).status_code == 200
+            backdate("countdown_start_time", room_id, 5)
+        assert client.post(f"/api/rooms/{rooms['playing']}/start", json={"user": HOST}).status_code == 200
+        backdate("game_start_time", rooms["playing"], 5)
+        backdate("expires_at", rooms["expired"], 1)
+    assert scheduler.pending() == 0
+
+    with TestClient(api.main.app) as client:
+        assert api.main.startup["armed"] == 4
+        # 停机期间已到期的立即处理
+        wait_status(client, rooms["playing"], "FINISHED")
+        wait_status(client, rooms["expired"], "CANCELLED")
+        wait_status(client, rooms["countdown"], "PLAYING")
+        wait_status(client, rooms["countdown"], "FINISHED")
+        assert client.get(f"/api/rooms/{rooms['open']}").json()["status"] == "OPEN"
+        # 只剩没到期的房间
+        assert scheduler.pending() == 1
+
+def test_failed_settle_is_retried(short_clock, monkeypatch, capsys):
+    monkeypatch.setattr(api.main, "SETTLE_RETRY_SECONDS", 0.2)
+    failures = metrics.timer_failures._values.get(("settle",), 0)
+    with TestClient(api.main.app) as client:
+        room_id = client.post("/api/rooms", json={"user": HOST, "bet_amount": 10}).json()["room_id"]
+        assert client.post(f"/api/rooms/{room_id}/join", json={"user": GUEST}).status_code == 200
+        # 冻结余额与房间不一致：结算时无法扣款
+        conn = sqlite3.connect(api.db.DB_PATH)
+        conn.execute("UPDATE users SET frozen=0 WHERE user_id=?", (GUEST["user_id"],))
+        conn.commit()
+        for user in (HOST, GUEST):
+            assert client.post(f"/api/rooms/{room_id}/ready", json={"user": user}).status_code == 200
+        wait_status(client, room_id, "PLAYING")
+        assert client.post(f"/api/rooms/{room_id}/click", json={"user": HOST}).status_code == 200
+
+        # 失败两次（等待 0.2 秒、0.4 秒）后修复余额，下一次重试结算成功
+        deadline = time.monotonic() + 5
+        while metrics.timer_failures._values.get(("settle",), 0) < failures + 2:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        assert client.get(f"/api/rooms/{room_id}").json()["status"] == "PLAYING"
+        conn.execute("UPDATE users SET frozen=10 WHERE user_id=?", (GUEST["user_id"],))
+        conn.commit()
+        conn.close()
+        room = wait_status(client, room_id, "FINISHED")
+        assert room["winner_id"] == HOST["user_id"]
+        assert ("settle", room_id) not in scheduler._failures
+
+    out = capsys.readouterr().out
+    assert f"房间 {room_id} 自动结算失败: Insufficient frozen balance，0.2秒后重试" in out
+    assert f"房间 {room_id} 自动结算失败: Insufficient frozen balance，0.4秒后重试" in out
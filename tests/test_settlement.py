@@ -0,0 +1,71 @@
+"""
+结算测试
+双方前端和定时器同时结算：只派彩一次，余额和账本正确；已结束的房间重复结算返回同一结果
+
+运行: python -m pytest -q tests/test_settlement.py
+"""
+import asyncio
+import sqlite3
+
+import api.db
+from api import ledger
+from conftest import GUEST, HOST, backdate, start_game
+
+def balances(client) -> list[tuple[int, int]]:
+    users = [client.get(f"/api/users/{user['user_id']}").json() for user in (HOST, GUEST)]
+    return [(user["available"], user["frozen"]) for user in users]
+
+def ledger_rows(room_id: str) -> list[tuple]:
+    conn = sqlite3.connect(api.db.DB_PATH)
+    rows = conn.execute(
+        "SELECT user_id, type, amount, reason FROM ledger WHERE room_id=? ORDER BY tx_id", (room_id,)
+    ).fetchall()
+    conn.close()
+    return rows
+
+def test_concurrent_settle_pays_once(client, run):
+    room_id = start_game(client)
+    for user, clicks in ((HOST, 3), (GUEST, 1)):
+        for _ in range(clicks):
+            assert client.post(f"/api/rooms/{room_id}/click", json={"user": user}).status_code == 200
+    backdate("game_start_time", room_id, 31)
+
+    async def scenario(client):
+        return await asyncio.gather(*(
+            client.post(f"/api/rooms/{room_id}/settle", json={"user": user})
+            for user in (HOST, GUEST) * 5
+        ))
+
+    responses = run(scenario)
+    assert {r.status_code for r in responses} == {200}
+    assert {(r.json()["winner_id"], r.json()["host_clicks"], r.json()["guest_clicks"]) for r in responses} == {
+        (HOST["user_id"], 3, 1)
+    }
+
+    assert balances(client) == [(1010, 0), (990, 0)]
+    assert ledger_rows(room_id) == [
+        (HOST["user_id"], ledger.FREEZE, 10, ledger.BET),
+        (GUEST["user_id"], ledger.FREEZE, 10, ledger.BET),
+        (HOST["user_id"], ledger.UNFREEZE, 10, ledger.WIN),
+        (GUEST["user_id"], ledger.DEBIT, 10, ledger.WIN),
+        (HOST["user_id"], ledger.CREDIT, 10, ledger.WIN),
+    ]
+
+def test_settle_finished_room(client):
+    room_id = start_game(client)
+    assert client.post(f"/api/rooms/{room_id}/click", json={"user": GUEST}).status_code == 200
+    r = client.post(f"/api/rooms/{room_id}/settle", json={"user": HOST})
+    assert r.status_code == 400 and r.json()["detail"].startswith("Game not finished yet")
+
+    backdate("game_start_time", room_id, 31)
+    first = client.post(f"/api/rooms/{room_id}/settle", json={"user": HOST}).json()
+    assert (first["winner_id"], first["host_clicks"], first["guest_clicks"]) == (GUEST["user_id"], 0, 1)
+    rows = ledger_rows(room_id)
+
+    # 房间已是 FINISHED：返回同一结果，不再变动余额和账本，结束后的点击不计入
+    assert client.post(f"/api/rooms/{room_id}/click", json={"user": HOST}).json()["detail"] == "Game is not playing"
+    again = client.post(f"/api/rooms/{room_id}/settle", json={"user": GUEST}).json()
+    assert again == first
+    assert client.get(f"/api/rooms/{room_id}").json()["status"] == "FINISHED"
+    assert balances(client) == [(990, 0), (1010, 0)]
+    assert ledger_rows(room_id) == rows and len(rows) == 5
@@ -0,0 +1,96 @@
+"""
+启动测试
+导入 api.main 不加载 aiogram；Webhook 已是当前地址时跳过注册；同一个数据库已有 API 进程时拒绝启动
+
+运行: python -m pytest -q tests/test_startup.py
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import api.db
+import api.instance
+import api.main
+from api.instance import InstanceLock
+from conftest import reset_db
+
+TOKEN = "123456:STARTUP"
+
+@pytest.fixture
+def stub(stub_url, tmp_path, monkeypatch):
+    httpx.post(f"{stub_url}/_stub/reset")
+    monkeypatch.setattr(api.db, "DB_PATH", tmp_path / "startup.db")
+    monkeypatch.setattr(api.main, "BOT_TOKEN", TOKEN)
+    monkeypatch.setattr(api.main, "TELEGRAM_API_URL", stub_url)
+    monkeypatch.setattr(api.main, "bot_loader", None)
+    monkeypatch.setattr(api.main, "RECONCILE_INTERVAL", 0)
+    monkeypatch.setattr(api.main, "ARCHIVE_INTERVAL", 0)
+    monkeypatch.setattr(api.instance, "INSTANCE_LOCK_RETRY", 0.05)
+    reset_db()
+    yield stub_url
+    reset_db()
+
+def calls(stub_url: str) -> dict:
+    return httpx.get(f"{stub_url}/_stub/calls").json()
+
+def wait_until(condition, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+def test_import_does_not_load_bot():
+    code = "import sys, time; t = time.perf_counter(); import api.main; print('aiogram' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert out.stdout.strip().splitlines()[-1] == "False"
+
+def test_instance_lock(tmp_path):
+    path = str(tmp_path / "test.db.lock")
+    first, second = InstanceLock(), InstanceLock()
+    assert first.try_acquire(path) and first.held
+    assert not second.try_acquire(path)
+    with pytest.raises(RuntimeError, match=f"pid {os.getpid()}"):
+        asyncio.run(second.acquire(path, wait=0))
+    first.release()
+    assert not first.held
+    assert second.try_acquire(path)
+    second.release()
+
+def test_webhook_registered_once(stub):
+    with TestClient(api.main.app):
+        wait_until(lambda: api.main.webhook_task.done())
+    assert calls(stub) == {"getWebhookInfo": 1, "setWebhook": 1}
+
+    # 已是当前地址：重启时不重新注册（不丢弃积压的更新），关闭时也不删除
+    httpx.post(f"{stub}/_stub/reset")
+    httpx.post(f"{stub}/_stub/config", json={"webhook_url": api.main.WEBHOOK_URL})
+    with TestClient(api.main.app):
+        wait_until(lambda: api.main.webhook_task.done())
+    assert calls(stub) == {"getWebhookInfo": 1}
+
+def test_second_process_refuses_to_start(stub, monkeypatch):
+    monkeypatch.setattr(api.instance, "INSTANCE_LOCK_WAIT", 0.2)
+    holder = InstanceLock()
+    assert holder.try_acquire(f"{api.db.DB_PATH}.lock")
+    # 同一个数据库已有进程（例如 uvicorn --workers 2 的另一个 worker）：等待后拒绝启动，不注册 Webhook
+    with pytest.raises(RuntimeError, match="只支持单进程"):
+        with TestClient(api.main.app):
+            pass
+    assert calls(stub) == {}
+
+    # 旧进程在等待期间退出（重启）：拿到锁后正常启动
+    monkeypatch.setattr(api.instance, "INSTANCE_LOCK_WAIT", 5)
+    threading.Timer(0.2, holder.release).start()
+    with TestClient(api.main.app) as client:
+        stats = client.get("/api/internal/stats", headers={"x-internal-key": api.main.INTERNAL_API_KEY}).json()
+        assert stats["startup"]["lock_wait_seconds"] > 0.1
+        wait_until(lambda: api.main.webhook_task.done())
+    assert calls(stub) == {"getWebhookInfo": 1, "setWebhook": 1}
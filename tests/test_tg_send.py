@@ -0,0 +1,108 @@
+"""
+Telegram 发送队列测试
+使用本地桩服务（tg_stub.py）代替 api.telegram.org
+
+运行: python -m pytest -q tests/test_tg_send.py
+"""
+import asyncio
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from api.tg_send import TelegramSender
+from conftest import reset_db
+
+@pytest.fixture
+def stub(stub_url):
+    httpx.post(f"{stub_url}/_stub/reset")
+    return stub_url
+
+def received(stub_url: str) -> list[dict]:
+    return httpx.get(f"{stub_url}/_stub/messages").json()
+
+def run_sender(stub_url: str, messages: list[tuple[int, str]], **options) -> None:
+    async def main():
+        sender = TelegramSender(api_url=stub_url, **options)
+        sender.start("TEST")
+        for chat_id, text in messages:
+            assert sender.enqueue(chat_id, {"text": text})
+        await asyncio.wait_for(sender.drain(), timeout=10)
+        await sender.stop()
+        assert sender.sent == len(messages) and sender.failed == 0
+    asyncio.run(main())
+
+def test_per_chat_order_and_interval(stub):
+    messages = [(-100, "a1"), (-200, "b1"), (-100, "a2"), (-100, "a3"), (-200, "b2")]
+    run_sender(stub, messages, group_interval=0.2)
+
+    got = received(stub)
+    assert [m["text"] for m in got if m["chat_id"] == -100] == ["a1", "a2", "a3"]
+    assert [m["text"] for m in got if m["chat_id"] == -200] == ["b1", "b2"]
+
+    # 同一个群的相邻消息至少间隔 group_interval，不同群互不阻塞
+    times = [m["at"] for m in got if m["chat_id"] == -100]
+    assert all(later - earlier >= 0.18 for earlier, later in zip(times, times[1:]))
+    assert [m["text"] for m in got][:2] == ["a1", "b1"]
+
+def test_retries_after_429(stub):
+    httpx.post(f"{stub}/_stub/config", json={"flood": {"-100": 1}, "retry_after": 1})
+    start = time.time()
+    run_sender(stub, [(-100, "hello"), (-300, "other")], group_interval=0.01)
+
+    got = {m["text"]: m["at"] - start for m in received(stub)}
+    assert got["hello"] >= 1.0
+    # 被限流的群不影响其他群
+    assert got["other"] < 1.0
+
+def test_settle_does_not_wait_for_telegram(stub, tmp_path, monkeypatch):
+    import api.db
+    import api.main
+
+    class FakeSession:
+        async def close(self): pass
+
+    class FakeBot:
+        def __init__(self, *args, **kwargs): self.session = FakeSession()
+        async def get_webhook_info(self): return type("WebhookInfo", (), {"url": ""})()
+        async def set_webhook(self, **kwargs): pass
+        async def delete_webhook(self, **kwargs): pass
+
+    monkeypatch.setattr(api.db, "DB_PATH", tmp_path / "tg.db")
+    monkeypatch.setattr(api.main, "_import_bot", lambda: (FakeBot(), None, None))
+    monkeypatch.setattr(api.main, "bot_loader", None)
+    monkeypatch.setattr(api.main, "BOT_TOKEN", "TEST")
+    monkeypatch.setattr(api.main.tg_sender, "api_url", stub)
+    monkeypatch.setattr(api.main.tg_sender, "group_interval", 0.1)
+    reset_db()
+    httpx.post(f"{stub}/_stub/config", json={"delay": 1.5})
+
+    host = {"user_id": 1, "username": "host"}
+    guest = {"user_id": 2, "username": "guest"}
+    with TestClient(api.main.app) as client:
+        room_id = client.post("/api/rooms", json={"user": host, "bet_amount": 10, "chat_id": -100}).json()["room_id"]
+
+        start = time.time()
+        assert client.post(f"/api/rooms/{room_id}/share", json={"user": host, "chat_id": -100}).status_code == 200
+        assert time.time() - start < 1.0
+
+        client.post(f"/api/rooms/{room_id}/join", json={"user": guest})
+        conn = sqlite3.connect(api.db.DB_PATH)
+        conn.execute(
+            "UPDATE rooms SET status='PLAYING', game_start_time=? WHERE room_id=?",
+            ((datetime.utcnow() - timedelta(seconds=40)).isoformat(), room_id)
+        )
+        conn.commit()
+        conn.close()
+
+        start = time.time()
+        assert client.post(f"/api/rooms/{room_id}/settle", json={"user": host}).status_code == 200
+        assert time.time() - start < 1.0
+        assert received(stub) == []
+    # 关闭时发完队列中的消息
+    texts = [m["text"] for m in received(stub)]
+    assert len(texts) == 2 and "游戏结束" in texts[1]
+    reset_db()
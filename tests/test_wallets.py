@@ -0,0 +1,56 @@
+"""
+余额缓存测试
+冻结、结算、过期退款提交后，GET /api/users/{user_id} 不会读到旧余额
+
+运行: python -m pytest -q tests/test_wallets.py
+"""
+import asyncio
+import sqlite3
+
+import api.db
+import api.main
+from api.wallets import wallets
+from conftest import GUEST, HOST, backdate
+
+def db_balance(user_id: int) -> tuple[int, int]:
+    conn = sqlite3.connect(api.db.DB_PATH)
+    row = conn.execute("SELECT available, frozen FROM users WHERE user_id=?", (user_id,)).fetchone()
+    conn.close()
+    return row
+
+def balance(client, user_id: int) -> tuple[int, int]:
+    user = client.get(f"/api/users/{user_id}").json()
+    return user["available"], user["frozen"]
+
+def test_cache_follows_settlement(client):
+    room_id = client.post("/api/rooms", json={"user": HOST, "bet_amount": 10}).json()["room_id"]
+    assert client.post(f"/api/rooms/{room_id}/join", json={"user": GUEST}).status_code == 200
+
+    # 冻结押注时已写入缓存
+    hits, misses = wallets.hits, wallets.misses
+    assert balance(client, HOST["user_id"]) == (990, 10) == db_balance(HOST["user_id"])
+    assert (wallets.hits, wallets.misses) == (hits + 1, misses)
+
+    for user in (HOST, GUEST):
+        assert client.post(f"/api/rooms/{room_id}/ready", json={"user": user}).status_code == 200
+    backdate("countdown_start_time", room_id, 5)
+    assert client.post(f"/api/rooms/{room_id}/start", json={"user": HOST}).status_code == 200
+    assert client.post(f"/api/rooms/{room_id}/click", json={"user": HOST}).status_code == 200
+    backdate("game_start_time", room_id, 40)
+    assert client.post(f"/api/rooms/{room_id}/settle", json={"user": HOST}).status_code == 200
+
+    hits = wallets.hits
+    assert balance(client, HOST["user_id"]) == (1010, 0) == db_balance(HOST["user_id"])
+    assert balance(client, GUEST["user_id"]) == (990, 0) == db_balance(GUEST["user_id"])
+    assert wallets.hits == hits + 2
+
+def test_expiry_invalidates_cache(client):
+    r = client.post("/api/rooms", json={"user": HOST, "bet_amount": 10})
+    assert balance(client, HOST["user_id"]) == (990, 10)
+
+    backdate("expires_at", r.json()["room_id"], 60)
+    assert asyncio.run(api.main.cleanup_expired_rooms()) == 1
+
+    misses = wallets.misses
+    assert balance(client, HOST["user_id"]) == (1000, 0) == db_balance(HOST["user_id"])
+    assert wallets.misses == misses + 1
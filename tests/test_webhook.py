@@ -0,0 +1,76 @@
+"""
+Webhook 更新队列测试
+按 update_id 去重；队列满时返回 503 让 Telegram 重试；没有启动队列（未配置 BOT_TOKEN）时返回 404
+
+运行: python -m pytest -q tests/test_webhook.py
+"""
+import asyncio
+
+import api.main
+from api.webhook import UpdateQueue
+
+def update(update_id: int) -> dict:
+    return {"update_id": update_id, "message": {"text": f"#{update_id}"}}
+
+class Handler:
+    """记录处理过的 update_id；gate 打开之前 worker 停在第一个更新上"""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.handled: list[int] = []
+
+    async def __call__(self, data: dict) -> None:
+        await self.gate.wait()
+        self.handled.append(data["update_id"])
+
+def test_dedup_and_backpressure():
+    async def main():
+        handler = Handler()
+        queue = UpdateQueue(size=2, workers=1)
+        queue.start(handler)
+
+        assert queue.submit(update(1))
+        await asyncio.sleep(0)  # worker 取走 1，停在 gate
+        assert queue.submit(update(2)) and queue.submit(update(3))
+        # Telegram 重试投递已入队的更新：直接确认，不重复处理
+        assert queue.submit(update(2))
+        # 队列已满：拒绝，不记入去重窗口，重试时还能入队
+        assert not queue.submit(update(4))
+        assert queue.snapshot()["depth"] == 2
+
+        handler.gate.set()
+        await queue.stop()
+        assert handler.handled == [1, 2, 3]
+        assert (queue.stats["received"], queue.stats["duplicates"], queue.stats["rejected"]) == (5, 1, 1)
+        return queue
+
+    queue = asyncio.run(main())
+    assert queue.stats["processed"] == 3 and queue.stats["max_depth"] == 2
+
+def test_webhook_route(client, run, monkeypatch):
+    # 没有启动队列：与队列已满区分开
+    r = client.post(api.main.WEBHOOK_PATH, json=update(1))
+    assert (r.status_code, r.json()) == (404, {"ok": False, "error": "Webhook disabled"})
+
+    handler = Handler()
+    queue = UpdateQueue(size=1, workers=1)
+    monkeypatch.setattr(api.main, "webhook_updates", queue)
+
+    async def scenario(client):
+        queue.start(handler)
+        post = lambda data: client.post(api.main.WEBHOOK_PATH, json=data)
+        assert (await post(update(1))).json() == {"ok": True}
+        await asyncio.sleep(0)
+        assert (await post(update(2))).status_code == 200
+        r = await post(update(3))
+        assert (r.status_code, r.json()) == (503, {"ok": False, "error": "Webhook queue is full"})
+        assert (await post(update(1))).status_code == 200
+
+        handler.gate.set()
+        await asyncio.sleep(0.05)
+        # 队列有空位后 Telegram 重试的更新被接受
+        assert (await post(update(3))).status_code == 200
+        await queue.stop()
+
+    run(scenario)
+    assert handler.handled == [1, 2, 3]
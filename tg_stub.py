@@ -0,0 +1,91 @@
+"""
+本地 Telegram Bot API 桩服务 - 用于测试和压测，不会真的发消息
+记录所有 sendMessage 请求，可以让指定会话返回 429 来模拟限流
+
+用法:
+    python tg_stub.py --port 8081
+    TELEGRAM_API_URL=http://127.0.0.1:8081 python -m uvicorn api.main:app
+
+控制接口:
+    GET  /_stub/messages   已收到的消息（含接收时间）
+    GET  /_stub/calls      sendMessage 以外的方法调用次数（如 {"setWebhook": 1}）
+    POST /_stub/config     {"flood": {"<chat_id>": 次数}, "retry_after": 秒, "delay": 秒,
+                            "webhook_url": getWebhookInfo 返回的地址}
+    POST /_stub/reset      清空消息和配置
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Telegram Bot API stub")
+
+state = {
+    "messages": [],
+    "flood": {},       # chat_id -> 剩余需要返回 429 的次数
+    "retry_after": 1,
+    "delay": 0.0,      # 每个请求的响应延迟（秒）
+    "webhook_url": "",
+    "calls": {},
+}
+
+@app.get("/_stub/messages")
+def messages():
+    return state["messages"]
+
+@app.get("/_stub/calls")
+def calls():
+    return state["calls"]
+
+@app.post("/_stub/config")
+async def config(request: Request):
+    body = await request.json()
+    if "flood" in body:
+        state["flood"] = {int(chat_id): n for chat_id, n in body["flood"].items()}
+    for key in ("retry_after", "delay", "webhook_url"):
+        if key in body:
+            state[key] = body[key]
+    return {"ok": True}
+
+@app.post("/_stub/reset")
+def reset():
+    state.update(messages=[], flood={}, retry_after=1, delay=0.0, webhook_url="", calls={})
+    return {"ok": True}
+
+@app.post("/bot{token}/sendMessage")
+async def send_message(token: str, request: Request):
+    body = await request.json()
+    if state["delay"]:
+        await asyncio.sleep(state["delay"])
+
+    chat_id = int(body["chat_id"])
+    if state["flood"].get(chat_id, 0) > 0:
+        state["flood"][chat_id] -= 1
+        return JSONResponse(status_code=429, content={
+            "ok": False,
+            "error_code": 429,
+            "description": f"Too Many Requests: retry after {state['retry_after']}",
+            "parameters": {"retry_after": state["retry_after"]},
+        })
+
+    state["messages"].append({"chat_id": chat_id, "text": body.get("text"), "at": time.time(), "http_version": request.scope.get("http_version")})
+    return {"ok": True, "result": {"message_id": len(state["messages"]), "chat": {"id": chat_id}, "text": body.get("text")}}
+
+@app.post("/bot{token}/{method}")
+async def other_method(token: str, method: str):
+    state["calls"][method] = state["calls"].get(method, 0) + 1
+    if method == "getWebhookInfo":
+        return {"ok": True, "result": {"url": state["webhook_url"], "has_custom_certificate": False, "pending_update_count": 0}}
+    # setWebhook / deleteWebhook 等其他方法直接返回成功
+    return {"ok": True, "result": True}
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Telegram Bot API 桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port)